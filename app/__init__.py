@@ -1,14 +1,32 @@
 import os
 
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
 from flask import Flask
 from flask_bootstrap import Bootstrap
-from flask_login import LoginManager
+from flask_login import LoginManager, current_user
 from flask_mail import Mail
 from flask_pymodm import PyModm
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from app.epg.catchup_planner import CatchupPlanner
+from app.epg.merger import XmltvMerger
+from app.epg.programme_store import ProgrammeStore
+from app.logo.mirror import LogoMirror
+from app.logo.validator import LogoValidator
+from app.service.circuit_breaker import RestartBreaker
+from app.service.http_pool import HttpPool
+from app.service.log_index import LogSearchIndex
+from app.service.log_store import LogStore
+from app.service.output_monitor import OutputMonitor
+from app.service.placement import PlacementEngine
+from app.service.service import Service, ServiceFields
 from app.service.service_manager import ServiceManager
+from app.service.source_prober import SourceProber
+from app.service.start_scheduler import StartScheduler
+from app.service.upload_spool import SpoolingRequest, UploadMetrics
+from app.service.wire_format import WireFormat, CompactSchema
 
 
 def get_app_folder():
@@ -23,10 +41,22 @@ def get_runtime_stream_folder():
     return os.path.join(get_runtime_folder(), 'stream')
 
 
+def get_logs_folder():
+    return os.path.join(get_runtime_folder(), 'logs')
+
+
 def get_epg_tmp_folder():
     return os.path.join(get_runtime_folder(), 'epg')
 
 
+def get_epg_output_folder():
+    return os.path.join(get_runtime_folder(), 'epg_out')
+
+
+def get_logo_mirror_folder():
+    return os.path.join(get_runtime_folder(), 'logo')
+
+
 def init_project(static_folder, *args):
     runtime_folder = get_runtime_folder()
     if not os.path.exists(runtime_folder):
@@ -45,23 +75,79 @@ def init_project(static_folder, *args):
         _app.config.from_pyfile(file, silent=False)
 
     _app.wsgi_app = ProxyFix(_app.wsgi_app)
+    # uploads are spooled to disk above UPLOAD_SPOOL_THRESHOLD instead of being held in memory
+    _app.request_class = SpoolingRequest
+    _app.extensions[UploadMetrics.EXTENSION_NAME] = UploadMetrics()
     Bootstrap(_app)
     _db = PyModm(_app)
     _mail = Mail(_app)
-    _socketio = SocketIO(_app, async_mode='gevent')
+    # http_compression/compression_threshold apply to the polling transport, gevent-websocket has no
+    # permessage-deflate support, clients that need small frames should negotiate the compact wire format
+    _socketio = SocketIO(_app, async_mode='gevent', http_compression=True,
+                         compression_threshold=_app.config.get('SOCKETIO_COMPRESSION_THRESHOLD', 1024))
     _login_manager = LoginManager(_app)
 
     _login_manager.login_view = 'HomeView:signin'
 
     # socketio
+    def find_subscription_rooms(data: dict) -> list:
+        if not current_user.is_authenticated or not isinstance(data, dict):
+            return []
+
+        wire_format = data.get('format', WireFormat.JSON)
+        if wire_format not in WireFormat.ALL:
+            return []
+
+        sid = data.get('service_id')
+        settings = None
+        for server_settings in current_user.servers:
+            if server_settings and str(server_settings.id) == sid:
+                settings = server_settings
+                break
+
+        if not settings:
+            return []
+
+        rooms = [Service.get_service_room(settings.id, wire_format)]
+        stream_ids = data.get('streams')
+        if not stream_ids:
+            rooms.append(Service.get_service_streams_room(settings.id, wire_format))
+            return rooms
+
+        server = _servers_manager.find_or_create_server(settings)
+        for stream_id in stream_ids:
+            try:
+                stream = server.find_stream_by_id(ObjectId(stream_id))
+            except (InvalidId, TypeError):
+                continue
+
+            if stream:
+                rooms.append(Service.get_stream_room(stream.id, wire_format))
+        return rooms
+
     @_socketio.on('connect')
     def connect():
-        pass
+        if not current_user.is_authenticated:
+            return False
 
     @_socketio.on('disconnect')
     def disconnect():
         pass
 
+    @_socketio.on('subscribe')
+    def subscribe(data):
+        rooms = find_subscription_rooms(data)
+        if rooms and data.get('format') == WireFormat.COMPACT:
+            emit('wire_schema', CompactSchema.to_dict(ServiceFields.ALL))
+
+        for room in rooms:
+            join_room(room)
+
+    @_socketio.on('unsubscribe')
+    def unsubscribe(data):
+        for room in find_subscription_rooms(data):
+            leave_room(room)
+
     # defaults flask
     _host = '0.0.0.0'
     _port = 8080
@@ -73,12 +159,121 @@ def init_project(static_folder, *args):
 
     host = sn_host or _host
     port = int(sn_port or _port)
-    _servers_manager = ServiceManager(host, port, _socketio)
+    start_options = {'concurrency': _app.config.get('START_CONCURRENCY', StartScheduler.DEFAULT_CONCURRENCY),
+                     'rate': _app.config.get('START_RATE', StartScheduler.DEFAULT_RATE),
+                     'start_timeout': _app.config.get('START_TIMEOUT', StartScheduler.DEFAULT_START_TIMEOUT),
+                     'priority_groups': _app.config.get('START_PRIORITY_GROUPS', [])}
+    breaker_options = {'window': _app.config.get('BREAKER_WINDOW', RestartBreaker.DEFAULT_WINDOW),
+                       'max_restarts': _app.config.get('BREAKER_MAX_RESTARTS', RestartBreaker.DEFAULT_MAX_RESTARTS),
+                       'backoff': _app.config.get('BREAKER_BACKOFF', RestartBreaker.DEFAULT_BACKOFF),
+                       'max_backoff': _app.config.get('BREAKER_MAX_BACKOFF', RestartBreaker.DEFAULT_MAX_BACKOFF)}
+    node_bandwidth = _app.config.get('PLACEMENT_NODE_BANDWIDTH', PlacementEngine.DEFAULT_NODE_BANDWIDTH)
+    _servers_manager = ServiceManager(host, port, _socketio, node_bandwidth, start_options, breaker_options)
+
+    # logs uploaded by nodes
+    generations = _app.config.get('LOG_STORE_GENERATIONS', LogStore.DEFAULT_GENERATIONS)
+    max_size = _app.config.get('LOG_STORE_MAX_SIZE', LogStore.DEFAULT_MAX_SIZE)
+    # every store has a folder of its own, runtime_folder holds other data too
+    _stream_logs = LogStore(os.path.join(get_logs_folder(), 'stream'), generations, max_size)
+    _service_logs = LogStore(os.path.join(get_logs_folder(), 'service'), generations, max_size)
+    _stream_logs.import_legacy(runtime_stream_folder)
+    _service_logs.import_legacy(runtime_folder)
+    log_stores = {'stream': _stream_logs, 'service': _service_logs}
+
+    def make_log_tail_notifier(store_name: str):
+        def notify(key: str, path: str, entry: dict):
+            offset, data = LogStore.read_appended(path, entry)
+            _socketio.emit('log_appended', {'type': store_name, 'key': key, 'offset': offset,
+                                            'reset': not entry[LogStore.APPENDED_FROM_FIELD],
+                                            'data': data.decode('utf-8', 'replace')},
+                           room=LogStore.get_room(store_name, key))
+
+        return notify
+
+    for name, store in log_stores.items():
+        store.add_listener(make_log_tail_notifier(name))
+
+    # pipeline dumps share the stream store ('<sid>_pipeline' keys) and are not worth indexing
+    index_max_tokens = _app.config.get('LOG_INDEX_MAX_TOKENS', LogSearchIndex.DEFAULT_MAX_TOKENS)
+    _stream_logs_index = LogSearchIndex(_stream_logs, index_max_tokens, '_pipeline',
+                                        _app.config.get('LOG_SEARCH_MAX_SCAN', LogSearchIndex.DEFAULT_MAX_SCAN))
+    _stream_logs.add_listener(_stream_logs_index.on_ingested)
+
+    # outgoing http checks (stream sources) run in a bounded thread pool
+    _http_pool = HttpPool(_app.config.get('HTTP_POOL_SIZE', HttpPool.DEFAULT_SIZE),
+                          _app.config.get('HTTP_POOL_TIMEOUT', HttpPool.DEFAULT_TIMEOUT))
+    _source_prober = SourceProber(_http_pool, _app.config.get('SOURCE_PROBE_TTL', SourceProber.DEFAULT_TTL))
+    _logo_validator = LogoValidator(_http_pool, _app.config.get('LOGO_VALIDATION_TTL', LogoValidator.DEFAULT_TTL),
+                                    _app.config.get('LOGO_VALIDATION_NEGATIVE_TTL', LogoValidator.DEFAULT_NEGATIVE_TTL),
+                                    timeout=_app.config.get('LOGO_VALIDATION_TIMEOUT', LogoValidator.DEFAULT_TIMEOUT))
+    _output_monitor = OutputMonitor(_http_pool, _servers_manager.get_servers,
+                                    _app.config.get('OUTPUT_MONITOR_INTERVAL', OutputMonitor.DEFAULT_INTERVAL),
+                                    _app.config.get('OUTPUT_MONITOR_STALE_AFTER', OutputMonitor.DEFAULT_STALE_AFTER))
+    _logo_mirror = LogoMirror(get_logo_mirror_folder(), _http_pool,
+                              _app.config.get('LOGO_MIRROR_SIZES', LogoMirror.DEFAULT_SIZES),
+                              _app.config.get('LOGO_MIRROR_MAX_SIZE', LogoMirror.DEFAULT_MAX_SIZE),
+                              _app.config.get('LOGO_MIRROR_REFRESH', LogoMirror.DEFAULT_REFRESH),
+                              enabled=_app.config.get('LOGO_MIRROR_ENABLED', True),
+                              public_url=_app.config.get('LOGO_MIRROR_PUBLIC_URL', ''))
+    # cached playlists still point to the original logos
+    _logo_mirror.add_listener(_servers_manager.playlist_cache.clear)
+    _epg_store = ProgrammeStore(_app.config.get('EPG_BATCH_SIZE', ProgrammeStore.DEFAULT_BATCH_SIZE),
+                                _app.config.get('EPG_KEEP_PAST', ProgrammeStore.DEFAULT_KEEP_PAST))
+    _catchup_planner = CatchupPlanner(_epg_store, _servers_manager.find_server_by_id,
+                                      _app.config.get('CATCHUP_PLANNER_INTERVAL', CatchupPlanner.DEFAULT_INTERVAL),
+                                      _app.config.get('CATCHUP_HORIZON', CatchupPlanner.DEFAULT_HORIZON),
+                                      _app.config.get('CATCHUP_KEEP', CatchupPlanner.DEFAULT_KEEP))
+    _epg_merger = XmltvMerger(get_epg_output_folder(), _app.config.get('EPG_OUTPUT_TTL', XmltvMerger.DEFAULT_TTL),
+                              _app.config.get('EPG_OUTPUT_KEEP_PAST', XmltvMerger.DEFAULT_KEEP_PAST))
+
+    def find_log_room(data: dict):
+        if not current_user.is_authenticated or not isinstance(data, dict):
+            return None
+
+        store_name = data.get('type')
+        key = data.get('key')
+        if store_name not in log_stores or not LogStore.is_valid_key(key):
+            return None
+
+        # service logs are keyed by service id, stream logs by stream id with an optional '_pipeline' suffix,
+        # both have to belong to the user like in find_subscription_rooms
+        oid = key.split('_', 1)[0]
+        for server_settings in current_user.servers:
+            if not server_settings:
+                continue
+
+            if store_name == 'service':
+                if str(server_settings.id) == oid:
+                    return LogStore.get_room(store_name, key)
+                continue
+
+            server = _servers_manager.find_or_create_server(server_settings)
+            try:
+                if server.find_stream_by_id(ObjectId(oid)):
+                    return LogStore.get_room(store_name, key)
+            except (InvalidId, TypeError):
+                return None
+        return None
+
+    @_socketio.on('subscribe_log')
+    def subscribe_log(data):
+        room = find_log_room(data)
+        if room:
+            join_room(room)
+
+    @_socketio.on('unsubscribe_log')
+    def unsubscribe_log(data):
+        room = find_log_room(data)
+        if room:
+            leave_room(room)
 
-    return _app, _mail, _login_manager, _servers_manager, _db
+    return _app, _mail, _login_manager, _servers_manager, _db, _stream_logs, _service_logs, _stream_logs_index, \
+           _http_pool, _source_prober, _output_monitor, _logo_validator, _logo_mirror, _epg_store, _catchup_planner, \
+           _epg_merger
 
 
-app, mail, login_manager, servers_manager, db = init_project(
+app, mail, login_manager, servers_manager, db, stream_logs, service_logs, stream_logs_index, http_pool, \
+source_prober, output_monitor, logo_validator, logo_mirror, epg_store, catchup_planner, epg_merger = init_project(
     'static',
     'config/public_config.py',
     'config/config.py',
@@ -93,6 +288,7 @@ from app.service.view import ServiceView
 from app.subscriber.view import SubscriberView
 from app.autofill.view import M3uParseStreamsView, M3uParseVodsView
 from app.epg.view import EpgView
+from app.logo.view import LogoView
 
 HomeView.register(app)
 ProviderView.register(app)
@@ -102,3 +298,4 @@ SubscriberView.register(app)
 M3uParseStreamsView.register(app)
 M3uParseVodsView.register(app)
 EpgView.register(app)
+LogoView.register(app)
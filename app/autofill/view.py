@@ -2,11 +2,14 @@ import pyfastocloud_models.constants as constants
 from flask import request, jsonify, render_template, redirect, url_for
 from flask_classy import FlaskView, route
 from flask_login import login_required
-from pyfastocloud_models.utils.m3u_parser import M3uParser
-from pyfastocloud_models.utils.utils import is_valid_http_url
 
+from app import logo_validator
 from app.autofill.entry import M3uParseStreams, M3uParseVods
 from app.common.service.forms import UploadM3uForm
+from app.service.playlist_reader import iterate_m3u_batches
+from app.service.upload_spool import open_upload
+
+UPLOAD_BATCH_SIZE = 1000
 
 
 # routes
@@ -37,34 +40,33 @@ class M3uParseStreamsView(FlaskView):
         if form.validate_on_submit():
             files = request.files.getlist("files")
             for file in files:
-                m3u_parser = M3uParser()
-                data = file.read().decode('utf-8')
-                m3u_parser.load_content(data)
-                m3u_parser.parse()
-
-                for entry in m3u_parser.files:
-                    title = entry['title']
-                    if len(title) > constants.MAX_STREAM_NAME_LENGTH:
-                        continue
-
-                    line = M3uParseStreams.get_by_name(name=title)
-                    if not line:
-                        line = M3uParseStreams(name=title)
-
-                    tvg_id = entry['tvg-id']
-                    if len(tvg_id) and len(tvg_id) < constants.MAX_STREAM_TVG_ID_LENGTH:
-                        line.tvg_id.append(tvg_id)
-
-                    tvg_group = entry['tvg-group']
-                    if tvg_group:
-                        line.group.append(tvg_group)
-
-                    tvg_logo = entry['tvg-logo']
-                    if len(tvg_logo) and len(tvg_logo) < constants.MAX_URI_LENGTH:
-                        if is_valid_http_url(tvg_logo, timeout=0.1):
-                            line.tvg_logo.append(tvg_logo)
-
-                    line.save()
+                with open_upload(file) as reader:
+                    for entries in iterate_m3u_batches(reader, UPLOAD_BATCH_SIZE):
+                        valid_logos = logo_validator.validate(
+                            [entry.tvg_logo for entry in entries if len(entry.tvg_logo) < constants.MAX_URI_LENGTH])
+                        for entry in entries:
+                            title = entry.title
+                            if not title or len(title) > constants.MAX_STREAM_NAME_LENGTH:
+                                continue  # bare urls have no name to fill streams from
+
+                            line = M3uParseStreams.get_by_name(name=title)
+                            if not line:
+                                line = M3uParseStreams(name=title)
+
+                            tvg_id = entry.tvg_id
+                            if len(tvg_id) and len(tvg_id) < constants.MAX_STREAM_TVG_ID_LENGTH:
+                                line.tvg_id.append(tvg_id)
+
+                            tvg_group = entry.tvg_group
+                            if tvg_group:
+                                line.group.append(tvg_group)
+
+                            tvg_logo = entry.tvg_logo
+                            if len(tvg_logo) and len(tvg_logo) < constants.MAX_URI_LENGTH:
+                                if tvg_logo in valid_logos:
+                                    line.tvg_logo.append(tvg_logo)
+
+                            line.save()
 
         return redirect(url_for('M3uParseStreamsView:show'))
 
@@ -103,30 +105,29 @@ class M3uParseVodsView(FlaskView):
         if form.validate_on_submit():
             files = request.files.getlist("files")
             for file in files:
-                m3u_parser = M3uParser()
-                data = file.read().decode('utf-8')
-                m3u_parser.load_content(data)
-                m3u_parser.parse()
-
-                for entry in m3u_parser.files:
-                    title = entry['title']
-                    if len(title) > constants.MAX_STREAM_NAME_LENGTH:
-                        continue
-
-                    line = M3uParseVods.get_by_name(title)
-                    if not line:
-                        line = M3uParseVods(name=title)
-
-                    tvg_group = entry['tvg-group']
-                    if tvg_group:
-                        line.group.append(tvg_group)
-
-                    tvg_logo = entry['tvg-logo']
-                    if len(tvg_logo) and len(tvg_logo) < constants.MAX_URI_LENGTH:
-                        if is_valid_http_url(tvg_logo, timeout=0.1):
-                            line.tvg_logo.append(tvg_logo)
-
-                    line.save()
+                with open_upload(file) as reader:
+                    for entries in iterate_m3u_batches(reader, UPLOAD_BATCH_SIZE):
+                        valid_logos = logo_validator.validate(
+                            [entry.tvg_logo for entry in entries if len(entry.tvg_logo) < constants.MAX_URI_LENGTH])
+                        for entry in entries:
+                            title = entry.title
+                            if not title or len(title) > constants.MAX_STREAM_NAME_LENGTH:
+                                continue  # bare urls have no name to fill streams from
+
+                            line = M3uParseVods.get_by_name(title)
+                            if not line:
+                                line = M3uParseVods(name=title)
+
+                            tvg_group = entry.tvg_group
+                            if tvg_group:
+                                line.group.append(tvg_group)
+
+                            tvg_logo = entry.tvg_logo
+                            if len(tvg_logo) and len(tvg_logo) < constants.MAX_URI_LENGTH:
+                                if tvg_logo in valid_logos:
+                                    line.tvg_logo.append(tvg_logo)
+
+                            line.save()
 
         return redirect(url_for('M3uParseVodsView:show'))
 
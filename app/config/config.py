@@ -7,3 +7,44 @@ SUBSCRIBERS_SUPPORT = False
 EPG_SUPPORT = False
 META_SUPPORT = False
 EPG_IN_DIRECTORY = '~/epg/in'
+SOCKETIO_COMPRESSION_THRESHOLD = 1024
+LOG_STORE_GENERATIONS = 5
+LOG_STORE_MAX_SIZE = 64 * 1024 * 1024
+LOGS_DELIVERY = 'python'
+LOGS_ACCEL_LOCATION = '/runtime_folder/'
+LOG_INDEX_MAX_TOKENS = 500000
+LOG_SEARCH_MAX_SCAN = 64 * 1024 * 1024
+AUTO_PLACEMENT = False
+PLACEMENT_NODE_BANDWIDTH = 1024 * 1024 * 1024 // 8
+START_CONCURRENCY = 8
+START_RATE = 2.0
+START_TIMEOUT = 30
+START_PRIORITY_GROUPS = []
+BREAKER_WINDOW = 300
+BREAKER_MAX_RESTARTS = 5
+BREAKER_BACKOFF = 60
+BREAKER_MAX_BACKOFF = 3600
+HTTP_POOL_SIZE = 32
+HTTP_POOL_TIMEOUT = 5
+SOURCE_PROBE_TTL = 60
+OUTPUT_MONITOR_INTERVAL = 30
+OUTPUT_MONITOR_STALE_AFTER = 30
+LOGO_VALIDATION_TTL = 24 * 3600
+LOGO_VALIDATION_NEGATIVE_TTL = 3600
+LOGO_VALIDATION_TIMEOUT = 2
+LOGO_MIRROR_ENABLED = True
+LOGO_MIRROR_SIZES = [64, 256]
+LOGO_MIRROR_MAX_SIZE = 2 * 1024 * 1024
+LOGO_MIRROR_REFRESH = 7 * 24 * 3600
+LOGO_MIRROR_PUBLIC_URL = ''
+EPG_INGEST = True
+EPG_BATCH_SIZE = 1000
+EPG_KEEP_PAST = 7 * 24 * 3600
+CATCHUP_PLANNER_INTERVAL = 60
+CATCHUP_HORIZON = 24 * 3600
+CATCHUP_KEEP = 7 * 24 * 3600
+EPG_OUTPUT_TTL = 3600
+EPG_OUTPUT_KEEP_PAST = 24 * 3600
+MAX_CONTENT_LENGTH = 512 * 1024 * 1024
+UPLOAD_MAX_FILE_SIZE = 256 * 1024 * 1024
+UPLOAD_SPOOL_THRESHOLD = 1024 * 1024
@@ -0,0 +1,152 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import gevent
+import pyfastocloud_models.constants as constants
+from bson.objectid import ObjectId
+from pymongo.errors import PyMongoError
+
+from app.epg.entry import CatchupPlan
+from app.epg.programme_store import ProgrammeStore
+
+
+def _utc_to_local(value: datetime) -> datetime:
+    # catchup windows are compared with datetime.now()
+    return value.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+
+class CatchupPlanner(object):
+    DEFAULT_INTERVAL = 60
+    DEFAULT_HORIZON = 24 * 3600
+    DEFAULT_KEEP = 7 * 24 * 3600
+    # the next batch is planned when less than this is left of the previous one
+    PLAN_AHEAD = 3600
+    NAME_TEMPLATE_2S = '{0}: {1}'
+
+    def __init__(self, store: ProgrammeStore, find_service, interval=DEFAULT_INTERVAL, horizon=DEFAULT_HORIZON,
+                 keep=DEFAULT_KEEP):
+        # find_service(sid) returns the Service of a plan, recordings of the next horizon seconds are created in one
+        # batch per channel, expired ones are removed in one batch as well
+        self._store = store
+        self._find_service = find_service
+        self._interval = interval
+        self._horizon = horizon
+        self._keep = keep
+        self._stop_listen = False
+
+    def stop(self):
+        self._stop_listen = True
+
+    def run(self):
+        while not self._stop_listen and self._interval > 0:
+            started = time.time()
+            try:
+                self.check()
+            except PyMongoError as ex:
+                logging.warning('Catchup planning failed: %s', str(ex))
+            gevent.sleep(max(self._interval - (time.time() - started), 1))
+
+    def check(self):
+        plans = {}
+        for plan in CatchupPlan.objects.all():
+            plans.setdefault(plan.service, []).append(plan)
+
+        for sid, service_plans in plans.items():
+            service = self._find_service(sid)
+            if not service:
+                continue
+
+            for plan in service_plans:
+                self.collect_garbage(service, plan)
+                self.generate(service, plan)
+            service.start_due_catchups()
+
+    def get_plans(self, service) -> list:
+        return list(CatchupPlan.objects.raw({'service': service.id}))
+
+    def enable(self, service, stream_ids: list, keep=None) -> int:
+        enabled = 0
+        for sid in stream_ids:
+            stream = service.find_stream_by_id(ObjectId(sid))
+            if not stream or not stream.stream().tvg_id or stream.type == constants.StreamType.CATCHUP:
+                continue
+
+            # enabling twice only changes keep, already planned programmes are not duplicated
+            plans = list(CatchupPlan.objects.raw({'_id': stream.id}))
+            plan = plans[0] if plans else CatchupPlan(stream=stream.id, service=service.id)
+            plan.keep = keep or plan.keep or self._keep
+            plan.save()
+            self.generate(service, plan)
+            enabled += 1
+        return enabled
+
+    def disable(self, service, stream_ids: list, remove=False) -> int:
+        # planned recordings are kept unless remove is set
+        disabled = 0
+        for plan in CatchupPlan.objects.raw({'_id': {'$in': [ObjectId(sid) for sid in stream_ids]},
+                                             'service': service.id}):
+            if remove:
+                channel = service.find_stream_by_id(plan.stream)
+                if channel:
+                    service.remove_catchups(channel, CatchupPlanner.__get_catchup_ids(service, channel))
+            plan.delete()
+            disabled += 1
+        return disabled
+
+    def generate(self, service, plan: CatchupPlan) -> int:
+        channel = service.find_stream_by_id(plan.stream)
+        if not channel:
+            return 0
+
+        original = channel.stream()
+        now = datetime.utcnow()
+        if plan.generated_until and plan.generated_until > now + timedelta(seconds=CatchupPlanner.PLAN_AHEAD):
+            return 0
+
+        start = max(plan.generated_until or now, now)
+        stop = now + timedelta(seconds=self._horizon)
+        source = original.output[0].uri if original.output else None
+        catchups = []
+        for programme in self._store.iterate_programmes(original.tvg_id, start, stop):
+            # programmes already running are not recorded
+            if not source or programme['start'] < start:
+                continue
+
+            catchup = service.make_catchup_stream().stream()
+            name = CatchupPlanner.NAME_TEMPLATE_2S.format(original.name, programme.get('title') or '')
+            catchup.name = name[:constants.MAX_STREAM_NAME_LENGTH - 1]
+            catchup.tvg_id = original.tvg_id
+            catchup.tvg_logo = original.tvg_logo
+            catchup.input[0].uri = source
+            catchup.start = _utc_to_local(programme['start'])
+            catchup.stop = _utc_to_local(programme['stop'])
+            catchups.append(catchup)
+
+        service.add_catchups(channel, catchups)
+        plan.generated_until = stop
+        plan.save()
+        return len(catchups)
+
+    def collect_garbage(self, service, plan: CatchupPlan) -> int:
+        channel = service.find_stream_by_id(plan.stream)
+        if not channel:
+            # the channel is gone, so is the plan
+            plan.delete()
+            return 0
+
+        limit = _utc_to_local(datetime.utcnow() - timedelta(seconds=plan.keep))
+        expired = CatchupPlanner.__get_catchup_ids(service, channel, limit)
+        service.remove_catchups(channel, expired)
+        return len(expired)
+
+    # private
+    @staticmethod
+    def __get_catchup_ids(service, channel, ended_before=None) -> list:
+        parts = set(part.id for part in channel.stream().parts if part)
+        ids = []
+        for stream in service.get_streams():
+            if stream.id in parts and stream.type == constants.StreamType.CATCHUP:
+                if ended_before is None or stream.stream().stop < ended_before:
+                    ids.append(stream.id)
+        return ids
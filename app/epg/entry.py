@@ -1,5 +1,6 @@
 import pyfastocloud_models.constants as constants
 from pymodm import MongoModel, fields
+from pymongo import ASCENDING, IndexModel
 
 
 class Epg(MongoModel):
@@ -15,3 +16,42 @@ class Epg(MongoModel):
 
     uri = fields.CharField(default='http://0.0.0.0/epg.xml', max_length=constants.MAX_URI_LENGTH, required=True)
     extension = fields.CharField(max_length=5, required=False)
+
+
+class EpgChannel(MongoModel):
+    class Meta:
+        collection_name = 'epg_channel'
+        indexes = [IndexModel([('channel', ASCENDING), ('source', ASCENDING)], unique=True)]
+
+    channel = fields.CharField(required=True)  # xmltv channel id, matched with stream tvg_id
+    source = fields.CharField(required=True)  # id of the Epg it was loaded from
+    display_names = fields.ListField(fields.CharField(), default=[])
+    icon = fields.CharField(max_length=constants.MAX_URI_LENGTH, required=False)
+    updated = fields.DateTimeField(required=True)
+
+
+class EpgProgramme(MongoModel):
+    class Meta:
+        collection_name = 'epg_programme'
+        indexes = [IndexModel([('channel', ASCENDING), ('start', ASCENDING)]),
+                   IndexModel([('source', ASCENDING), ('channel', ASCENDING), ('start', ASCENDING)], unique=True),
+                   IndexModel([('stop', ASCENDING)])]
+
+    channel = fields.CharField(required=True)
+    source = fields.CharField(required=True)
+    start = fields.DateTimeField(required=True)  # utc
+    stop = fields.DateTimeField(required=True)  # utc
+    title = fields.CharField(required=False)
+    description = fields.CharField(required=False)
+    categories = fields.ListField(fields.CharField(), default=[])
+    updated = fields.DateTimeField(required=True)
+
+
+class CatchupPlan(MongoModel):
+    class Meta:
+        collection_name = 'catchup_plan'
+
+    stream = fields.ObjectIdField(primary_key=True)  # recorded channel, programmes are found by its tvg_id
+    service = fields.ObjectIdField(required=True)
+    keep = fields.IntegerField(required=True)  # seconds recordings are kept after they end
+    generated_until = fields.DateTimeField(required=False)  # utc, programmes starting earlier are planned
@@ -0,0 +1,125 @@
+import math
+import re
+import unicodedata
+
+from app.epg.entry import EpgChannel
+
+# quality and codec marks say nothing about the channel
+NOISE_TOKENS = {'hd', 'fhd', 'uhd', 'sd', '4k', '8k', 'hevc', 'h264', 'h265', '720p', '1080p', '2160p', 'backup',
+                'raw', 'live'}
+TOKEN_SPLIT_PATTERN = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_tokens(text: str) -> tuple:
+    # 'BBC One HD' and 'bbc.one' give the same tokens
+    if not text:
+        return ()
+
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return tuple(token for token in TOKEN_SPLIT_PATTERN.split(text) if token and token not in NOISE_TOKENS)
+
+
+class MatchFields:
+    ID = 'id'
+    NAME = 'name'
+    CURRENT = 'current'
+    SUGGESTED = 'suggested'
+    CONFIDENCE = 'confidence'
+
+
+class ChannelMatcher(object):
+    EXACT_ID_CONFIDENCE = 1.0
+    EXACT_NAME_CONFIDENCE = 0.95
+    # token matches never reach exact ones
+    TOKEN_CONFIDENCE_SCALE = 0.9
+    DEFAULT_MIN_CONFIDENCE = 0.5
+    CONTAINED_SCORE = 0.8
+
+    def __init__(self, channels: list):
+        # channels are (channel id, display names) pairs, names and ids are indexed by their normalized tokens
+        self._ids = set()
+        self._by_name = {}  # joined tokens -> channel ids
+        self._by_token = {}  # token -> channel ids
+        self._names = {}  # channel id -> token sets
+        for channel, names in channels:
+            self._ids.add(channel)
+            for name in [channel] + list(names):
+                tokens = normalize_tokens(name)
+                if not tokens:
+                    continue
+
+                self._by_name.setdefault(' '.join(tokens), set()).add(channel)
+                self._names.setdefault(channel, set()).add(frozenset(tokens))
+                for token in tokens:
+                    self._by_token.setdefault(token, set()).add(channel)
+
+        count = max(len(self._ids), 1)
+        self._idf = {token: math.log(1 + count / len(ids)) for token, ids in self._by_token.items()}
+
+    @classmethod
+    def load(cls, sources=None):
+        # every epg channel, or the ones of the given Epg ids
+        query = {'source': {'$in': sources}} if sources else {}
+        channels = {}
+        for entry in EpgChannel.objects.raw(query).only('channel', 'display_names').values():
+            channels.setdefault(entry['channel'], []).extend(entry.get('display_names', []))
+        return cls(list(channels.items()))
+
+    def match(self, name: str, tvg_id=None) -> (str, float):
+        # best channel id for a stream and the confidence of it, (None, 0) without a candidate
+        if tvg_id and tvg_id in self._ids:
+            return tvg_id, ChannelMatcher.EXACT_ID_CONFIDENCE
+
+        tokens = frozenset(normalize_tokens(name))
+        if not tokens:
+            return None, 0
+
+        exact = self._by_name.get(' '.join(normalize_tokens(name)))
+        if exact and len(exact) == 1:
+            return next(iter(exact)), ChannelMatcher.EXACT_NAME_CONFIDENCE
+
+        candidates = set()
+        for token in tokens:
+            candidates.update(self._by_token.get(token, ()))
+
+        scores = sorted(((max(self.__similarity(tokens, names) for names in self._names[channel]), channel)
+                         for channel in candidates), key=lambda item: (-item[0], item[1]))
+        if not scores:
+            return None, 0
+
+        best_score, best = scores[0]
+        # 'BBC' fits 'BBC One' and 'BBC Two' equally, ambiguous matches are halved
+        if len(scores) > 1 and scores[1][0] == best_score:
+            best_score /= 2
+        return best, round(best_score * ChannelMatcher.TOKEN_CONFIDENCE_SCALE, 3)
+
+    def match_streams(self, streams: list, min_confidence=DEFAULT_MIN_CONFIDENCE) -> list:
+        # suggestions for streams whose tvg_id is missing or unknown to the epg
+        result = []
+        for stream in streams:
+            original = stream.stream()
+            suggested, confidence = self.match(original.name, original.tvg_id)
+            if not suggested or suggested == original.tvg_id or confidence < min_confidence:
+                continue
+
+            result.append({MatchFields.ID: str(stream.id), MatchFields.NAME: original.name,
+                           MatchFields.CURRENT: original.tvg_id, MatchFields.SUGGESTED: suggested,
+                           MatchFields.CONFIDENCE: confidence})
+        return result
+
+    # private
+    def __similarity(self, left: frozenset, right: frozenset) -> float:
+        # idf weighted jaccard, rare tokens (names) count more than common ones (country codes), a stream name
+        # fully contained in a channel name ('CNN' in 'CNN International') scores at least CONTAINED_SCORE
+        union = sum(self.__weight(token) for token in left | right)
+        if not union:
+            return 0
+
+        score = sum(self.__weight(token) for token in left & right) / union
+        if left <= right:
+            score = max(score, ChannelMatcher.CONTAINED_SCORE)
+        return score
+
+    def __weight(self, token: str) -> float:
+        return self._idf.get(token, 1)
@@ -0,0 +1,127 @@
+import gzip
+import hashlib
+import heapq
+import os
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING
+
+from app.epg.entry import Epg, EpgChannel, EpgProgramme
+from app.epg.xmltv import XmltvFields, write_xmltv
+
+
+class XmltvMerger(object):
+    DEFAULT_TTL = 3600
+    DEFAULT_KEEP_PAST = 24 * 3600
+    FILE_TEMPLATE_1S = '{0}.xml.gz'
+
+    def __init__(self, folder: str, ttl=DEFAULT_TTL, keep_past=DEFAULT_KEEP_PAST):
+        # one gzipped xmltv per service with the channels its streams use, rebuilt when older than ttl
+        self._folder = folder
+        self._ttl = ttl
+        self._keep_past = keep_past
+        self._etags = {}  # path -> content digest
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def get_path(self, service, force=False) -> str:
+        path = os.path.join(self._folder, XmltvMerger.FILE_TEMPLATE_1S.format(service.id))
+        if force or not os.path.exists(path) or os.path.getmtime(path) + self._ttl < time.time():
+            self.generate(service, path)
+        return path
+
+    def get_etag(self, path: str) -> str:
+        etag = self._etags.get(path)
+        if not etag:
+            etag = XmltvMerger.__get_file_digest(path)
+            self._etags[path] = etag
+        return etag
+
+    def generate(self, service, path: str):
+        tvg_ids = set(stream.stream().tvg_id for stream in service.get_streams() if stream.stream().tvg_id)
+        # earlier epg sources win on conflicts
+        ranks = {epg.get_id(): rank for rank, epg in enumerate(Epg.objects.all())}
+        tmp_path = path + '.tmp'
+        digest = hashlib.md5()
+        with open(tmp_path, 'wb') as raw:
+            # fixed gzip mtime, unchanged content gives unchanged bytes
+            with gzip.GzipFile(fileobj=_HashingWriter(raw, digest), mode='wb', mtime=0) as file:
+                write_xmltv(file, self.__merge_channels(tvg_ids, ranks), self.__merge_programmes(tvg_ids, ranks))
+
+        # identical output keeps the old file, only its age is refreshed
+        if os.path.exists(path) and self.get_etag(path) == digest.hexdigest():
+            os.unlink(tmp_path)
+            os.utime(path)
+            return
+
+        os.replace(tmp_path, path)
+        self._etags[path] = digest.hexdigest()
+
+    # private
+    @staticmethod
+    def __merge_channels(tvg_ids: set, ranks: dict) -> list:
+        channels = {}
+        query = {'channel': {'$in': list(tvg_ids)}, 'source': {'$in': list(ranks.keys())}}
+        entries = sorted(EpgChannel.objects.raw(query).values(), key=lambda entry: ranks[entry['source']])
+        for entry in entries:
+            channel = channels.get(entry['channel'])
+            if not channel:
+                channel = {XmltvFields.CHANNEL: entry['channel'], XmltvFields.DISPLAY_NAMES: [],
+                           XmltvFields.ICON: None}
+                channels[entry['channel']] = channel
+
+            for name in entry.get('display_names', []):
+                if name not in channel[XmltvFields.DISPLAY_NAMES]:
+                    channel[XmltvFields.DISPLAY_NAMES].append(name)
+            channel[XmltvFields.ICON] = channel[XmltvFields.ICON] or entry.get('icon')
+        return [channels[channel] for channel in sorted(channels)]
+
+    def __merge_programmes(self, tvg_ids: set, ranks: dict):
+        # every source is read sorted by (channel, start) from its own index and the cursors are merged lazily,
+        # a programme overlapping one already written for the channel is dropped
+        since = datetime.utcnow() - timedelta(seconds=self._keep_past)
+        cursors = []
+        for source, rank in ranks.items():
+            query = {'source': source, 'channel': {'$in': list(tvg_ids)}, 'stop': {'$gt': since}}
+            cursor = EpgProgramme.objects.raw(query).order_by([('channel', ASCENDING), ('start', ASCENDING)]).values()
+            cursors.append(_keyed(cursor, rank))
+
+        channel = None
+        last_stop = None
+        for programme_channel, start, _, programme in heapq.merge(*cursors, key=lambda item: item[:3]):
+            if programme_channel != channel:
+                channel = programme_channel
+                last_stop = None
+            if last_stop and start < last_stop:
+                continue
+
+            last_stop = programme['stop']
+            yield programme
+
+    @staticmethod
+    def __get_file_digest(path: str) -> str:
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+def _keyed(cursor, rank: int):
+    # merge keys, rank is bound per cursor
+    for programme in cursor:
+        yield programme['channel'], programme['start'], rank, programme
+
+
+class _HashingWriter(object):
+    def __init__(self, file, digest):
+        self._file = file
+        self._digest = digest
+
+    def write(self, data: bytes):
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
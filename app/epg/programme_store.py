@@ -0,0 +1,146 @@
+import logging
+from datetime import datetime, timedelta
+
+import gevent
+from pyfastocloud_models.utils.utils import date_to_utc_msec
+from pymongo import UpdateOne, ASCENDING
+from pymongo.errors import PyMongoError
+
+from app.epg.entry import EpgChannel, EpgProgramme
+from app.epg.xmltv import XmltvFields, iterate_xmltv, open_xmltv
+
+
+class ProgrammeFields:
+    CHANNEL = 'channel'
+    START = 'start'
+    STOP = 'stop'
+    TITLE = 'title'
+    DESCRIPTION = 'description'
+    CATEGORIES = 'categories'
+    NOW = 'now'
+    NEXT = 'next'
+
+
+class ProgrammeStore(object):
+    DEFAULT_BATCH_SIZE = 1000
+    # programmes ended longer ago are removed on load
+    DEFAULT_KEEP_PAST = 7 * 24 * 3600
+    # now/next lookups do not look further than this
+    LOOKAHEAD = timedelta(days=1)
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, keep_past=DEFAULT_KEEP_PAST):
+        self._batch_size = batch_size
+        self._keep_past = keep_past
+
+    def load_file(self, path: str, source: str) -> dict:
+        with open_xmltv(path) as file:
+            return self.load(file, source)
+
+    def load(self, file, source: str) -> dict:
+        # upserts channels and programmes of one epg source in batches, programmes of the source that disappeared
+        # from the feed inside its time range and channels no longer in it are removed afterwards
+        updated = datetime.utcnow()
+        channels = []
+        programmes = []
+        seen = set()  # channel ids of the feed
+        counts = {'channels': 0, 'programmes': 0}
+        first_start = None
+        for kind, item in iterate_xmltv(file):
+            seen.add(item[XmltvFields.CHANNEL])
+            if kind == 'channel':
+                item['source'] = source
+                item['updated'] = updated
+                channels.append(UpdateOne({'channel': item[XmltvFields.CHANNEL], 'source': source}, {'$set': item},
+                                          upsert=True))
+                if len(channels) >= self._batch_size:
+                    counts['channels'] += ProgrammeStore.__write(EpgChannel, channels)
+                    channels = []
+            else:
+                if first_start is None or item[XmltvFields.START] < first_start:
+                    first_start = item[XmltvFields.START]
+                item['source'] = source
+                item['updated'] = updated
+                programmes.append(UpdateOne({'source': source, 'channel': item[XmltvFields.CHANNEL],
+                                             'start': item[XmltvFields.START]}, {'$set': item}, upsert=True))
+                if len(programmes) >= self._batch_size:
+                    counts['programmes'] += ProgrammeStore.__write(EpgProgramme, programmes)
+                    programmes = []
+
+        counts['channels'] += ProgrammeStore.__write(EpgChannel, channels)
+        counts['programmes'] += ProgrammeStore.__write(EpgProgramme, programmes)
+
+        stale = {'source': source, 'updated': {'$lt': updated}}
+        if first_start is not None:
+            stale['start'] = {'$gte': first_start}
+        self.__delete(EpgProgramme, stale)
+        self.__delete(EpgProgramme, {'stop': {'$lt': updated - timedelta(seconds=self._keep_past)}})
+        if seen:
+            # an empty feed is more likely broken than really empty
+            self.__delete(EpgChannel, {'source': source, 'updated': {'$lt': updated}})
+            self.__delete(EpgProgramme, {'source': source, 'channel': {'$nin': list(seen)}})
+        return counts
+
+    def remove_source(self, source: str):
+        self.__delete(EpgChannel, {'source': source})
+        self.__delete(EpgProgramme, {'source': source})
+
+    def keep_sources(self, sources: list):
+        # drops what is left of epg sources deleted meanwhile
+        self.__delete(EpgChannel, {'source': {'$nin': sources}})
+        self.__delete(EpgProgramme, {'source': {'$nin': sources}})
+
+    def get_now_next(self, tvg_ids: list, now=None) -> dict:
+        # tvg_id -> {'now': programme or None, 'next': programme or None}
+        now = now or datetime.utcnow()
+        result = {tvg_id: {ProgrammeFields.NOW: None, ProgrammeFields.NEXT: None} for tvg_id in tvg_ids}
+        query = {'channel': {'$in': list(result.keys())}, 'stop': {'$gt': now},
+                 'start': {'$lt': now + ProgrammeStore.LOOKAHEAD}}
+        cursor = EpgProgramme.objects.raw(query).order_by([('channel', ASCENDING), ('start', ASCENDING)]).values()
+        for programme in cursor:
+            slots = result[programme['channel']]
+            # several sources can describe the same slot, the first one wins
+            if programme['start'] <= now:
+                if not slots[ProgrammeFields.NOW]:
+                    slots[ProgrammeFields.NOW] = ProgrammeStore.__to_front(programme)
+            elif not slots[ProgrammeFields.NEXT]:
+                slots[ProgrammeFields.NEXT] = ProgrammeStore.__to_front(programme)
+        return result
+
+    def get_programmes(self, tvg_id: str, start: datetime, stop: datetime) -> list:
+        return [ProgrammeStore.__to_front(programme) for programme in self.iterate_programmes(tvg_id, start, stop)]
+
+    def iterate_programmes(self, tvg_id: str, start: datetime, stop: datetime):
+        # raw programmes overlapping [start, stop) ordered by start, one per slot when sources overlap
+        query = {'channel': tvg_id, 'stop': {'$gt': start}, 'start': {'$lt': stop}}
+        last_start = None
+        for programme in EpgProgramme.objects.raw(query).order_by([('start', ASCENDING)]).values():
+            if programme['start'] != last_start:
+                last_start = programme['start']
+                yield programme
+
+    # private
+    @staticmethod
+    def __to_front(programme: dict) -> dict:
+        return {ProgrammeFields.CHANNEL: programme['channel'],
+                ProgrammeFields.START: date_to_utc_msec(programme['start']),
+                ProgrammeFields.STOP: date_to_utc_msec(programme['stop']),
+                ProgrammeFields.TITLE: programme.get('title'),
+                ProgrammeFields.DESCRIPTION: programme.get('description'),
+                ProgrammeFields.CATEGORIES: programme.get('categories', [])}
+
+    @staticmethod
+    def __write(model, operations: list) -> int:
+        if not operations:
+            return 0
+
+        model._mongometa.collection.bulk_write(operations, ordered=False)
+        # big feeds take a while, let other greenlets run between batches
+        gevent.sleep(0)
+        return len(operations)
+
+    @staticmethod
+    def __delete(model, query: dict):
+        try:
+            model._mongometa.collection.delete_many(query)
+        except PyMongoError as ex:
+            logging.warning('Epg cleanup failed: %s', str(ex))
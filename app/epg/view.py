@@ -1,16 +1,21 @@
 import gzip
+import logging
 import os
 import shutil
+from datetime import datetime, timedelta
 
+import gevent
 from bson.objectid import ObjectId
 from flask import render_template, request, jsonify, redirect, url_for
 from flask_classy import FlaskView, route
 from flask_login import login_required
 from pyfastocloud_models.utils.utils import download_file
+from pymongo.errors import PyMongoError
 
-from app import app, get_epg_tmp_folder
+from app import app, get_epg_tmp_folder, epg_store
 from app.common.epg.forms import EpgForm, UploadEpgForm, gen_extension
 from app.epg.entry import Epg
+from app.service.upload_spool import open_upload
 
 
 def _get_epg_by_id(sid: str):
@@ -22,6 +27,18 @@ def _get_epg_by_id(sid: str):
         return epg
 
 
+def _ingest_files(files: list, sources: list):
+    # files are (path, epg id, uri), removed once loaded
+    for path, source, uri in files:
+        try:
+            epg_store.load_file(path, source)
+        except (PyMongoError, SyntaxError, OSError, EOFError) as ex:
+            logging.warning('Epg %s not loaded: %s', uri, str(ex))
+        finally:
+            os.unlink(path)
+    epg_store.keep_sources(sources)
+
+
 def gunzip(file_path, output_path):
     with gzip.open(file_path, 'rb') as f_in, open(output_path, 'wb') as f_out:
         shutil.copyfileobj(f_in, f_out)
@@ -42,7 +59,9 @@ class EpgView(FlaskView):
         epgs = Epg.objects.all()
         epg_service_in_directory = app.config.get('EPG_IN_DIRECTORY')
 
+        ingest = app.config.get('EPG_INGEST', True)
         result = []
+        files = []
         for index, epg in enumerate(epgs):
             try:
                 path, name = download_file(epg.uri, get_epg_tmp_folder(), epg.extension, 10)
@@ -61,11 +80,34 @@ class EpgView(FlaskView):
             else:
                 shutil.copy(path, out_path)
 
-            os.unlink(path)
             result.append({'path': path, 'status': status})
+            if status and ingest:
+                files.append((path, epg.get_id(), epg.uri))
+            else:
+                os.unlink(path)
 
+        if ingest:
+            # feeds are big, they are loaded after the response
+            gevent.spawn(_ingest_files, files, [epg.get_id() for epg in epgs])
         return jsonify(status='ok', result=result), 200
 
+    @login_required
+    @route('/now_next', methods=['GET'])
+    def now_next(self):
+        tvg_ids = request.args.getlist('tvg_id')
+        if not tvg_ids:
+            return jsonify(status='failed'), 404
+
+        return jsonify(status='ok', programmes=epg_store.get_now_next(tvg_ids)), 200
+
+    @login_required
+    @route('/programmes/<tvg_id>', methods=['GET'])
+    def programmes(self, tvg_id):
+        hours = min(max(request.args.get('hours', 24, type=int), 1), 7 * 24)
+        start = datetime.utcnow()
+        programmes = epg_store.get_programmes(tvg_id, start, start + timedelta(hours=hours))
+        return jsonify(status='ok', programmes=programmes), 200
+
     @login_required
     @route('/add', methods=['GET', 'POST'])
     def add(self):
@@ -83,6 +125,7 @@ class EpgView(FlaskView):
         sid = request.form['sid']
         epg = _get_epg_by_id(sid)
         if epg:
+            epg_store.remove_source(epg.get_id())
             epg.delete()
             return jsonify(status='ok'), 200
 
@@ -112,11 +155,11 @@ class EpgView(FlaskView):
     def upload_file(self):
         form = UploadEpgForm()
         if form.validate_on_submit():
-            file_handle = form.file.data
-            content = file_handle.read().decode('utf-8')
             url_set = set()
-            for line in content.split():
-                url_set.add(line.strip())
+            with open_upload(form.file.data) as reader:
+                for line in reader:
+                    for url in line.decode('utf-8', 'replace').split():
+                        url_set.add(url.strip())
 
             for uniq in url_set:
                 epg = Epg()
@@ -0,0 +1,135 @@
+import gzip
+import itertools
+from datetime import datetime, timedelta
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape, quoteattr
+
+GZIP_MAGIC = b'\x1f\x8b'
+XMLTV_TIME_FORMAT = '%Y%m%d%H%M%S'
+
+
+class XmltvFields:
+    CHANNEL = 'channel'
+    DISPLAY_NAMES = 'display_names'
+    ICON = 'icon'
+    START = 'start'
+    STOP = 'stop'
+    TITLE = 'title'
+    DESCRIPTION = 'description'
+    CATEGORIES = 'categories'
+
+
+def open_xmltv(path: str):
+    # plain or gzipped xmltv, detected by content not by extension
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def parse_xmltv_time(value: str):
+    # '20200101120000 +0200' -> naive utc datetime, None if malformed
+    if not value:
+        return None
+
+    stamp, _, offset = value.strip().partition(' ')
+    stamp = stamp[:14].ljust(14, '0')
+    try:
+        result = datetime.strptime(stamp, XMLTV_TIME_FORMAT)
+    except ValueError:
+        return None
+
+    offset = offset.strip()
+    if len(offset) == 5 and offset[0] in '+-' and offset[1:].isdigit():
+        delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+        result = result - delta if offset[0] == '+' else result + delta
+    return result
+
+
+def iterate_xmltv(file):
+    # yields ('channel', dict) and ('programme', dict) in document order, parsed elements are dropped right away
+    # so memory does not grow with the feed size
+    context = iterparse(file, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event != 'end':
+            continue
+
+        if element.tag == 'channel':
+            channel = element.get('id')
+            if channel:
+                icon = element.find('icon')
+                yield 'channel', {XmltvFields.CHANNEL: channel,
+                                  XmltvFields.DISPLAY_NAMES: [name.text.strip() for name in
+                                                              element.findall('display-name') if name.text],
+                                  XmltvFields.ICON: icon.get('src') if icon is not None else None}
+            root.clear()
+        elif element.tag == 'programme':
+            programme = _make_programme(element)
+            if programme:
+                yield 'programme', programme
+            root.clear()
+
+
+def _make_programme(element) -> dict:
+    channel = element.get('channel')
+    start = parse_xmltv_time(element.get('start'))
+    stop = parse_xmltv_time(element.get('stop'))
+    if not channel or not start:
+        return None
+
+    # programmes without stop end when the next one starts, an hour is a safe default
+    if not stop or stop <= start:
+        stop = start + timedelta(hours=1)
+
+    return {XmltvFields.CHANNEL: channel, XmltvFields.START: start, XmltvFields.STOP: stop,
+            XmltvFields.TITLE: element.findtext('title'), XmltvFields.DESCRIPTION: element.findtext('desc'),
+            XmltvFields.CATEGORIES: [category.text for category in element.findall('category') if category.text]}
+
+
+def format_xmltv_time(value: datetime) -> str:
+    # naive utc datetime
+    return value.strftime(XMLTV_TIME_FORMAT) + ' +0000'
+
+
+def write_xmltv(file, channels, programmes, buffer_size=64 * 1024):
+    # writes utf-8 xmltv to a binary file from channel and programme dicts (XmltvFields keys), programmes can be
+    # any iterable so the document never has to be held in memory
+    buffer = ['<?xml version="1.0" encoding="UTF-8"?>\n<tv generator-info-name="fastocloud_admin">\n']
+    buffered = 0
+    for element in itertools.chain((_format_channel(channel) for channel in channels),
+                                   (_format_programme(programme) for programme in programmes)):
+        buffer.append(element)
+        buffered += len(element)
+        if buffered >= buffer_size:
+            file.write(''.join(buffer).encode('utf-8'))
+            buffer = []
+            buffered = 0
+
+    buffer.append('</tv>\n')
+    file.write(''.join(buffer).encode('utf-8'))
+
+
+def _format_channel(channel: dict) -> str:
+    lines = ['<channel id={0}>'.format(quoteattr(channel[XmltvFields.CHANNEL]))]
+    for name in channel.get(XmltvFields.DISPLAY_NAMES) or []:
+        lines.append('<display-name>{0}</display-name>'.format(escape(name)))
+    if channel.get(XmltvFields.ICON):
+        lines.append('<icon src={0}/>'.format(quoteattr(channel[XmltvFields.ICON])))
+    lines.append('</channel>\n')
+    return ''.join(lines)
+
+
+def _format_programme(programme: dict) -> str:
+    lines = ['<programme start="{0}" stop="{1}" channel={2}>'.format(
+        format_xmltv_time(programme[XmltvFields.START]), format_xmltv_time(programme[XmltvFields.STOP]),
+        quoteattr(programme[XmltvFields.CHANNEL]))]
+    if programme.get(XmltvFields.TITLE):
+        lines.append('<title>{0}</title>'.format(escape(programme[XmltvFields.TITLE])))
+    if programme.get(XmltvFields.DESCRIPTION):
+        lines.append('<desc>{0}</desc>'.format(escape(programme[XmltvFields.DESCRIPTION])))
+    for category in programme.get(XmltvFields.CATEGORIES) or []:
+        lines.append('<category>{0}</category>'.format(escape(category)))
+    lines.append('</programme>\n')
+    return ''.join(lines)
@@ -2,6 +2,7 @@ from flask import session
 from flask_login import UserMixin, login_user, logout_user
 
 from pyfastocloud_models.provider.entry import Provider
+from pyfastocloud_models.provider.entry_pair import ProviderPair
 
 
 class ProviderUser(UserMixin, Provider):
@@ -28,3 +29,15 @@ class ProviderUser(UserMixin, Provider):
             return servers_manager.find_or_create_server(server_settings)
 
         return None
+
+    def get_writable_servers(self) -> list:
+        from app import servers_manager
+        result = []
+        for server_settings in self.servers:
+            if not server_settings:
+                continue
+
+            server = servers_manager.find_or_create_server(server_settings)
+            if server.get_user_role_by_id(self.id) != ProviderPair.Roles.READ:
+                result.append(server)
+        return result
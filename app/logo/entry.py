@@ -0,0 +1,24 @@
+import pyfastocloud_models.constants as constants
+from pymodm import MongoModel, fields
+from pymongo import IndexModel
+
+
+class LogoValidation(MongoModel):
+    class Meta:
+        collection_name = 'logo_validation'
+        # mongo removes the documents once expired
+        indexes = [IndexModel('expires', expireAfterSeconds=0)]
+
+    url = fields.CharField(max_length=constants.MAX_URI_LENGTH, primary_key=True)
+    valid = fields.BooleanField(default=False)
+    expires = fields.DateTimeField(required=True)
+
+
+class LogoMirrorEntry(MongoModel):
+    class Meta:
+        collection_name = 'logo_mirror'
+
+    url = fields.CharField(max_length=constants.MAX_URI_LENGTH, primary_key=True)
+    name = fields.CharField(required=True)  # content hash based file name, shared by urls with the same image
+    sizes = fields.ListField(fields.IntegerField(), default=[])  # resized variants available
+    updated = fields.DateTimeField(required=True)
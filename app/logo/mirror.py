@@ -0,0 +1,243 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import time
+from datetime import datetime
+
+import gevent
+from flask import url_for
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from app.logo.entry import LogoMirrorEntry
+from app.service.http_pool import HttpPool
+
+try:
+    from PIL import Image
+
+    IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+except ImportError:  # Pillow is optional, without it only the original images are mirrored
+    Image = None
+    IMAGE_ERRORS = (OSError, ValueError)
+
+
+class LogoMirror(object):
+    DEFAULT_SIZES = [64, 256]
+    DEFAULT_MAX_SIZE = 2 * 1024 * 1024
+    DEFAULT_REFRESH = 7 * 24 * 3600
+    DEFAULT_RETRY = 3600
+    DEFAULT_MAX_URLS = 100000
+    BATCH_SIZE = 64
+    # no svg, it can carry scripts and is served from the app origin
+    CONTENT_TYPES = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/gif': 'gif', 'image/webp': 'webp'}
+    VARIANT_TEMPLATE_2S = '{0}_{1}.png'
+    ORIGINAL_TEMPLATE_2S = '{0}.{1}'
+    LOGO_PATTERN = re.compile(r'tvg-logo="([^"]*)"')
+    NAME_PATTERN = re.compile(r'^[0-9a-f]{32}(_[0-9]+\.png|\.(png|jpg|gif|webp))$')
+
+    def __init__(self, root: str, pool: HttpPool, sizes=None, max_size=DEFAULT_MAX_SIZE, refresh=DEFAULT_REFRESH,
+                 retry=DEFAULT_RETRY, enabled=True, public_url='', max_urls=DEFAULT_MAX_URLS):
+        # logos are fetched by the run() greenlet, urls seen in playlists are queued and served from the mirror
+        # once fetched, files are named by content hash so equal images from different urls are stored once,
+        # mirrored urls start with public_url (scheme and host, relative when empty) and not the request host,
+        # cached playlists are shared by every client, max_urls bounds the urls kept in memory
+        self._root = root
+        self._pool = pool
+        self._public_url = public_url.rstrip('/')
+        self._max_urls = max_urls
+        self._sizes = sorted(sizes if sizes is not None else LogoMirror.DEFAULT_SIZES) if Image else []
+        self._max_size = max_size
+        self._refresh = refresh
+        self._retry = retry
+        self._enabled = enabled
+        self._entries = {}  # url -> (name, sizes, updated)
+        self._failed = {}  # url -> retry time
+        self._looked_up = set()  # urls already searched in mongo
+        self._pending = set()
+        self._listeners = []
+        self._stop_listen = False
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def add_listener(self, listener):
+        # listener() is called after a batch of logos was mirrored
+        self._listeners.append(listener)
+
+    def stop(self):
+        self._stop_listen = True
+
+    def run(self):
+        while not self._stop_listen:
+            if not self._pending:
+                gevent.sleep(1)
+                continue
+
+            batch = [self._pending.pop() for _ in range(min(len(self._pending), LogoMirror.BATCH_SIZE))]
+            try:
+                if self.mirror(batch):
+                    for listener in self._listeners:
+                        listener()
+            except Exception as ex:
+                logging.error('Logo mirroring failed: %s', str(ex))
+                gevent.sleep(1)
+
+    def get_path(self, name: str):
+        if not LogoMirror.NAME_PATTERN.match(name):
+            return None
+
+        path = os.path.join(self._root, name)
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def get_urls(self, urls: list, size=None) -> dict:
+        # url -> mirrored url or the original one with one lookup for all, unknown urls are queued for mirroring
+        if not self._enabled:
+            return {url: url for url in urls}
+
+        self.__lookup([url for url in urls if url])
+        return {url: self.__get_url(url, size) if url else url for url in urls}
+
+    def rewrite_playlist(self, content: str, size=None) -> str:
+        if not self._enabled or not content:
+            return content
+
+        urls = set(LogoMirror.LOGO_PATTERN.findall(content))
+        if not urls:
+            return content
+
+        self.__lookup(list(urls))
+        return LogoMirror.LOGO_PATTERN.sub(
+            lambda match: 'tvg-logo="{0}"'.format(self.__get_url(match.group(1), size)), content)
+
+    def mirror(self, urls: list) -> int:
+        # fetches urls and stores them, returns the number of mirrored logos
+        now = time.time()
+        responses = self._pool.fetch_many(urls, max_body=self._max_size + 1)
+        fetched = []
+        for url, response in zip(urls, responses):
+            content_type = (response.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+            extension = LogoMirror.CONTENT_TYPES.get(content_type)
+            if not response.ok or not extension or not response.body or len(response.body) > self._max_size:
+                self._failed[url] = now + self._retry
+                continue
+
+            fetched.append((url, response.body, extension))
+
+        # decoding and resizing are cpu bound, they run in the pool threads and not on the event loop
+        stored = self._pool.map(lambda item: self.__store(item[1], item[2]), fetched)
+        mirrored = []
+        for (url, _, _), (name, sizes, error) in zip(fetched, stored):
+            if error:
+                logging.warning('Logo %s not mirrored: %s', url, error)
+                self._failed[url] = now + self._retry
+                continue
+
+            self._entries[url] = (name, sizes, now)
+            self._failed.pop(url, None)
+            mirrored.append((url, name, sizes))
+
+        self.__save(mirrored)
+        return len(mirrored)
+
+    # private
+    def __get_url(self, url: str, size):
+        entry = self._entries.get(url)
+        if not entry:
+            return url
+
+        name, sizes, _ = entry
+        if size:
+            # the smallest variant not smaller than requested
+            for variant in sizes:
+                if variant >= size:
+                    name = LogoMirror.VARIANT_TEMPLATE_2S.format(name.rsplit('.', 1)[0], variant)
+                    break
+        return self._public_url + url_for('LogoView:get', name=name)
+
+    def __trim(self, now: float):
+        # entries and looked up urls are loaded again from mongo, failures are retried earlier
+        if len(self._entries) + len(self._looked_up) > self._max_urls:
+            self._entries.clear()
+            self._looked_up.clear()
+        if len(self._failed) > self._max_urls:
+            self._failed = {url: retry for url, retry in self._failed.items() if retry > now}
+            if len(self._failed) > self._max_urls:
+                self._failed.clear()
+
+    def __lookup(self, urls: list):
+        now = time.time()
+        self.__trim(now)
+        unknown = [url for url in urls if url and url not in self._entries and url not in self._looked_up]
+        if unknown:
+            self._looked_up.update(unknown)
+            try:
+                for entry in LogoMirrorEntry.objects.raw({'_id': {'$in': unknown}}).values():
+                    if not LogoMirror.NAME_PATTERN.match(entry['name']):
+                        continue  # no longer served (svg), mirrored again or left to the original url
+
+                    updated = time.time() - (datetime.utcnow() - entry['updated']).total_seconds()
+                    self._entries[entry['_id']] = (entry['name'], entry.get('sizes', []), updated)
+            except PyMongoError as ex:
+                logging.warning('Logo mirror entries not loaded: %s', str(ex))
+
+        for url in urls:
+            if not url or not url.startswith(('http://', 'https://')) or self._failed.get(url, 0) > now:
+                continue
+
+            entry = self._entries.get(url)
+            if (not entry or entry[2] + self._refresh < now) and len(self._pending) < self._max_urls:
+                self._pending.add(url)  # when full, urls are queued again by the next playlist
+
+    def __store(self, content: bytes, extension: str) -> (str, list, str):
+        # runs in a pool thread, returns (name, sizes, None) or (None, None, error)
+        try:
+            name, sizes = self.__store_image(content, extension)
+        except IMAGE_ERRORS as ex:
+            return None, None, str(ex)
+        return name, sizes, None
+
+    def __store_image(self, content: bytes, extension: str) -> (str, list):
+        digest = hashlib.sha256(content).hexdigest()[:32]
+        name = LogoMirror.ORIGINAL_TEMPLATE_2S.format(digest, extension)
+        self.__write(name, content)
+
+        sizes = []
+        if Image:
+            with Image.open(io.BytesIO(content)) as image:
+                image.load()
+                for size in self._sizes:
+                    variant = LogoMirror.VARIANT_TEMPLATE_2S.format(digest, size)
+                    if not os.path.exists(os.path.join(self._root, variant)):
+                        thumbnail = image.convert('RGBA')
+                        thumbnail.thumbnail((size, size))
+                        output = io.BytesIO()
+                        thumbnail.save(output, 'PNG', optimize=True)
+                        self.__write(variant, output.getvalue())
+                    sizes.append(size)
+        return name, sizes
+
+    def __write(self, name: str, content: bytes):
+        path = os.path.join(self._root, name)
+        if os.path.exists(path):
+            return  # same content already stored
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def __save(mirrored: list):
+        if not mirrored:
+            return
+
+        updated = datetime.utcnow()
+        operations = [UpdateOne({'_id': url}, {'$set': {'name': name, 'sizes': sizes, 'updated': updated}},
+                                upsert=True) for url, name, sizes in mirrored]
+        try:
+            LogoMirrorEntry._mongometa.collection.bulk_write(operations, ordered=False)
+        except PyMongoError as ex:
+            logging.warning('Logo mirror entries not saved: %s', str(ex))
@@ -0,0 +1,114 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from app.logo.entry import LogoValidation
+from app.service.http_pool import HttpPool
+
+
+class LogoValidator(object):
+    DEFAULT_TTL = 24 * 3600
+    DEFAULT_NEGATIVE_TTL = 3600
+    DEFAULT_MAX_ENTRIES = 65536
+    DEFAULT_TIMEOUT = 2
+    # servers that refuse HEAD get a short GET
+    HEAD_NOT_ALLOWED_STATUSES = [403, 405, 501]
+    GET_PROBE_SIZE = 1024
+
+    def __init__(self, pool: HttpPool, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES, timeout=DEFAULT_TIMEOUT, persist=True):
+        # results live in a memory LRU and in mongo (shared by all processes and scripts), dead logos are kept for
+        # negative_ttl so they are not checked again on every import
+        self._pool = pool
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._max_entries = max_entries
+        self._timeout = timeout
+        self._persist = persist
+        self._cache = OrderedDict()  # url -> (valid, expires)
+
+    def is_valid(self, url: str) -> bool:
+        return url in self.validate([url])
+
+    def validate(self, urls: list) -> set:
+        # returns the valid subset of urls
+        now = time.time()
+        valid = set()
+        missing = []
+        for url in set(url for url in urls if url):
+            cached = self._cache.get(url)
+            if cached and cached[1] > now:
+                self._cache.move_to_end(url)
+                if cached[0]:
+                    valid.add(url)
+            else:
+                missing.append(url)
+
+        if missing and self._persist:
+            for url, is_valid, expires in self.__load(missing):
+                self.__put(url, is_valid, expires)
+                if is_valid:
+                    valid.add(url)
+            missing = [url for url in missing if url not in self._cache or self._cache[url][1] <= now]
+
+        if not missing:
+            return valid
+
+        checked = []
+        for url, is_valid in zip(missing, self._pool.map(self.__check, missing)):
+            expires = now + (self._ttl if is_valid else self._negative_ttl)
+            self.__put(url, is_valid, expires)
+            checked.append((url, is_valid, expires))
+            if is_valid:
+                valid.add(url)
+
+        if self._persist:
+            self.__save(checked)
+        return valid
+
+    # private
+    def __put(self, url: str, is_valid: bool, expires: float):
+        self._cache[url] = (is_valid, expires)
+        self._cache.move_to_end(url)
+        while len(self._cache) > self._max_entries:
+            self._cache.popitem(last=False)
+
+    def __check(self, url: str) -> bool:
+        if urlparse(url).scheme not in ('http', 'https'):
+            return False
+
+        result = self._pool.fetch_direct(url, method='HEAD', max_body=0, timeout=self._timeout)
+        if result.status in LogoValidator.HEAD_NOT_ALLOWED_STATUSES:
+            result = self._pool.fetch_direct(url, max_body=LogoValidator.GET_PROBE_SIZE, timeout=self._timeout)
+        return result.ok
+
+    @staticmethod
+    def __load(urls: list):
+        now = datetime.utcnow()
+        try:
+            for entry in LogoValidation.objects.raw({'_id': {'$in': urls}, 'expires': {'$gt': now}}).values():
+                expires = time.time() + (entry['expires'] - now).total_seconds()
+                yield entry['_id'], entry.get('valid', False), expires
+        except PyMongoError as ex:
+            logging.warning('Logo validation cache not loaded: %s', str(ex))
+
+    @staticmethod
+    def __save(checked: list):
+        if not checked:
+            return
+
+        now = time.time()
+        operations = []
+        for url, is_valid, expires in checked:
+            expires_at = datetime.utcnow() + timedelta(seconds=expires - now)
+            operations.append(UpdateOne({'_id': url}, {'$set': {'valid': is_valid, 'expires': expires_at}},
+                                        upsert=True))
+        try:
+            LogoValidation._mongometa.collection.bulk_write(operations, ordered=False)
+        except PyMongoError as ex:
+            logging.warning('Logo validation cache not saved: %s', str(ex))
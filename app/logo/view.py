@@ -0,0 +1,22 @@
+from flask import jsonify, send_file
+from flask_classy import FlaskView, route
+
+from app import logo_mirror
+
+
+# routes
+class LogoView(FlaskView):
+    # mirrored files are named by content hash and never change
+    CACHE_MAX_AGE = 365 * 24 * 3600
+
+    route_base = '/logo/'
+
+    @route('/<name>', methods=['GET'])
+    def get(self, name):
+        path = logo_mirror.get_path(name)
+        if not path:
+            return jsonify(status='failed'), 404
+
+        response = send_file(path, conditional=True, cache_timeout=LogoView.CACHE_MAX_AGE)
+        response.headers['Cache-Control'] = 'public, max-age={0}, immutable'.format(LogoView.CACHE_MAX_AGE)
+        return response
@@ -4,9 +4,13 @@ from flask_classy import FlaskView, route
 from flask_login import login_required, current_user
 from pyfastocloud_models.service.entry import ServiceSettings
 
+from app import logo_mirror
+
 
 # routes
 class ProviderView(FlaskView):
+    LOGO_SIZE = 64
+
     route_base = '/'
 
     @login_required
@@ -39,6 +43,12 @@ class ProviderView(FlaskView):
                 else:
                     streams_relay_encoder_timeshifts.append(front)
 
+            # logos are shown from the mirror once fetched
+            fronts = streams_relay_encoder_timeshifts + vods + cods + proxy + catchups + events + tests
+            logos = logo_mirror.get_urls([front.get('tvg_logo') for front in fronts], ProviderView.LOGO_SIZE)
+            for front in fronts:
+                front['tvg_logo'] = logos[front.get('tvg_logo')]
+
             role = server.get_user_role_by_id(current_user.id)
             return render_template('provider/dashboard.html', streams=streams_relay_encoder_timeshifts, vods=vods,
                                    cods=cods, proxies=proxy, catchups=catchups, events=events, tests=tests,
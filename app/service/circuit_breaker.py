@@ -0,0 +1,118 @@
+import time
+from collections import deque
+
+
+class BreakerState:
+    CLOSED = 'closed'  # stream runs normally
+    OPEN = 'open'  # stream is stopped until retry_at
+    HALF_OPEN = 'half_open'  # stream was started again and is on probation for one window
+
+
+class RestartBreaker(object):
+    DEFAULT_WINDOW = 300
+    DEFAULT_MAX_RESTARTS = 5
+    DEFAULT_BACKOFF = 60
+    DEFAULT_MAX_BACKOFF = 3600
+
+    def __init__(self, window=DEFAULT_WINDOW, max_restarts=DEFAULT_MAX_RESTARTS, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF):
+        # max_restarts restarts/quits inside window seconds open the breaker, every trip in a row doubles backoff
+        self._window = window
+        self._max_restarts = max(max_restarts, 1)
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._events = deque()
+        self._state = BreakerState.CLOSED
+        self._trips = 0
+        self._retry_at = 0
+        self._probation_until = 0
+        self._last_restarts = 0
+        self._quit_expected = False
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @property
+    def trips(self) -> int:
+        return self._trips
+
+    @property
+    def retry_at(self) -> float:
+        return self._retry_at
+
+    @property
+    def backoff(self) -> float:
+        # backoff of the last trip
+        return min(self._backoff * 2 ** max(self._trips - 1, 0), self._max_backoff)
+
+    def is_open(self) -> bool:
+        return self._state == BreakerState.OPEN
+
+    def on_restarts(self, restarts: int, now=None) -> bool:
+        # restarts is the counter reported in stream statistics, it starts from zero after every start
+        delta = restarts - self._last_restarts if restarts >= self._last_restarts else restarts
+        self._last_restarts = restarts
+        return self.__record(delta, now)
+
+    def expect_quit(self):
+        # the next quit was asked for (stop, restart) and is not counted
+        self._quit_expected = True
+
+    def on_quit(self, now=None) -> bool:
+        self._last_restarts = 0
+        if self._quit_expected:
+            self._quit_expected = False
+            return False
+        return self.__record(1, now)
+
+    def on_healthy(self, now=None):
+        # probation passed without a storm
+        now = now or time.time()
+        if self._state == BreakerState.HALF_OPEN and now >= self._probation_until:
+            self._state = BreakerState.CLOSED
+            self._trips = 0
+
+    def is_retry_due(self, now=None) -> bool:
+        return self._state == BreakerState.OPEN and (now or time.time()) >= self._retry_at
+
+    def delay_retry(self, now=None):
+        # the retry could not happen, the next one is one backoff away
+        self._retry_at = (now or time.time()) + self.backoff
+
+    def half_open(self, now=None):
+        now = now or time.time()
+        self._state = BreakerState.HALF_OPEN
+        self._probation_until = now + self._window
+        self._events.clear()
+        self._last_restarts = 0
+        self._quit_expected = False
+
+    def reset(self):
+        self._events.clear()
+        self._state = BreakerState.CLOSED
+        self._trips = 0
+        self._retry_at = 0
+        self._last_restarts = 0
+        self._quit_expected = False
+
+    # private
+    def __record(self, count: int, now) -> bool:
+        # returns True when the breaker has just opened, the caller stops the stream
+        if count <= 0 or self._state == BreakerState.OPEN:
+            return False
+
+        now = now or time.time()
+        for _ in range(min(count, self._max_restarts)):
+            self._events.append(now)
+        while self._events and self._events[0] <= now - self._window:
+            self._events.popleft()
+
+        if len(self._events) < self._max_restarts:
+            return False
+
+        self._events.clear()
+        self._trips += 1
+        self._state = BreakerState.OPEN
+        self._retry_at = now + self.backoff
+        return True
@@ -0,0 +1,134 @@
+import http.client
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, urlparse
+
+from gevent.threadpool import ThreadPool
+
+
+class HttpResult(object):
+    __slots__ = ['url', 'status', 'headers', 'body', 'elapsed', 'error']
+
+    def __init__(self, url: str, status=0, headers=None, body=b'', elapsed=0.0, error=None):
+        self.url = url  # final url after redirects
+        self.status = status
+        self.headers = headers or {}  # case insensitive http.client.HTTPMessage when received
+        self.body = body
+        self.elapsed = elapsed  # seconds
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return not self.error and 200 <= self.status < 300
+
+    def get_last_modified(self):
+        # seconds since epoch or None
+        value = self.headers.get('Last-Modified')
+        if not value:
+            return None
+
+        try:
+            return parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError):
+            return None
+
+
+class HttpPool(object):
+    DEFAULT_SIZE = 32
+    DEFAULT_TIMEOUT = 5
+    DEFAULT_MAX_BODY = 1024 * 1024
+    MAX_REDIRECTS = 5
+    REDIRECT_STATUSES = [301, 302, 303, 307, 308]
+    USER_AGENT = 'fastocloud_admin'
+
+    def __init__(self, size=DEFAULT_SIZE, timeout=DEFAULT_TIMEOUT):
+        # http.client blocks, requests run in a bounded pool of native threads so the gevent loop keeps serving,
+        # every thread keeps one keep-alive connection per host
+        self._pool = ThreadPool(size)
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def fetch(self, url: str, method='GET', max_body=DEFAULT_MAX_BODY, timeout=None) -> HttpResult:
+        return self._pool.apply(self.fetch_direct, (url, method, max_body, timeout))
+
+    def fetch_direct(self, url: str, method='GET', max_body=DEFAULT_MAX_BODY, timeout=None) -> HttpResult:
+        # blocks the calling thread, for functions already running in the pool through map()
+        start = time.time()
+        try:
+            for _ in range(HttpPool.MAX_REDIRECTS + 1):
+                response, body = self.__request(url, method, max_body, timeout or self._timeout)
+                location = response.getheader('Location')
+                if response.status in HttpPool.REDIRECT_STATUSES and location:
+                    url = urljoin(url, location)
+                    continue
+
+                error = None
+                if not 200 <= response.status < 300:
+                    error = 'HTTP Error {0}: {1}'.format(response.status, response.reason)
+                return HttpResult(url, response.status, response.headers, body, time.time() - start, error)
+            return HttpResult(url, 0, None, b'', time.time() - start, 'Too many redirects')
+        except Exception as ex:
+            return HttpResult(url, 0, None, b'', time.time() - start, str(ex))
+
+    def map(self, func, items: list) -> list:
+        # func(item) runs in the pool, results are returned in items order
+        tasks = [self._pool.spawn(func, item) for item in items]
+        return [task.get() for task in tasks]
+
+    def fetch_many(self, urls: list, method='GET', max_body=DEFAULT_MAX_BODY, timeout=None) -> list:
+        return self.map(lambda url: self.fetch_direct(url, method, max_body, timeout), urls)
+
+    # private
+    def __request(self, url: str, method: str, max_body: int, timeout):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise ValueError('Unsupported url: {0}'.format(url))
+
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        key = (parsed.scheme, parsed.netloc)
+        headers = {'User-Agent': HttpPool.USER_AGENT}
+        connection = self.__get_connection(key, timeout)
+        try:
+            connection.request(method, path, headers=headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # the server closed the idle keep-alive connection, one retry on a fresh one
+            self.__drop_connection(key)
+            connection = self.__get_connection(key, timeout)
+            connection.request(method, path, headers=headers)
+            response = connection.getresponse()
+
+        body = response.read(max_body) if max_body else b''
+        if not response.isclosed() or response.will_close:
+            # unread body left on the socket or the server asked to close
+            self.__drop_connection(key)
+        return response, body
+
+    def __get_connection(self, key: tuple, timeout):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = {}
+            self._local.connections = connections
+
+        connection = connections.get(key)
+        if connection is None:
+            scheme, netloc = key
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(netloc, timeout=timeout)
+            else:
+                connection = http.client.HTTPConnection(netloc, timeout=timeout)
+            connections[key] = connection
+        else:
+            connection.timeout = timeout
+            if connection.sock:
+                connection.sock.settimeout(timeout)
+        return connection
+
+    def __drop_connection(self, key: tuple):
+        connection = self._local.connections.pop(key, None)
+        if connection:
+            connection.close()
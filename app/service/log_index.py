@@ -0,0 +1,259 @@
+import os
+import re
+from collections import deque
+
+import gevent
+
+from app.service.log_store import LogStore
+
+
+class LogSearchIndex(object):
+    TOKEN_PATTERN = re.compile(rb'[a-z0-9_]{3,64}')
+    DEFAULT_MAX_TOKENS = 500000
+    DEFAULT_MAX_MATCHES = 50
+    DEFAULT_MAX_SCAN = 64 * 1024 * 1024  # log bytes read by one search
+    MAX_LINE_LENGTH = 1024
+    MAX_REGEX_LENGTH = 256
+    YIELD_LINES = 1000  # lines tokenized or scanned between gevent switches
+
+    LINE_FIELD = 'line'
+    TEXT_FIELD = 'text'
+
+    def __init__(self, store: LogStore, max_tokens=DEFAULT_MAX_TOKENS, ignore_suffix=None, max_scan=DEFAULT_MAX_SCAN):
+        # token -> keys whose current log contains it, stale keys only cost a verification scan,
+        # max_tokens caps the (token, key) entries, once reached they are not indexed and lookups of unknown tokens
+        # scan every log, indexing runs in a worker greenlet, built lazily on the first search and fed with appended
+        # bytes after
+        self._store = store
+        self._max_tokens = max_tokens
+        self._max_scan = max_scan
+        self._ignore_suffix = ignore_suffix
+        self._postings = {}
+        self._tokens = {}  # key -> its tokens, to drop the key from postings
+        self._entries = 0  # (token, key) entries in postings, each one is in _tokens too
+        self._queue = deque()
+        self._worker = None
+        self._building = False
+        self._built = False
+        self._overflowed = False
+
+    @staticmethod
+    def tokenize(data: bytes) -> set:
+        return set(LogSearchIndex.TOKEN_PATTERN.findall(data.lower()))
+
+    @staticmethod
+    def compile_regex(term: str):
+        # user patterns run on the event loop, the ones that can backtrack exponentially are refused:
+        # a repeated group holding a quantifier or an alternation, like (a+)+ or (a|aa)*, and backreferences
+        if len(term) > LogSearchIndex.MAX_REGEX_LENGTH:
+            raise re.error('pattern longer than {0}'.format(LogSearchIndex.MAX_REGEX_LENGTH))
+
+        groups = [False]  # per open group, whether it holds a quantifier or an alternation
+        i = 0
+        while i < len(term):
+            char = term[i]
+            if char == '\\':
+                if term[i + 1:i + 2].isdigit():
+                    raise re.error('backreferences are not allowed')
+                i += 2
+                continue
+            if char == '[':
+                # a set, quantifiers inside are plain characters
+                i += 1
+                if term[i:i + 1] == '^':
+                    i += 1
+                if term[i:i + 1] == ']':
+                    i += 1
+                while i < len(term) and term[i] != ']':
+                    i += 2 if term[i] == '\\' else 1
+            elif char == '(':
+                if term[i + 1:i + 3] == '?P' and term[i + 3:i + 4] == '=':
+                    raise re.error('backreferences are not allowed')
+                groups.append(False)
+            elif char == ')' and len(groups) > 1:
+                risky = groups.pop()
+                if risky and term[i + 1:i + 2] in ('*', '+', '{'):
+                    raise re.error('nested quantifiers are not allowed')
+                groups[-1] = groups[-1] or risky
+            elif char in ('*', '+', '{', '|'):
+                groups[-1] = True
+            i += 1
+        return re.compile(term.encode('utf-8'), re.IGNORECASE)
+
+    def on_ingested(self, key: str, path: str, entry: dict):
+        if not self._building and not self._built:
+            return  # picked up by the lazy rebuild
+        if self._ignore_suffix and key.endswith(self._ignore_suffix):
+            return
+
+        self._queue.append((key, path, entry))
+        self.__wake()
+
+    def search(self, term: str, keys: list, regex=False, max_matches=DEFAULT_MAX_MATCHES) -> tuple:
+        # returns ({key: [{line, text}]} for keys whose current log matches term, False if the scan stopped at
+        # max_scan bytes)
+        if not self._built and not self._building:
+            self._building = True
+            self._queue.appendleft(None)  # rebuild
+            self.__wake()
+
+        if regex:
+            pattern = LogSearchIndex.compile_regex(term)
+            candidates = keys
+        elif not self._built:
+            # every log is scanned until the index is ready
+            pattern = None
+            needle = term.lower().encode('utf-8')
+            candidates = keys
+        else:
+            self.__prune()
+            needle = term.lower().encode('utf-8')
+            pattern = None
+            candidates = self.__find_candidates(needle, keys)
+
+        result = {}
+        scanned = 0
+        for key in candidates:
+            path = self._store.get_current_path(key) if LogStore.is_valid_key(key) else None
+            if not path:
+                continue
+
+            gevent.sleep(0)
+            matches = []
+            with open(path, 'rb') as f:
+                for number, line in enumerate(f, 1):
+                    scanned += len(line)
+                    if scanned > self._max_scan:
+                        if matches:
+                            result[key] = matches
+                        return result, False
+                    if number % LogSearchIndex.YIELD_LINES == 0:
+                        gevent.sleep(0)
+
+                    line = line[:LogSearchIndex.MAX_LINE_LENGTH]
+                    found = pattern.search(line) if pattern else needle in line.lower()
+                    if not found:
+                        continue
+
+                    text = line.rstrip(b'\r\n').decode('utf-8', 'replace')
+                    matches.append({LogSearchIndex.LINE_FIELD: number, LogSearchIndex.TEXT_FIELD: text})
+                    if len(matches) >= max_matches:
+                        break
+
+            if matches:
+                result[key] = matches
+        return result, True
+
+    # private
+    def __find_candidates(self, needle: bytes, keys: list) -> list:
+        # a needle token touching the needle edge may be only part of a longer token in the log
+        candidates = set(keys)
+        for match in LogSearchIndex.TOKEN_PATTERN.finditer(needle):
+            posting = self.__lookup(match.group(0), match.start() == 0, match.end() == len(needle))
+            if posting is None:
+                continue
+
+            candidates &= posting
+            if not candidates:
+                return []
+        return [key for key in keys if key in candidates]
+
+    def __lookup(self, token: bytes, open_left: bool, open_right: bool):
+        # None means the index can't tell, because tokens were not indexed
+        if not open_left and not open_right:
+            posting = self._postings.get(token)
+            if posting is None:
+                return None if self._overflowed else set()
+            return posting
+
+        result = set()
+        for indexed, posting in self._postings.items():
+            if open_left and open_right:
+                found = token in indexed
+            elif open_left:
+                found = indexed.endswith(token)
+            else:
+                found = indexed.startswith(token)
+
+            if found:
+                result |= posting
+
+        if self._overflowed:
+            return None
+        return result
+
+    def __wake(self):
+        if self._worker is None or self._worker.dead:
+            self._worker = gevent.spawn(self.__run)
+
+    def __run(self):
+        while self._queue:
+            item = self._queue.popleft()
+            if item is None:
+                self.__rebuild()
+                continue
+
+            key, path, entry = item
+            try:
+                # the log was replaced, or changed again since this upload, its tokens are indexed anew
+                start = entry.get(LogStore.APPENDED_FROM_FIELD, 0)
+                if not start or os.path.getsize(path) != entry.get(LogStore.SIZE_FIELD):
+                    self.__remove(key)
+                    start = 0
+                self.__add(key, path, start)
+            except OSError:
+                self.__remove(key)
+
+    def __add(self, key: str, path: str, start=0):
+        tokens = self._tokens.setdefault(key, set())
+        with open(path, 'rb') as f:
+            f.seek(start)
+            for number, line in enumerate(f, 1):
+                if number % LogSearchIndex.YIELD_LINES == 0:
+                    gevent.sleep(0)
+
+                for token in LogSearchIndex.tokenize(line):
+                    if token in tokens:
+                        continue
+                    if self._entries >= self._max_tokens:
+                        self._overflowed = True
+                        continue
+
+                    self._postings.setdefault(token, set()).add(key)
+                    tokens.add(token)
+                    self._entries += 1
+
+    def __remove(self, key: str):
+        for token in self._tokens.pop(key, ()):
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+
+            posting.discard(key)
+            self._entries -= 1
+            if not posting:
+                del self._postings[token]
+
+    def __prune(self):
+        # keys whose log is gone
+        keys = set(self._store.get_keys())
+        for key in [key for key in self._tokens if key not in keys]:
+            self.__remove(key)
+
+    def __rebuild(self):
+        self._postings.clear()
+        self._tokens.clear()
+        self._entries = 0
+        self._overflowed = False
+        for key in self._store.get_keys():
+            if self._ignore_suffix and key.endswith(self._ignore_suffix):
+                continue
+
+            path = self._store.get_current_path(key)
+            if path:
+                try:
+                    self.__add(key, path)
+                except OSError:
+                    self.__remove(key)
+        self._building = False
+        self._built = True
@@ -0,0 +1,339 @@
+import gzip
+import json
+import os
+import re
+import shutil
+import uuid
+import zlib
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from flask import Response, current_app, request, send_file, stream_with_context
+from pyfastocloud_models.utils.utils import date_to_utc_msec
+
+
+class LogsDelivery:
+    PYTHON = 'python'
+    NGINX = 'nginx'
+
+    DEFAULT_ACCEL_LOCATION = '/runtime_folder/'
+
+
+class LogStore(object):
+    CURRENT_FILE_NAME = 'current.log'
+    GENERATION_FILE_TEMPLATE_1I = '{0}.log.gz'
+    INDEX_FILE_NAME = 'index.json'
+    TMP_FILE_TEMPLATE_1S = 'upload_{0}.tmp'
+    DEFAULT_GENERATIONS = 5
+    DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+    DEFAULT_CHUNK_SIZE = 64 * 1024
+    LINE_INDEX_STEP = 1000
+    COMPARE_PREFIX_SIZE = 4096
+
+    TIMESTAMP_FIELD = 'timestamp'
+    SIZE_FIELD = 'size'
+    LINES_FIELD = 'lines'
+    LINE_OFFSETS_FIELD = 'line_offsets'
+    APPENDED_FROM_FIELD = 'appended_from'
+
+    KEY_PATTERN = re.compile(r'^[\w\-]+$')
+    ROOM_TEMPLATE_2S = 'log_{0}_{1}'
+    TAIL_PUSH_MAX_SIZE = 64 * 1024
+    MAX_TAIL_LINES = 10000
+
+    def __init__(self, root: str, generations=DEFAULT_GENERATIONS, max_size=DEFAULT_MAX_SIZE,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self._root = root
+        self._generations = max(generations, 1)
+        self._max_size = max_size
+        self._chunk_size = chunk_size
+        self._listeners = []
+
+    @staticmethod
+    def is_valid_key(key: str) -> bool:
+        return bool(key) and LogStore.KEY_PATTERN.match(key) is not None
+
+    @staticmethod
+    def get_room(store_name: str, key: str) -> str:
+        return LogStore.ROOM_TEMPLATE_2S.format(store_name, key)
+
+    @staticmethod
+    def read_appended(path: str, entry: dict, max_size=TAIL_PUSH_MAX_SIZE) -> (int, bytes):
+        # bytes added by the last upload, limited to the last max_size bytes
+        size = entry[LogStore.SIZE_FIELD]
+        start = max(entry.get(LogStore.APPENDED_FROM_FIELD, 0), size - max_size)
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return start, f.read(size - start)
+
+    def add_listener(self, listener):
+        # listener(key: str, path: str, entry: dict) is called after every ingested upload
+        self._listeners.append(listener)
+
+    def ingest(self, key: str, stream) -> dict:
+        # stream is a file like object, the upload is written to disk chunk by chunk and becomes
+        # the current generation, the previous one is compressed
+        folder = self.__get_folder(key)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        tmp_path = os.path.join(folder, LogStore.TMP_FILE_TEMPLATE_1S.format(uuid.uuid4().hex))
+        size = 0
+        lines = 0
+        line_offsets = [0]
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(self._chunk_size)
+                    if not chunk:
+                        break
+
+                    pos = chunk.find(b'\n')
+                    while pos != -1:
+                        lines += 1
+                        if lines % LogStore.LINE_INDEX_STEP == 0:
+                            line_offsets.append(size + pos + 1)
+                        pos = chunk.find(b'\n', pos + 1)
+
+                    f.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        current_path = os.path.join(folder, LogStore.CURRENT_FILE_NAME)
+        entry = {LogStore.TIMESTAMP_FIELD: date_to_utc_msec(datetime.now()), LogStore.SIZE_FIELD: size,
+                 LogStore.LINES_FIELD: lines, LogStore.LINE_OFFSETS_FIELD: line_offsets,
+                 LogStore.APPENDED_FROM_FIELD: LogStore.__find_appended_from(current_path, tmp_path, size)}
+        index = self.get_index(key)
+        if os.path.exists(current_path):
+            index = self.__rotate(folder, current_path, index, size)
+        os.replace(tmp_path, current_path)
+
+        index.insert(0, entry)
+        self.__save_index(folder, index)
+        for listener in self._listeners:
+            listener(key, current_path, entry)
+        return entry
+
+    def import_legacy(self, folder: str) -> int:
+        # logs were single files named by key (runtime_folder/<sid>, runtime_folder/stream/<sid>), they become the
+        # current generation of their key unless it already has one
+        if not os.path.isdir(folder):
+            return 0
+
+        imported = 0
+        for key in os.listdir(folder):
+            # keys are ids of services or streams, '<sid>_pipeline' for pipeline dumps
+            path = os.path.join(folder, key)
+            if not LogStore.is_valid_key(key) or not ObjectId.is_valid(key.split('_', 1)[0]) or \
+                    not os.path.isfile(path):
+                continue
+
+            if not self.get_current_path(key):
+                with open(path, 'rb') as f:
+                    self.ingest(key, f)
+                imported += 1
+            os.unlink(path)
+        return imported
+
+    def get_keys(self) -> list:
+        if not os.path.exists(self._root):
+            return []
+
+        keys = []
+        for key in os.listdir(self._root):
+            if LogStore.is_valid_key(key) and os.path.exists(os.path.join(self._root, key, LogStore.CURRENT_FILE_NAME)):
+                keys.append(key)
+        return keys
+
+    def get_current_path(self, key: str):
+        path = os.path.join(self.__get_folder(key), LogStore.CURRENT_FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def get_generation_path(self, key: str, generation: int):
+        if generation == 0:
+            return self.get_current_path(key)
+
+        path = os.path.join(self.__get_folder(key), LogStore.GENERATION_FILE_TEMPLATE_1I.format(generation))
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def get_index(self, key: str) -> list:
+        # entries are ordered from the current generation to the oldest one
+        path = os.path.join(self.__get_folder(key), LogStore.INDEX_FILE_NAME)
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    # private
+    @staticmethod
+    def __find_appended_from(current_path: str, new_path: str, new_size: int) -> int:
+        # nodes upload the whole log file, when it only grew the previous upload is a prefix of the new one
+        try:
+            current_size = os.path.getsize(current_path)
+            if current_size > new_size:
+                return 0
+
+            compare_size = min(current_size, LogStore.COMPARE_PREFIX_SIZE)
+            with open(current_path, 'rb') as current, open(new_path, 'rb') as new:
+                if current.read(compare_size) != new.read(compare_size):
+                    return 0
+            return current_size
+        except OSError:
+            return 0
+
+    def __get_folder(self, key: str) -> str:
+        if not LogStore.is_valid_key(key):
+            raise ValueError('Invalid log key: {0}'.format(key))
+        return os.path.join(self._root, key)
+
+    def __rotate(self, folder: str, current_path: str, index: list, incoming_size: int) -> list:
+        for generation in range(self._generations - 1, 0, -1):
+            path = os.path.join(folder, LogStore.GENERATION_FILE_TEMPLATE_1I.format(generation))
+            if not os.path.exists(path):
+                continue
+
+            if generation == self._generations - 1:
+                os.unlink(path)
+            else:
+                os.replace(path, os.path.join(folder, LogStore.GENERATION_FILE_TEMPLATE_1I.format(generation + 1)))
+
+        if self._generations > 1:
+            with open(current_path, 'rb') as f_in, gzip.open(
+                    os.path.join(folder, LogStore.GENERATION_FILE_TEMPLATE_1I.format(1)), 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out, self._chunk_size)
+        index = index[:self._generations - 1]
+
+        # size based limit over the incoming upload and the compressed generations, oldest ones are dropped first
+        total = incoming_size
+        for generation in range(1, len(index) + 1):
+            path = os.path.join(folder, LogStore.GENERATION_FILE_TEMPLATE_1I.format(generation))
+            if not os.path.exists(path):
+                return index[:generation - 1]
+
+            total += os.path.getsize(path)
+            if total > self._max_size:
+                for stale in range(generation, self._generations):
+                    stale_path = os.path.join(folder, LogStore.GENERATION_FILE_TEMPLATE_1I.format(stale))
+                    if os.path.exists(stale_path):
+                        os.unlink(stale_path)
+                return index[:generation - 1]
+        return index
+
+    def __save_index(self, folder: str, index: list):
+        path = os.path.join(folder, LogStore.INDEX_FILE_NAME)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+
+
+def iterate_file(path: str, start=0, length=None, chunk_size=LogStore.DEFAULT_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length is None or length > 0:
+            chunk = f.read(chunk_size if length is None else min(chunk_size, length))
+            if not chunk:
+                break
+
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+
+
+def read_tail(path: str, lines: int, max_size=LogStore.DEFAULT_MAX_SIZE, chunk_size=LogStore.DEFAULT_CHUNK_SIZE):
+    # reads backwards from the end of file until enough lines or max_size bytes are collected, at most
+    # MAX_TAIL_LINES lines whatever was asked
+    lines = min(lines, LogStore.MAX_TAIL_LINES)
+    if lines <= 0:
+        return b''
+
+    chunks = []
+    count = 0
+    size = 0
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        while pos > 0 and count <= lines and size < max_size:
+            step = min(chunk_size, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            chunks.append(chunk)
+            count += chunk.count(b'\n')
+            size += len(chunk)
+
+    chunks.reverse()
+    return b''.join(b''.join(chunks).splitlines(keepends=True)[-lines:])
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def make_chunks_response(chunks, mimetype='text/html') -> Response:
+    if 'gzip' in request.accept_encodings:
+        response = Response(stream_with_context(gzip_chunks(chunks)), mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def make_tail_response(path: str, lines: int) -> Response:
+    return make_chunks_response(iter([read_tail(path, lines)]), mimetype='text/plain')
+
+
+def make_range_response(path: str) -> Response:
+    size = os.path.getsize(path)
+    byte_range = request.range.range_for_length(size) if request.range else None
+    if request.range and not byte_range:
+        response = Response(status=416, mimetype='text/plain')
+        response.headers['Content-Range'] = 'bytes */{0}'.format(size)
+        return response
+
+    if not byte_range:
+        response = Response(stream_with_context(iterate_file(path)), mimetype='text/plain')
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.content_length = size
+        return response
+
+    start, stop = byte_range
+    response = Response(stream_with_context(iterate_file(path, start, stop - start)), status=206,
+                        mimetype='text/plain')
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, stop - 1, size)
+    response.content_length = stop - start
+    return response
+
+
+def make_file_response(path: str, root: str, mimetype='text/plain') -> Response:
+    # LOGS_DELIVERY = 'nginx' hands the file to an internal nginx location mapped on root (zero copy sendfile)
+    if current_app.config.get('LOGS_DELIVERY', LogsDelivery.PYTHON) == LogsDelivery.NGINX:
+        location = current_app.config.get('LOGS_ACCEL_LOCATION', LogsDelivery.DEFAULT_ACCEL_LOCATION)
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = location + os.path.relpath(path, root).replace(os.sep, '/')
+        return response
+
+    if not request.range and 'gzip' in request.accept_encodings:
+        # compressed on the fly, validated like send_file with an etag of its own
+        stat = os.stat(path)
+        response = make_chunks_response(iterate_file(path), mimetype)
+        response.set_etag('{0}-{1}-gzip'.format(stat.st_mtime, stat.st_size))
+        response.last_modified = int(stat.st_mtime)
+        return response.make_conditional(request)
+
+    return send_file(path, mimetype=mimetype, conditional=True)
@@ -0,0 +1,144 @@
+import logging
+import time
+from urllib.parse import urlparse
+
+import gevent
+from pyfastocloud.client_constants import ClientStatus
+
+from app.service.http_pool import HttpPool
+from app.service.stream import HardwareStreamObject
+
+
+class OutputStatus:
+    OK = 'ok'
+    STALE = 'stale'  # playlist answers but does not advance
+    FAILED = 'failed'
+
+
+class OutputFields:
+    STREAM_ID = 'stream_id'
+    URL = 'url'
+    STATUS = 'status'
+    MEDIA_SEQUENCE = 'media_sequence'
+    LAST_ADVANCE = 'last_advance'
+    SEGMENT_AGE = 'segment_age'
+    ERROR = 'error'
+    CHECKED = 'checked'
+
+
+class OutputMonitor(object):
+    DEFAULT_INTERVAL = 30
+    DEFAULT_STALE_AFTER = 30
+    PLAYLIST_MAX_SIZE = 256 * 1024
+    # a playlist that did not advance for this many target durations is stale
+    STALE_TARGET_DURATIONS = 3
+    MEDIA_SEQUENCE_TAG = '#EXT-X-MEDIA-SEQUENCE:'
+    TARGET_DURATION_TAG = '#EXT-X-TARGETDURATION:'
+
+    def __init__(self, pool: HttpPool, get_services, interval=DEFAULT_INTERVAL, stale_after=DEFAULT_STALE_AFTER):
+        # get_services() returns the services to watch, only started hardware streams of active ones are checked,
+        # changes of output status are reported to the service through on_output_status_changed
+        self._pool = pool
+        self._get_services = get_services
+        self._interval = interval
+        self._stale_after = stale_after
+        self._states = {}  # url -> state dict
+        self._stop_listen = False
+
+    def stop(self):
+        self._stop_listen = True
+
+    def run(self):
+        while not self._stop_listen and self._interval > 0:
+            started = time.time()
+            try:
+                self.check()
+            except Exception as ex:
+                logging.error('Output monitoring failed: %s', str(ex))
+            gevent.sleep(max(self._interval - (time.time() - started), 1))
+
+    def check(self):
+        targets = []
+        for service in self._get_services():
+            if service.status != ClientStatus.ACTIVE:
+                continue
+
+            for stream in service.get_streams():
+                if not isinstance(stream, HardwareStreamObject) or not stream.is_started():
+                    continue
+
+                for output in stream.stream().output:
+                    if urlparse(output.uri).scheme in ('http', 'https'):
+                        targets.append((service, str(stream.id), output.uri))
+
+        urls = [url for _, _, url in targets]
+        responses = self._pool.fetch_many(urls, max_body=OutputMonitor.PLAYLIST_MAX_SIZE)
+        watched = set()
+        for (service, sid, url), response in zip(targets, responses):
+            watched.add(url)
+            previous = self._states.get(url)
+            state = self.__update_state(sid, url, previous, response)
+            self._states[url] = state
+            if not previous or previous[OutputFields.STATUS] != state[OutputFields.STATUS]:
+                service.on_output_status_changed(state)
+
+        # stopped or removed streams
+        for url in list(self._states.keys()):
+            if url not in watched:
+                del self._states[url]
+
+    def get_status(self, stream_ids: list) -> list:
+        ids = set(str(sid) for sid in stream_ids)
+        return [state for state in self._states.values() if state[OutputFields.STREAM_ID] in ids]
+
+    # private
+    def __update_state(self, sid: str, url: str, previous: dict, response) -> dict:
+        now = time.time()
+        state = {OutputFields.STREAM_ID: sid, OutputFields.URL: url, OutputFields.STATUS: OutputStatus.FAILED,
+                 OutputFields.MEDIA_SEQUENCE: None, OutputFields.LAST_ADVANCE: now, OutputFields.SEGMENT_AGE: None,
+                 OutputFields.ERROR: response.error, OutputFields.CHECKED: now}
+        if previous:
+            state[OutputFields.MEDIA_SEQUENCE] = previous[OutputFields.MEDIA_SEQUENCE]
+            state[OutputFields.LAST_ADVANCE] = previous[OutputFields.LAST_ADVANCE]
+
+        if not response.ok:
+            return state
+
+        lines = [line.strip() for line in response.body.decode('utf-8', 'replace').splitlines()]
+        if '#EXT-X-ENDLIST' in lines:
+            state[OutputFields.STATUS] = OutputStatus.OK
+            return state
+
+        sequence = OutputMonitor.__get_tag_value(lines, OutputMonitor.MEDIA_SEQUENCE_TAG)
+        # a playlist without media sequence is compared by its segments
+        if sequence is None:
+            segments = [line for line in lines if line and not line.startswith('#')]
+            sequence = segments[-1] if segments else None
+
+        if sequence != state[OutputFields.MEDIA_SEQUENCE]:
+            state[OutputFields.MEDIA_SEQUENCE] = sequence
+            state[OutputFields.LAST_ADVANCE] = now
+
+        last_modified = response.get_last_modified()
+        if last_modified is not None:
+            state[OutputFields.SEGMENT_AGE] = max(int(now - last_modified), 0)
+
+        target_duration = OutputMonitor.__get_tag_value(lines, OutputMonitor.TARGET_DURATION_TAG)
+        stale_after = self._stale_after
+        if isinstance(target_duration, int):
+            stale_after = max(stale_after, target_duration * OutputMonitor.STALE_TARGET_DURATIONS)
+
+        # without history the playlist modification time is the only hint
+        age = now - state[OutputFields.LAST_ADVANCE]
+        if not previous and state[OutputFields.SEGMENT_AGE] is not None:
+            age = state[OutputFields.SEGMENT_AGE]
+        state[OutputFields.STATUS] = OutputStatus.OK if age <= stale_after else OutputStatus.STALE
+        return state
+
+    @staticmethod
+    def __get_tag_value(lines: list, tag: str):
+        for line in lines:
+            if line.startswith(tag):
+                value = line[len(tag):]
+                return int(value) if value.isdigit() else value
+        return None
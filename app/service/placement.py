@@ -0,0 +1,169 @@
+import pyfastocloud_models.constants as constants
+from pyfastocloud.client_constants import ClientStatus
+from pyfastocloud_models.stream.entry import IStream
+
+
+class StreamCost(object):
+    __slots__ = ['cpu', 'memory', 'bandwidth']
+
+    def __init__(self, cpu=0.0, memory=0, bandwidth=0):
+        self.cpu = cpu  # percents of node cpu
+        self.memory = memory  # bytes
+        self.bandwidth = bandwidth  # bytes per second
+
+    def to_dict(self) -> dict:
+        return {'cpu': self.cpu, 'memory': self.memory, 'bandwidth': self.bandwidth}
+
+
+class PlacementEngine(object):
+    # every relay channel takes about 1% cpu, encoding cost grows with the output frame size
+    RELAY_CPU = 1.0
+    ENCODE_CPU_PER_MEGAPIXEL = 5.0
+    DEFAULT_FRAME_PIXELS = 1920 * 1080
+    STREAM_MEMORY = 64 * 1024 * 1024
+    DEFAULT_BITRATE = 4 * 1024 * 1024 // 8
+    DEFAULT_NODE_BANDWIDTH = 1024 * 1024 * 1024 // 8
+    DEFAULT_MAX_MOVES = 50
+    DEFAULT_TOLERANCE = 0.1
+
+    RELAY_TYPES = [constants.StreamType.RELAY, constants.StreamType.TIMESHIFT_RECORDER,
+                   constants.StreamType.TIMESHIFT_PLAYER, constants.StreamType.CATCHUP, constants.StreamType.TEST_LIFE,
+                   constants.StreamType.VOD_RELAY, constants.StreamType.COD_RELAY]
+    ENCODE_TYPES = [constants.StreamType.ENCODE, constants.StreamType.VOD_ENCODE, constants.StreamType.COD_ENCODE,
+                    constants.StreamType.EVENT]
+
+    def __init__(self, node_bandwidth=DEFAULT_NODE_BANDWIDTH):
+        self._node_bandwidth = node_bandwidth
+
+    @staticmethod
+    def estimate_cost(stream: IStream) -> StreamCost:
+        return PlacementEngine.estimate_type_cost(stream.get_type(), stream)
+
+    @staticmethod
+    def estimate_type_cost(stream_type: constants.StreamType, stream=None) -> StreamCost:
+        if stream_type in PlacementEngine.RELAY_TYPES:
+            return StreamCost(PlacementEngine.RELAY_CPU, PlacementEngine.STREAM_MEMORY,
+                              PlacementEngine.DEFAULT_BITRATE)
+
+        if stream_type in PlacementEngine.ENCODE_TYPES:
+            pixels = PlacementEngine.DEFAULT_FRAME_PIXELS
+            bitrate = PlacementEngine.DEFAULT_BITRATE
+            if stream:
+                if stream.size.is_valid():
+                    width, _, height = str(stream.size).partition('x')
+                    if width.isdigit() and height.isdigit():
+                        pixels = int(width) * int(height)
+
+                video_bitrate = stream.get_video_bit_rate()
+                audio_bitrate = stream.get_audio_bit_rate()
+                if video_bitrate:
+                    bitrate = (video_bitrate + (audio_bitrate or 0)) // 8
+
+            cpu = PlacementEngine.ENCODE_CPU_PER_MEGAPIXEL * pixels / (1000 * 1000)
+            return StreamCost(cpu, PlacementEngine.STREAM_MEMORY, bitrate)
+
+        # proxy streams are served from their origin
+        return StreamCost()
+
+    def get_load(self, service) -> StreamCost:
+        # measured load, the estimated cost of the started streams when stats lag behind, stopped streams cost nothing
+        started = [PlacementEngine.estimate_cost(stream.stream()) for stream in service.get_streams() if
+                   stream.is_started()]
+        return StreamCost(max(service.cpu, sum(cost.cpu for cost in started)),
+                          max(service.memory_total - service.memory_free, sum(cost.memory for cost in started)),
+                          max(service.bandwidth_in, service.bandwidth_out, sum(cost.bandwidth for cost in started)))
+
+    def score(self, service, cost: StreamCost, load=None) -> float:
+        # smallest relative headroom left on cpu, memory and bandwidth after adding cost, None if the node is down
+        if service.status != ClientStatus.ACTIVE or not service.memory_total:
+            return None
+
+        if not load:
+            load = self.get_load(service)
+
+        cpu = (100 - load.cpu - cost.cpu) / 100
+        memory = (service.memory_total - load.memory - cost.memory) / service.memory_total
+        bandwidth = (self._node_bandwidth - load.bandwidth - cost.bandwidth) / self._node_bandwidth
+        return min(cpu, memory, bandwidth)
+
+    def choose(self, services: list, cost: StreamCost):
+        # returns the service with the biggest headroom and the scores of all candidates
+        best = None
+        best_score = None
+        scores = []
+        for service in services:
+            score = self.score(service, cost)
+            scores.append({'id': str(service.id), 'score': score})
+            if score is not None and (best_score is None or score > best_score):
+                best = service
+                best_score = score
+
+        return best, scores
+
+    def plan(self, services: list, costs: list) -> list:
+        # greedy bulk placement, the projected load of each service grows with every assigned stream
+        loads = {service.id: self.get_load(service) for service in services}
+        result = []
+        for cost in costs:
+            best = None
+            best_score = None
+            for service in services:
+                score = self.score(service, cost, loads[service.id])
+                if score is not None and (best_score is None or score > best_score):
+                    best = service
+                    best_score = score
+
+            if best:
+                loads[best.id] = PlacementEngine.__shift(loads[best.id], cost, 1)
+            result.append(best)
+        return result
+
+    def rebalance(self, services: list, max_moves=DEFAULT_MAX_MOVES, tolerance=DEFAULT_TOLERANCE) -> list:
+        # suggests moves from the service with the least headroom to the one with the most, one stream at a time,
+        # until headroom differs by less than tolerance or no move improves the worst service
+        empty = StreamCost()
+        active = [service for service in services if self.score(service, empty) is not None]
+        if len(active) < 2:
+            return []
+
+        loads = {service.id: self.get_load(service) for service in active}
+        candidates = {}
+        for service in active:
+            # only started streams add load and are worth moving
+            costs = [(stream.id, PlacementEngine.estimate_cost(stream.stream())) for stream in service.get_streams() if
+                     stream.is_started()]
+            candidates[service.id] = [(sid, cost) for sid, cost in costs if cost.cpu or cost.bandwidth]
+
+        moves = []
+        while len(moves) < max_moves:
+            active.sort(key=lambda service: self.score(service, empty, loads[service.id]))
+            source = active[0]
+            target = active[-1]
+            worst = self.score(source, empty, loads[source.id])
+            if self.score(target, empty, loads[target.id]) - worst <= tolerance:
+                break
+
+            best = None
+            best_score = worst
+            for sid, cost in candidates[source.id]:
+                after = min(self.score(source, empty, PlacementEngine.__shift(loads[source.id], cost, -1)),
+                            self.score(target, cost, loads[target.id]))
+                if after > best_score:
+                    best = (sid, cost)
+                    best_score = after
+
+            if not best:
+                break
+
+            sid, cost = best
+            loads[source.id] = PlacementEngine.__shift(loads[source.id], cost, -1)
+            loads[target.id] = PlacementEngine.__shift(loads[target.id], cost, 1)
+            candidates[source.id].remove(best)
+            moves.append({'stream': str(sid), 'source': str(source.id), 'target': str(target.id)})
+        return moves
+
+    # private
+    @staticmethod
+    def __shift(load: StreamCost, cost: StreamCost, sign: int) -> StreamCost:
+        return StreamCost(load.cpu + sign * cost.cpu, load.memory + sign * cost.memory,
+                          load.bandwidth + sign * cost.bandwidth)
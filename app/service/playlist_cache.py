@@ -0,0 +1,78 @@
+import gzip
+import hashlib
+from collections import OrderedDict
+
+from flask import Response, request
+
+
+class CachedPlaylist(object):
+    MIMETYPE = 'application/x-mpequrl'
+
+    __slots__ = ['content', 'etag', '_gzipped']
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.etag = hashlib.md5(content).hexdigest()
+        self._gzipped = None
+
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.content)
+        return self._gzipped
+
+    def make_response(self) -> Response:
+        if 'gzip' in request.accept_encodings:
+            response = Response(self.gzipped(), mimetype=CachedPlaylist.MIMETYPE)
+            response.headers['Content-Encoding'] = 'gzip'
+            response.set_etag(self.etag + '-gzip')
+        else:
+            response = Response(self.content, mimetype=CachedPlaylist.MIMETYPE)
+            response.set_etag(self.etag)
+
+        response.vary.add('Accept-Encoding')
+        return response.make_conditional(request)
+
+
+class PlaylistCache(object):
+    SERVICE_KEY_TEMPLATE_1S = 'service_{0}'
+    STREAM_KEY_TEMPLATE_1S = 'stream_{0}'
+    DEFAULT_MAX_ENTRIES = 4096
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._playlists = OrderedDict()
+
+    def get_service_playlist(self, sid, generate) -> CachedPlaylist:
+        return self.__get(PlaylistCache.SERVICE_KEY_TEMPLATE_1S.format(sid), generate)
+
+    def get_stream_playlist(self, sid, generate) -> CachedPlaylist:
+        return self.__get(PlaylistCache.STREAM_KEY_TEMPLATE_1S.format(sid), generate)
+
+    def invalidate_service(self, sid):
+        self._playlists.pop(PlaylistCache.SERVICE_KEY_TEMPLATE_1S.format(sid), None)
+
+    def invalidate_stream(self, sid):
+        self._playlists.pop(PlaylistCache.STREAM_KEY_TEMPLATE_1S.format(sid), None)
+
+    def clear(self):
+        self._playlists.clear()
+
+    # private
+    def __get(self, key: str, generate) -> CachedPlaylist:
+        playlist = self._playlists.get(key)
+        if playlist:
+            self._playlists.move_to_end(key)
+            return playlist
+
+        content = generate()
+        if content is None:
+            return None
+
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+
+        playlist = CachedPlaylist(content)
+        self._playlists[key] = playlist
+        while len(self._playlists) > self._max_entries:
+            self._playlists.popitem(last=False)
+        return playlist
@@ -0,0 +1,116 @@
+import re
+
+EXTINF_TAG = '#EXTINF:'
+EXTGRP_TAG = '#EXTGRP:'
+DEFAULT_BATCH_SIZE = 1000
+MAX_LINE_LENGTH = 64 * 1024
+ATTRIBUTE_PATTERN = re.compile(r'([\w-]+)=(?:"([^"]*)"|([^\s,"]*))')
+# attributes with their own fields, everything else stays in M3uEntry.attributes
+KNOWN_ATTRIBUTES = {'tvg-id': 'tvg_id', 'tvg-name': 'tvg_name', 'tvg-logo': 'tvg_logo', 'group-title': 'tvg_group'}
+
+
+class M3uEntry(object):
+    __slots__ = ['title', 'link', 'duration', 'tvg_id', 'tvg_name', 'tvg_logo', 'tvg_group', 'attributes']
+
+    def __init__(self, link: str, title='', duration=-1):
+        self.link = link
+        self.title = title
+        self.duration = duration
+        self.tvg_id = ''
+        self.tvg_name = ''
+        self.tvg_logo = ''
+        self.tvg_group = ''
+        self.attributes = None  # other extinf attributes, dict when present
+
+
+def _decode_line(raw: bytes) -> str:
+    # uploads are utf-8 in theory, single byte encodings (cp1252 names) in practice
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('cp1252', 'replace')
+
+
+def _iterate_lines(stream):
+    first = True
+    while True:
+        raw = stream.readline(MAX_LINE_LENGTH)
+        if not raw:
+            return
+
+        if len(raw) == MAX_LINE_LENGTH and not raw.endswith(b'\n'):
+            # oversized line, its rest must not be taken for an url
+            while raw and not raw.endswith(b'\n'):
+                raw = stream.readline(MAX_LINE_LENGTH)
+            continue
+
+        if first:
+            raw = raw.lstrip(b'\xef\xbb\xbf')
+            first = False
+        line = _decode_line(raw).strip()
+        if line:
+            yield line
+
+
+def _parse_extinf(line: str) -> M3uEntry:
+    # #EXTINF:-1 tvg-id="a" group-title="b, c",Title, with commas
+    info = line[len(EXTINF_TAG):]
+    quoted = False
+    split = -1
+    for pos, char in enumerate(info):
+        if char == '"':
+            quoted = not quoted
+        elif char == ',' and not quoted:
+            split = pos
+            break
+
+    head, title = (info[:split], info[split + 1:]) if split != -1 else (info, '')
+    duration, _, attributes = head.strip().partition(' ')
+    entry = M3uEntry('', title.strip())
+    try:
+        entry.duration = int(float(duration))
+    except ValueError:
+        pass
+
+    for key, quoted_value, value in ATTRIBUTE_PATTERN.findall(attributes):
+        value = (quoted_value or value).strip()
+        field = KNOWN_ATTRIBUTES.get(key.lower())
+        if field:
+            setattr(entry, field, value)
+        else:
+            if entry.attributes is None:
+                entry.attributes = {}
+            entry.attributes[key] = value
+    return entry
+
+
+def iterate_m3u(stream):
+    # yields M3uEntry for every url of a binary m3u/m3u8 stream, read line by line, bare urls without #EXTINF
+    # are entries too
+    current = None
+    for line in _iterate_lines(stream):
+        if line.startswith(EXTINF_TAG):
+            current = _parse_extinf(line)
+        elif line.startswith(EXTGRP_TAG):
+            if current and not current.tvg_group:
+                current.tvg_group = line[len(EXTGRP_TAG):].strip()
+        elif line.startswith('#'):
+            continue
+        else:
+            entry = current or M3uEntry('')
+            entry.link = line
+            current = None
+            yield entry
+
+
+def iterate_m3u_batches(stream, batch_size=DEFAULT_BATCH_SIZE):
+    # lists of at most batch_size entries, lets callers validate logos per batch
+    batch = []
+    for entry in iterate_m3u(stream):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
@@ -0,0 +1,63 @@
+from pyfastocloud_models.service.entry import ServiceSettings
+from pyfastocloud_models.stream.entry import IStream
+
+PLAYLIST_HEADER = '#EXTM3U\n'
+# fields used by IStream.generate_playlist/generate_input_playlist, everything else stays in mongo
+PLAYLIST_FIELDS = ['_cls', 'name', 'tvg_id', 'tvg_name', 'tvg_logo', 'groups', 'input', 'output']
+DEFAULT_IDS_CHUNK_SIZE = 1000
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+def _iterate_streams(query: dict):
+    return IStream.objects.raw(query).only(*PLAYLIST_FIELDS)
+
+
+def get_service_stream_ids(sid) -> list:
+    for service in ServiceSettings.objects.raw({'_id': sid}).only('streams').values():
+        return service.get('streams', [])
+    return None
+
+
+def generate_m3u(streams, header=True, input_playlist=False, rewrite=None, buffer_size=DEFAULT_BUFFER_SIZE):
+    # yields playlist text in buffer_size chunks, rewrite(stream, entry) can patch every stream entry
+    buffer = [PLAYLIST_HEADER] if header else []
+    buffered = len(PLAYLIST_HEADER) if header else 0
+    for stream in streams:
+        if input_playlist:
+            entry = stream.generate_input_playlist(False)
+        else:
+            entry = stream.generate_playlist(False)
+
+        if rewrite:
+            entry = rewrite(stream, entry)
+
+        buffer.append(entry)
+        buffered += len(entry)
+        if buffered >= buffer_size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+
+    if buffer:
+        yield ''.join(buffer)
+
+
+def iterate_service_streams(stream_ids: list, chunk_size=DEFAULT_IDS_CHUNK_SIZE):
+    # $in returns a chunk in storage order, streams are yielded in stream_ids order, missing ones are skipped
+    for pos in range(0, len(stream_ids), chunk_size):
+        chunk = stream_ids[pos:pos + chunk_size]
+        found = {stream.pk: stream for stream in _iterate_streams({'_id': {'$in': chunk}})}
+        for sid in chunk:
+            stream = found.get(sid)
+            if stream:
+                yield stream
+
+
+def iterate_all_streams():
+    return _iterate_streams({})
+
+
+def write_m3u(path: str, streams, input_playlist=False):
+    with open(path, 'w') as f:
+        for chunk in generate_m3u(streams, input_playlist=input_playlist):
+            f.write(chunk)
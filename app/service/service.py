@@ -1,19 +1,27 @@
+import time
 from datetime import datetime
 
+import gevent
 import pyfastocloud_models.constants as constants
 from bson.objectid import ObjectId
 from pyfastocloud.client_constants import ClientStatus
 from pyfastocloud_models.provider.entry_pair import ProviderPair
 from pyfastocloud_models.service.entry import ServiceSettings
-from pyfastocloud_models.stream.entry import IStream
+from pyfastocloud_models.stream.entry import IStream, CatchupStream
 from pyfastocloud_models.utils.utils import date_to_utc_msec
+from pymongo import UpdateOne
 
+from app.service.circuit_breaker import RestartBreaker
+from app.service.playlist_cache import PlaylistCache
 from app.service.service_client import ServiceClient, OperationSystem, RequestReturn
-from app.service.stream import IStreamObject, ProxyStreamObject, ProxyVodStreamObject, RelayStreamObject, \
-    VodRelayStreamObject, EncodeStreamObject, VodEncodeStreamObject, TimeshiftRecorderStreamObject, \
+from app.service.source_index import SourceIndex
+from app.service.start_scheduler import StartScheduler, StartAction
+from app.service.stream import IStreamObject, HardwareStreamObject, ProxyStreamObject, ProxyVodStreamObject, \
+    RelayStreamObject, VodRelayStreamObject, EncodeStreamObject, VodEncodeStreamObject, TimeshiftRecorderStreamObject, \
     TimeshiftPlayerStreamObject, CatchupStreamObject, EventStreamObject, CodEncodeStreamObject, CodRelayStreamObject, \
     TestLifeStreamObject
 from app.service.stream_handler import IStreamHandler
+from app.service.wire_format import WireFormat, pack_service, pack_stream
 
 
 class OnlineUsers(object):
@@ -53,11 +61,19 @@ class ServiceFields:
     ONLINE_USERS = 'online_users'
     OS = 'os'
 
+    ALL = [ID, CPU, GPU, LOAD_AVERAGE, MEMORY_TOTAL, MEMORY_FREE, HDD_TOTAL, HDD_FREE, BANDWIDTH_IN, BANDWIDTH_OUT,
+           PROJECT, VERSION, EXP_TIME, UPTIME, SYNCTIME, TIMESTAMP, STATUS, ONLINE_USERS, OS]
+
 
 class Service(IStreamHandler):
     SERVER_ID = 'server_id'
     STREAM_DATA_CHANGED = 'stream_data_changed'
     SERVICE_DATA_CHANGED = 'service_data_changed'
+    START_PROGRESS_CHANGED = 'start_progress_changed'
+    OUTPUT_STATUS_CHANGED = 'output_status_changed'
+    SERVICE_ROOM_TEMPLATE_2S = 'service_{0}_{1}'
+    SERVICE_STREAMS_ROOM_TEMPLATE_2S = 'service_streams_{0}_{1}'
+    STREAM_ROOM_TEMPLATE_2S = 'stream_{0}_{1}'
     INIT_VALUE = 0
     CALCULATE_VALUE = None
 
@@ -78,13 +94,22 @@ class Service(IStreamHandler):
     _online_users = None
     _os = OperationSystem()
 
-    def __init__(self, host, port, socketio, settings: ServiceSettings):
+    def __init__(self, host, port, socketio, settings: ServiceSettings, playlist_cache: PlaylistCache,
+                 start_options=None, breaker_options=None):
         self._settings = settings
         # other fields
         self._client = ServiceClient(settings.id, settings.host.host, settings.host.port, self)
         self._host = host
         self._port = port
         self._socketio = socketio
+        self._playlist_cache = playlist_cache
+        # start_options are StartScheduler arguments
+        self._scheduler = StartScheduler(on_progress=self.__notify_start_progress, **(start_options or {}))
+        self._recovery_ids = []
+        # breaker_options are RestartBreaker arguments
+        self._breaker_options = breaker_options or {}
+        # normalized source urls of the streams, finds duplicates without scanning
+        self._source_index = SourceIndex()
         self.__reload_from_db()
 
     def connect(self):
@@ -136,16 +161,19 @@ class Service(IStreamHandler):
     def start_stream(self, sid: ObjectId):
         stream = self.find_stream_by_id(sid)
         if stream:
+            Service.__reset_breaker(stream)
             stream.start_request()
 
     def stop_stream(self, sid: ObjectId):
         stream = self.find_stream_by_id(sid)
         if stream:
+            Service.__reset_breaker(stream)
             stream.stop_request()
 
     def restart_stream(self, sid: ObjectId):
         stream = self.find_stream_by_id(sid)
         if stream:
+            Service.__reset_breaker(stream)
             stream.restart_request()
 
     @property
@@ -234,6 +262,18 @@ class Service(IStreamHandler):
     def online_users(self) -> OnlineUsers:
         return self._online_users
 
+    @staticmethod
+    def get_service_room(sid, wire_format=WireFormat.JSON) -> str:
+        return Service.SERVICE_ROOM_TEMPLATE_2S.format(sid, wire_format)
+
+    @staticmethod
+    def get_service_streams_room(sid, wire_format=WireFormat.JSON) -> str:
+        return Service.SERVICE_STREAMS_ROOM_TEMPLATE_2S.format(sid, wire_format)
+
+    @staticmethod
+    def get_stream_room(sid, wire_format=WireFormat.JSON) -> str:
+        return Service.STREAM_ROOM_TEMPLATE_2S.format(sid, wire_format)
+
     def get_streams(self):
         return self._streams
 
@@ -256,8 +296,10 @@ class Service(IStreamHandler):
             stream_object = self.__convert_stream(stream)
             stream_object.stable()
             self._streams.append(stream_object)
+            self._source_index.add(stream)
             self._settings.add_stream(stream)
             self._settings.save()
+            self.__invalidate_playlists([stream.id])
 
     def add_streams(self, streams: [IStream]):
         stabled_streams = []
@@ -266,16 +308,55 @@ class Service(IStreamHandler):
                 stream_object = self.__convert_stream(stream)
                 stream_object.stable()
                 self._streams.append(stream_object)
+                self._source_index.add(stream)
                 stabled_streams.append(stream)
 
         self._settings.add_streams(stabled_streams)  #
         self._settings.save()
+        self.__invalidate_playlists([stream.id for stream in stabled_streams])
 
     def update_stream(self, stream: IStream):
-        stream.save()
-        stream_object = self.find_stream_by_id(stream.id)
-        if stream_object:
-            stream_object.stable()
+        self.update_streams([stream])
+
+    def update_streams(self, streams: [IStream]):
+        # edited streams, only the changed fields are written and all streams with one bulk write
+        operations = []
+        written = []
+        for stream in streams:
+            stream_object = self.find_stream_by_id(stream.id)
+            if not stream_object:
+                stream.save()
+                continue
+
+            stream_object.fixup_output_urls()
+            stream.full_clean()
+            update, digests = stream_object.get_changes()
+            if update is None:
+                stream.save(full_clean=False)
+            elif update:
+                operations.append(UpdateOne({'_id': stream.id}, update))
+            written.append((stream_object, digests))
+
+        if operations:
+            IStream._mongometa.collection.bulk_write(operations, ordered=False)
+
+        for stream_object, digests in written:
+            stream_object.mark_stored(digests)
+            self._source_index.update(stream_object.stream())
+        self.__invalidate_playlists([stream.id for stream in streams])
+
+    def update_tvg_ids(self, tvg_ids: dict) -> int:
+        # {sid: tvg_id}, written with update_streams so only the field goes to the database
+        changed = []
+        for sid, tvg_id in tvg_ids.items():
+            stream = self.find_stream_by_id(sid)
+            if stream:
+                stream.stream().tvg_id = tvg_id
+                changed.append(stream.stream())
+
+        if changed:
+            self.update_streams(changed)
+        return len(changed)
 
     def remove_stream(self, sid: ObjectId):
         for stream in list(self._streams):
@@ -286,23 +367,138 @@ class Service(IStreamHandler):
 
                 stream.stop_request()
                 self._streams.remove(stream)
+                self._source_index.remove(sid)
                 self._settings.remove_stream(original)
         self._settings.save()
+        self.__invalidate_playlists([sid])
 
     def remove_all_streams(self):
+        removed = []
         for stream in self._streams:
             self._client.stop_stream(stream.get_id())
+            removed.append(stream.id)
         self._streams = []
+        self._source_index.clear()
         self._settings.remove_all_streams()  #
         self._settings.save()
+        self.__invalidate_playlists(removed)
+
+    def detach_streams(self, sids: list) -> [IStream]:
+        # stops and unlinks streams (with their parts) without deleting them, used to move streams between services
+        sids = set(sids)
+        for stream in self._streams:
+            if stream.id in sids:
+                sids.update(part.id for part in stream.stream().parts)
+
+        detached = []
+        for stream in list(self._streams):
+            if stream.id in sids:
+                stream.stop_request()
+                self._streams.remove(stream)
+                self._source_index.remove(stream.id)
+                detached.append(stream.stream())
+
+        if detached:
+            ids = [stream.id for stream in detached]
+            ServiceSettings.objects.raw({'_id': self.id}).update({'$pull': {'streams': {'$in': ids}}})
+            self._settings.streams = [stream for stream in self._settings.streams if stream and stream.id not in sids]
+            self.__invalidate_playlists(ids)
+        return detached
+
+    def attach_streams(self, streams: [IStream], start=True, stable=True):
+        # output urls are regenerated for this service by stable(), stable=False for streams just written with
+        # their final urls
+        attached = []
+        for stream in streams:
+            stream_object = self.__convert_stream(stream)
+            if stream_object:
+                if stable:
+                    stream_object.stable()
+                self._streams.append(stream_object)
+                self._source_index.add(stream)
+                attached.append(stream_object)
+
+        if not attached:
+            return
+
+        ids = [stream.id for stream in attached]
+        ServiceSettings.objects.raw({'_id': self.id}).update({'$push': {'streams': {'$each': ids}}})
+        self._settings.streams.extend(stream.stream() for stream in attached)
+        self.__invalidate_playlists(ids)
+        if start and self.status == ClientStatus.ACTIVE:
+            for stream in attached:
+                stream.start_request()
+
+    def add_catchups(self, channel: IStreamObject, catchups: [CatchupStream]):
+        # one insert_many for all recordings, linked to the service and to the channel parts with single updates,
+        # output urls are fixed up before the insert so no recording is saved again, bulk_create does not set ids
+        # so they are given here first, the urls contain them
+        if not catchups:
+            return
+
+        for catchup in catchups:
+            if catchup.pk is None:
+                catchup.pk = ObjectId()
+            self.__make_stream_object(catchup).fixup_output_urls()
+        CatchupStream.objects.bulk_create(catchups, full_clean=True)
+        self.attach_streams(catchups, start=False, stable=False)
+        ids = [catchup.id for catchup in catchups]
+        IStream.objects.raw({'_id': channel.id}).update({'$push': {'parts': {'$each': ids}}})
+        channel.stream().parts.extend(catchups)
+
+    def remove_catchups(self, channel: IStreamObject, sids: list):
+        ids = [stream.id for stream in self.detach_streams(sids)]
+        if not ids:
+            return
+
+        IStream.objects.raw({'_id': {'$in': ids}}).delete()
+        IStream.objects.raw({'_id': channel.id}).update({'$pull': {'parts': {'$in': ids}}})
+        channel.stream().parts = [part for part in channel.stream().parts if part and part.id not in ids]
+
+    def start_due_catchups(self):
+        # catchups only record inside their window, start_request() ignores them before
+        if self.status != ClientStatus.ACTIVE:
+            return
+
+        now = datetime.now()
+        due = []
+        for stream in self._streams:
+            if stream.type == constants.StreamType.CATCHUP and not stream.is_started():
+                original = stream.stream()
+                if original.start <= now < original.stop:
+                    due.append(stream)
+        if due:
+            self._scheduler.schedule(due)
+
+    def find_streams_by_source(self, url: str) -> [IStreamObject]:
+        return [stream for stream in map(self.find_stream_by_id, self._source_index.find(url)) if stream]
+
+    def get_duplicate_sources(self) -> list:
+        # groups of streams sharing a source url
+        duplicates = []
+        for sids in self._source_index.get_duplicates():
+            streams = [stream for stream in map(self.find_stream_by_id, sids) if stream]
+            if len(streams) > 1:
+                duplicates.append(streams)
+        return duplicates
 
     def stop_all_streams(self):
         for stream in self._streams:
+            if isinstance(stream, HardwareStreamObject):
+                stream.breaker.expect_quit()
             self._client.stop_stream(stream.get_id())
 
     def start_all_streams(self):
-        for stream in self._streams:
-            self._client.start_stream(stream.config())
+        self._scheduler.schedule(self._streams)
+
+    def restart_all_streams(self):
+        self._scheduler.schedule(self._streams, StartAction.RESTART)
+
+    def cancel_scheduled_starts(self):
+        self._scheduler.cancel()
+
+    def get_start_progress(self) -> dict:
+        return self._scheduler.progress()
 
     def to_dict(self) -> dict:
         return {ServiceFields.ID: str(self.id), ServiceFields.CPU: self._cpu, ServiceFields.GPU: self._gpu,
@@ -360,7 +556,11 @@ class Service(IStreamHandler):
         stream = self.find_stream_by_id(ObjectId(sid))
         if stream:
             stream.update_runtime_fields(params)
-            self.__notify_front(Service.STREAM_DATA_CHANGED, stream.to_front_dict())
+            if isinstance(stream, HardwareStreamObject):
+                stream.breaker.on_healthy()
+                if stream.breaker.on_restarts(params[HardwareStreamObject.RESTARTS_FIELD]):
+                    self.__trip_breaker(stream)
+            self.__notify_stream_changed(stream)
 
     def on_stream_sources_changed(self, params: dict):
         pass
@@ -371,30 +571,105 @@ class Service(IStreamHandler):
     def on_service_statistic_received(self, params: dict):
         # nid = params['id']
         self.__refresh_stats(params)
-        self.__notify_front(Service.SERVICE_DATA_CHANGED, self.to_dict())
+        service = self.to_dict()
+        self.__notify_front(Service.SERVICE_DATA_CHANGED, service, Service.get_service_room(self.id))
+        self.__notify_front(Service.SERVICE_DATA_CHANGED, pack_service(service, ServiceFields.ALL),
+                            Service.get_service_room(self.id, WireFormat.COMPACT))
 
     def on_quit_status_stream(self, params: dict):
         sid = params['id']
         stream = self.find_stream_by_id(ObjectId(sid))
         if stream:
             stream.reset()
-            self.__notify_front(Service.STREAM_DATA_CHANGED, stream.to_front_dict())
+            if isinstance(stream, HardwareStreamObject) and stream.breaker.on_quit():
+                self.__trip_breaker(stream)
+            self.__notify_stream_changed(stream)
 
     def on_client_state_changed(self, status: ClientStatus):
         if status == ClientStatus.ACTIVE:
             self.sync(True)
+            # streams that ran before the connection was lost, already running ones are skipped by the scheduler
+            recovered = [stream for stream in self._streams if stream.id in self._recovery_ids]
+            self._recovery_ids = []
+            self._scheduler.schedule(recovered)
         else:
             self.__reset()
+            self._scheduler.cancel()
             for stream in self._streams:
+                if stream.is_started():
+                    self._recovery_ids.append(stream.id)
                 stream.reset()
 
     def on_ping_received(self, params: dict):
         self.sync()
 
+    def on_output_status_changed(self, state: dict):
+        for wire_format in WireFormat.ALL:
+            self.__notify_front(Service.OUTPUT_STATUS_CHANGED, state, Service.get_service_room(self.id, wire_format))
+
     # private
-    def __notify_front(self, channel: str, params: dict):
+    def __notify_front(self, channel: str, params, room: str):
         unique_channel = channel + '_' + str(self.id)
-        self._socketio.emit(unique_channel, params)
+        self._socketio.emit(unique_channel, params, room=room)
+
+    def __notify_stream_changed(self, stream: IStreamObject):
+        # clients join either the whole service streams room or rooms of the streams they display, never both,
+        # the stream is serialized and packed only for formats somebody listens to
+        joined = {}
+        for wire_format in WireFormat.ALL:
+            rooms = [room for room in (Service.get_service_streams_room(self.id, wire_format),
+                                       Service.get_stream_room(stream.id, wire_format)) if self.__has_members(room)]
+            if rooms:
+                joined[wire_format] = rooms
+
+        if not joined:
+            return
+
+        front = stream.to_front_dict()
+        for wire_format, rooms in joined.items():
+            params = pack_stream(front) if wire_format == WireFormat.COMPACT else front
+            for room in rooms:
+                self.__notify_front(Service.STREAM_DATA_CHANGED, params, room)
+
+    def __has_members(self, room: str) -> bool:
+        # the socketio manager drops rooms once their last client left
+        return room in self._socketio.server.manager.rooms.get('/', {})
+
+    @staticmethod
+    def __reset_breaker(stream: IStreamObject):
+        # manual start/stop/restart overrides the breaker
+        if isinstance(stream, HardwareStreamObject):
+            stream.breaker.reset()
+
+    def __trip_breaker(self, stream: HardwareStreamObject):
+        # restart storm, the node stops the stream until the backoff passes
+        self._client.stop_stream(stream.get_id())
+        gevent.spawn_later(max(stream.breaker.retry_at - time.time(), 0), self.__retry_stream, stream.id)
+
+    def __retry_stream(self, sid: ObjectId):
+        stream = self.find_stream_by_id(sid)
+        if not stream or not stream.breaker.is_retry_due():
+            return
+
+        if self.status != ClientStatus.ACTIVE:
+            # node is away, try again after this stream's own backoff
+            stream.breaker.delay_retry()
+            gevent.spawn_later(max(stream.breaker.retry_at - time.time(), 0), self.__retry_stream, sid)
+            return
+
+        stream.breaker.half_open()
+        self._scheduler.schedule([stream])
+        self.__notify_stream_changed(stream)
+
+    def __notify_start_progress(self, progress: dict):
+        for wire_format in WireFormat.ALL:
+            self.__notify_front(Service.START_PROGRESS_CHANGED, progress,
+                                Service.get_service_room(self.id, wire_format))
+
+    def __invalidate_playlists(self, stream_ids: list):
+        self._playlist_cache.invalidate_service(self.id)
+        for sid in stream_ids:
+            self._playlist_cache.invalidate_stream(sid)
 
     def __reset(self):
         self._cpu = Service.INIT_VALUE
@@ -427,10 +702,12 @@ class Service(IStreamHandler):
 
     def __reload_from_db(self):
         self._streams = []
+        self._source_index.clear()
         for stream in self._settings.streams:
             stream_object = self.__convert_stream(stream)
             if stream_object:
                 self._streams.append(stream_object)
+                self._source_index.add(stream)
 
     def __refresh_catchups(self):
         self._settings.refresh_from_db()
@@ -441,12 +718,21 @@ class Service(IStreamHandler):
                     stream_object = self.__convert_stream(stream)
                     if stream_object:
                         self._streams.append(stream_object)
+                        self._source_index.add(stream)
 
-        for stream in self._streams:
-            if stream.type == constants.StreamType.CATCHUP:
-                stream.start_request()
+        # only recordings inside their window, future ones would hold start slots until the timeout
+        self.start_due_catchups()
 
     def __convert_stream(self, stream: IStream) -> IStreamObject:
+        # streams come here as stored, edits are compared against this state
+        stream_object = self.__make_stream_object(stream)
+        if stream_object:
+            stream_object.mark_stored()
+        if isinstance(stream_object, HardwareStreamObject):
+            stream_object.breaker = RestartBreaker(**self._breaker_options)
+        return stream_object
+
+    def __make_stream_object(self, stream: IStream) -> IStreamObject:
         if not stream:
             return
 
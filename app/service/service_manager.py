@@ -1,16 +1,24 @@
+from bson.objectid import ObjectId
 from gevent import select
 from pyfastocloud_models.service.entry import ServiceSettings
 
+from app.service.placement import PlacementEngine
+from app.service.playlist_cache import PlaylistCache
 from app.service.service import Service
 
 
 class ServiceManager(object):
-    def __init__(self, host: str, port: int, socketio):
+    def __init__(self, host: str, port: int, socketio, node_bandwidth=PlacementEngine.DEFAULT_NODE_BANDWIDTH,
+                 start_options=None, breaker_options=None):
         self._host = host
         self._port = port
         self._socketio = socketio
         self._stop_listen = False
         self._servers_pool = []
+        self._playlist_cache = PlaylistCache()
+        self._placement = PlacementEngine(node_bandwidth)
+        self._start_options = start_options
+        self._breaker_options = breaker_options
 
     @property
     def host(self) -> str:
@@ -20,18 +28,49 @@ class ServiceManager(object):
     def port(self) -> int:
         return self._port
 
+    @property
+    def playlist_cache(self) -> PlaylistCache:
+        return self._playlist_cache
+
+    @property
+    def placement(self) -> PlacementEngine:
+        return self._placement
+
     def stop(self):
         self._stop_listen = True
 
+    def get_servers(self) -> [Service]:
+        return list(self._servers_pool)
+
+    def find_server_by_id(self, sid: ObjectId) -> Service:
+        # background jobs need services nobody opened yet
+        for server in self._servers_pool:
+            if server.id == sid:
+                return server
+
+        settings = ServiceSettings.get_by_id(sid)
+        if not settings:
+            return None
+        return self.find_or_create_server(settings)
+
     def find_or_create_server(self, settings: ServiceSettings) -> Service:
         for server in self._servers_pool:
             if server.id == settings.id:
                 return server
 
-        server = Service(self._host, self._port, self._socketio, settings)
+        server = Service(self._host, self._port, self._socketio, settings, self._playlist_cache, self._start_options,
+                         self._breaker_options)
         self.__add_server(server)
         return server
 
+    def migrate_streams(self, source: Service, target: Service, sids: list) -> int:
+        if source.id == target.id:
+            return 0
+
+        streams = source.detach_streams(sids)
+        target.attach_streams(streams)
+        return len(streams)
+
     def refresh(self):
         while not self._stop_listen:
             rsockets = []
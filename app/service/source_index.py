@@ -0,0 +1,83 @@
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import pyfastocloud_models.constants as constants
+from pyfastocloud_models.stream.entry import IStream
+
+
+class DuplicatePolicy:
+    SKIP = 'skip'  # duplicates are not imported
+    MERGE = 'merge'  # missing metadata of the existing stream is filled from the duplicate
+    KEEP = 'keep'  # duplicates are imported as new streams, only reported
+
+    ALL = [SKIP, MERGE, KEEP]
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'rtmp': 1935, 'rtsp': 554}
+
+
+def normalize_url(url: str) -> str:
+    # same source written differently: scheme/host case, default port, query order, fragment
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except (AttributeError, ValueError):
+        return url
+
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.username or parts.password:
+        netloc = '{0}:{1}@{2}'.format(parts.username or '', parts.password or '', netloc)
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = '{0}:{1}'.format(netloc, port)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def get_source_key(url: str) -> str:
+    return hashlib.md5(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+def get_source_urls(stream: IStream) -> list:
+    # proxy streams are played from their output, everything else pulls the input
+    if stream.get_type() in (constants.StreamType.PROXY, constants.StreamType.VOD_PROXY):
+        return [out.uri for out in stream.output]
+    return [inp.uri for inp in stream.input]
+
+
+class SourceIndex(object):
+    def __init__(self):
+        # normalized source url hash -> stream ids, and back to drop keys when a stream changes or goes away
+        self._streams_by_key = {}
+        self._keys_by_stream = {}
+
+    def clear(self):
+        self._streams_by_key = {}
+        self._keys_by_stream = {}
+
+    def add(self, stream: IStream):
+        self.remove(stream.id)
+        keys = set(get_source_key(url) for url in get_source_urls(stream) if url)
+        self._keys_by_stream[stream.id] = keys
+        for key in keys:
+            self._streams_by_key.setdefault(key, []).append(stream.id)
+
+    def update(self, stream: IStream):
+        self.add(stream)
+
+    def remove(self, sid):
+        for key in self._keys_by_stream.pop(sid, []):
+            sids = self._streams_by_key.get(key)
+            if sids:
+                sids.remove(sid)
+                if not sids:
+                    del self._streams_by_key[key]
+
+    def find(self, url: str) -> list:
+        # ids of streams using url as a source
+        return list(self._streams_by_key.get(get_source_key(url), []))
+
+    def get_duplicates(self) -> list:
+        # lists of stream ids sharing a source, streams sharing several sources are listed once
+        groups = set(tuple(sorted(sids, key=str)) for sids in self._streams_by_key.values() if len(sids) > 1)
+        return [list(group) for group in groups]
@@ -0,0 +1,147 @@
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlparse
+
+from app.service.http_pool import HttpPool, HttpResult
+
+
+class ProbeStatus:
+    OK = 'ok'
+    STALE = 'stale'  # playlist answers but the newest segment is old or unreachable
+    FAILED = 'failed'
+    UNSUPPORTED = 'unsupported'  # not an http(s) source
+
+
+class ProbeFields:
+    URL = 'url'
+    STATUS = 'status'
+    HTTP_STATUS = 'http_status'
+    RESPONSE_TIME = 'response_time'
+    SEGMENT_AGE = 'segment_age'
+    ERROR = 'error'
+    TIMESTAMP = 'timestamp'
+
+
+class SourceProber(object):
+    DEFAULT_TTL = 60
+    DEFAULT_MAX_ENTRIES = 16384
+    PLAYLIST_MAX_SIZE = 256 * 1024
+    # a live segment older than this many target durations means the source is stuck
+    STALE_TARGET_DURATIONS = 3
+    DEFAULT_TARGET_DURATION = 10
+
+    def __init__(self, pool: HttpPool, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self._pool = pool
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._cache = OrderedDict()
+
+    def probe(self, url: str) -> dict:
+        return self.probe_many([url])[url]
+
+    def probe_many(self, urls: list) -> dict:
+        # cached results are returned as is, the rest is probed concurrently in the pool
+        now = time.time()
+        result = {}
+        missing = []
+        for url in urls:
+            cached = self._cache.get(url)
+            if cached and cached[ProbeFields.TIMESTAMP] + self._ttl > now:
+                result[url] = cached
+            elif url not in missing:
+                missing.append(url)
+
+        for url, probed in zip(missing, self._pool.map(self.__probe, missing)):
+            self.__put(url, probed)
+            result[url] = probed
+        return result
+
+    def invalidate(self, url: str):
+        self._cache.pop(url, None)
+
+    # private
+    def __put(self, url: str, probed: dict):
+        self._cache.pop(url, None)
+        self._cache[url] = probed
+        while len(self._cache) > self._max_entries:
+            self._cache.popitem(last=False)
+
+    def __probe(self, url: str) -> dict:
+        probed = {ProbeFields.URL: url, ProbeFields.STATUS: ProbeStatus.FAILED, ProbeFields.HTTP_STATUS: None,
+                  ProbeFields.RESPONSE_TIME: None, ProbeFields.SEGMENT_AGE: None, ProbeFields.ERROR: None,
+                  ProbeFields.TIMESTAMP: time.time()}
+        if urlparse(url).scheme not in ('http', 'https'):
+            probed[ProbeFields.STATUS] = ProbeStatus.UNSUPPORTED
+            return probed
+
+        response = self._pool.fetch_direct(url, max_body=SourceProber.PLAYLIST_MAX_SIZE)
+        probed[ProbeFields.HTTP_STATUS] = response.status
+        probed[ProbeFields.RESPONSE_TIME] = int(response.elapsed * 1000)
+        if not response.ok:
+            probed[ProbeFields.ERROR] = response.error
+            return probed
+
+        if not response.body.lstrip().startswith(b'#EXTM3U'):
+            # raw transport stream or progressive source, answering with data is enough
+            probed[ProbeFields.STATUS] = ProbeStatus.OK if response.body else ProbeStatus.STALE
+            return probed
+
+        # master playlist, the first variant is checked
+        playlist = response
+        variant = SourceProber.__find_variant(playlist)
+        if variant:
+            playlist = self._pool.fetch_direct(variant, max_body=SourceProber.PLAYLIST_MAX_SIZE)
+            if not playlist.ok:
+                probed[ProbeFields.ERROR] = playlist.error
+                return probed
+
+        lines = SourceProber.__get_lines(playlist.body)
+        if '#EXT-X-ENDLIST' in lines:
+            probed[ProbeFields.STATUS] = ProbeStatus.OK
+            return probed
+
+        segments = [line for line in lines if line and not line.startswith('#')]
+        if not segments:
+            probed[ProbeFields.STATUS] = ProbeStatus.STALE
+            probed[ProbeFields.ERROR] = 'Empty playlist'
+            return probed
+
+        segment = self._pool.fetch_direct(urljoin(playlist.url, segments[-1]), method='HEAD', max_body=0)
+        if not segment.ok:
+            probed[ProbeFields.STATUS] = ProbeStatus.STALE
+            probed[ProbeFields.ERROR] = segment.error
+            return probed
+
+        last_modified = segment.get_last_modified()
+        if last_modified is None:
+            probed[ProbeFields.STATUS] = ProbeStatus.OK
+            return probed
+
+        age = max(int(time.time() - last_modified), 0)
+        probed[ProbeFields.SEGMENT_AGE] = age
+        max_age = SourceProber.__get_target_duration(lines) * SourceProber.STALE_TARGET_DURATIONS
+        probed[ProbeFields.STATUS] = ProbeStatus.OK if age <= max_age else ProbeStatus.STALE
+        return probed
+
+    @staticmethod
+    def __get_lines(body: bytes) -> list:
+        return [line.strip() for line in body.decode('utf-8', 'replace').splitlines()]
+
+    @staticmethod
+    def __find_variant(playlist: HttpResult):
+        lines = SourceProber.__get_lines(playlist.body)
+        for pos, line in enumerate(lines):
+            if line.startswith('#EXT-X-STREAM-INF'):
+                for uri in lines[pos + 1:]:
+                    if uri and not uri.startswith('#'):
+                        return urljoin(playlist.url, uri)
+        return None
+
+    @staticmethod
+    def __get_target_duration(lines: list) -> int:
+        for line in lines:
+            if line.startswith('#EXT-X-TARGETDURATION:'):
+                value = line.partition(':')[2]
+                if value.isdigit():
+                    return int(value)
+        return SourceProber.DEFAULT_TARGET_DURATION
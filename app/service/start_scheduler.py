@@ -0,0 +1,122 @@
+import time
+
+import gevent
+
+from app.service.stream import IStreamObject, HardwareStreamObject
+
+
+class StartAction:
+    START = 'start'
+    RESTART = 'restart'
+
+
+class StartProgressFields:
+    TOTAL = 'total'
+    DONE = 'done'
+    IN_FLIGHT = 'in_flight'
+    PENDING = 'pending'
+    FINISHED = 'finished'
+
+
+class StartScheduler(object):
+    DEFAULT_CONCURRENCY = 8
+    DEFAULT_RATE = 2.0
+    DEFAULT_START_TIMEOUT = 30
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, start_timeout=DEFAULT_START_TIMEOUT,
+                 priority_groups=None, on_progress=None):
+        # at most concurrency requests are in flight (sent, but the stream did not report a new start time and
+        # start_timeout did not pass yet) and no more than rate requests per second are sent,
+        # on_progress(progress: dict) is called after every request and when the queue is drained
+        self._concurrency = max(concurrency, 1)
+        self._interval = 1.0 / rate if rate > 0 else 0
+        self._start_timeout = start_timeout
+        self._priority_groups = priority_groups or []
+        self._on_progress = on_progress
+        self._queue = []
+        self._in_flight = []
+        self._total = 0
+        self._done = 0
+        self._greenlet = None
+
+    def schedule(self, streams: [IStreamObject], action=StartAction.START):
+        # streams already queued keep their place, proxy streams have nothing to start, streams with an open
+        # breaker wait for its retry
+        queued = set(stream.id for stream, _ in self._queue)
+        added = [(stream, action) for stream in streams if isinstance(stream, HardwareStreamObject) and
+                 stream.id not in queued and stream.is_started() != (action == StartAction.START) and
+                 not stream.breaker.is_open()]
+        if not added:
+            return
+
+        if not self._queue:
+            self._total = 0
+            self._done = 0
+
+        self._queue = sorted(self._queue + added, key=self.__priority)
+        self._total += len(added)
+        self.__notify()
+        if self._greenlet is None or self._greenlet.dead:
+            self._greenlet = gevent.spawn(self.__run)
+
+    def cancel(self):
+        self._queue = []
+        self.__notify()
+
+    def progress(self) -> dict:
+        return {StartProgressFields.TOTAL: self._total, StartProgressFields.DONE: self._done,
+                StartProgressFields.IN_FLIGHT: len(self._in_flight), StartProgressFields.PENDING: len(self._queue),
+                StartProgressFields.FINISHED: not self._queue}
+
+    # private
+    def __priority(self, item):
+        # streams of listed groups go first in the listed order, then everything else by name
+        stream = item[0].stream()
+        groups = stream.groups or []
+        rank = len(self._priority_groups)
+        for pos, group in enumerate(self._priority_groups):
+            if group in groups:
+                rank = pos
+                break
+        return rank, stream.name
+
+    def __run(self):
+        while self._queue:
+            self.__wait_slot()
+            if not self._queue:
+                break
+
+            stream, action = self._queue.pop(0)
+            self._done += 1
+            # start of a running or restart of a stopped stream is a no op and takes no slot, neither does a stream
+            # whose breaker opened while queued
+            if stream.is_started() == (action == StartAction.START) or stream.breaker.is_open():
+                continue
+
+            start_time = stream.start_time
+            if action == StartAction.RESTART:
+                stream.restart_request()
+            else:
+                stream.start_request()
+            self._in_flight.append((stream, start_time, time.time() + self._start_timeout))
+            self.__notify()
+            if self._interval:
+                gevent.sleep(self._interval)
+
+        self._in_flight = []
+        self.__notify()
+
+    def __wait_slot(self):
+        while True:
+            now = time.time()
+            # a request is done once the stream reports a new start time
+            self._in_flight = [(stream, start_time, deadline) for stream, start_time, deadline in self._in_flight if
+                               deadline > now and stream.start_time == start_time]
+            if len(self._in_flight) < self._concurrency:
+                return
+            gevent.sleep(StartScheduler.POLL_INTERVAL)
+
+    def __notify(self):
+        if self._on_progress:
+            self._on_progress(self.progress())
@@ -13,7 +13,9 @@ from pyfastocloud_models.stream.entry import IStream, ProxyStream, HardwareStrea
     TimeshiftRecorderStream, CatchupStream, TimeshiftPlayerStream, TestLifeStream, CodRelayStream, CodEncodeStream, \
     ProxyVodStream, VodRelayStream, VodEncodeStream, EventStream
 
+from app.service.circuit_breaker import RestartBreaker
 from app.service.service_client import ServiceClient
+from app.service.stream_changes import get_field_digests, get_update
 
 
 class ConfigFields:
@@ -79,6 +81,7 @@ class IStreamObject(ABC):
 
     _stream = None
     _settings = None
+    _stored = None  # field digests of the document as last written, see get_changes
 
     def __init__(self, stream: IStream, settings: ServiceSettings):
         self._stream = stream
@@ -147,9 +150,25 @@ class IStreamObject(ABC):
         assert self._stream.get_id() == params[IStream.ID_FIELD]
         assert self._stream.get_type() == params[IStream.TYPE_FIELD]
 
+    def fixup_output_urls(self):
+        return
+
     def stable(self, *args, **kwargs):
         pass
 
+    def mark_stored(self, digests=None):
+        # the stream as it is now is the stored document
+        self._stored = digests if digests is not None else get_field_digests(self._stream.to_son())
+
+    def get_changes(self) -> (dict, dict):
+        # (mongo update of the fields changed since mark_stored, digests to mark once written), the update is None
+        # if the stream was never marked and has to be saved whole
+        son = self._stream.to_son()
+        digests = get_field_digests(son)
+        if self._stored is None:
+            return None, digests
+        return get_update(self._stored, digests, son), digests
+
 
 class ProxyStreamObject(IStreamObject):
     def get_log_request(self, host, port):
@@ -190,6 +209,7 @@ class HardwareStreamObject(IStreamObject):
     TIMESTAMP_FIELD = 'timestamp'
     IDLE_TIME_FIELD = 'idle_time'
     QUALITY_FIELD = 'quality'
+    BREAKER_FIELD = 'breaker'
 
     # runtime
     _status = StreamStatus.NEW
@@ -207,6 +227,15 @@ class HardwareStreamObject(IStreamObject):
     def __init__(self, stream: HardwareStream, settings: ServiceSettings, client: ServiceClient):
         super(HardwareStreamObject, self).__init__(stream, settings)
         self._client = client
+        self._breaker = RestartBreaker()
+
+    @property
+    def breaker(self) -> RestartBreaker:
+        return self._breaker
+
+    @breaker.setter
+    def breaker(self, breaker: RestartBreaker):
+        self._breaker = breaker
 
     def get_log_request(self, host, port):
         self._client.get_log_stream(host, port, self.get_id(), self.generate_feedback_dir())
@@ -220,10 +249,12 @@ class HardwareStreamObject(IStreamObject):
 
     def stop_request(self):
         if self.is_started():
+            self._breaker.expect_quit()
             self._client.stop_stream(self.get_id())
 
     def restart_request(self):
         if self.is_started():
+            self._breaker.expect_quit()
             self._client.restart_stream(self.get_id())
 
     def generate_feedback_dir(self):
@@ -240,6 +271,10 @@ class HardwareStreamObject(IStreamObject):
     def is_started(self) -> bool:
         return self._start_time != 0
 
+    @property
+    def start_time(self):
+        return self._start_time
+
     def reset(self):
         self._status = StreamStatus.NEW
         self._cpu = 0.0
@@ -281,6 +316,7 @@ class HardwareStreamObject(IStreamObject):
         work_time = self._timestamp - self._start_time
         quality = 100 - (100 * self._idle_time / work_time) if work_time else 100
         front[HardwareStreamObject.QUALITY_FIELD] = quality
+        front[HardwareStreamObject.BREAKER_FIELD] = self._breaker.state
         return front
 
     def config(self) -> dict:
@@ -328,12 +364,11 @@ class HardwareStreamObject(IStreamObject):
         link = '{0}/{1}'.format(cods_root, playlist_name)
         return OutputUrl(id=oid, uri=self._settings.generate_cods_link(link), http_root=cods_root, hls_type=hls_type)
 
-    def fixup_output_urls(self):
-        return
-
     def stable(self, *args, **kwargs):
         self.fixup_output_urls()
-        return self._stream.save(*args, **kwargs)
+        result = self._stream.save(*args, **kwargs)
+        self.mark_stored()
+        return result
 
     @classmethod
     def make_stream(cls, settings: ServiceSettings, client: ServiceClient):
@@ -0,0 +1,20 @@
+import hashlib
+
+from bson import BSON
+
+
+def get_field_digests(son) -> dict:
+    # field -> digest of its bson value, a few bytes per field instead of a copy of the document
+    return {field: hashlib.md5(BSON.encode({'v': value})).digest() for field, value in son.items()}
+
+
+def get_update(stored: dict, digests: dict, son) -> dict:
+    # $set/$unset of the fields whose digest differs from the stored one, empty if nothing changed
+    changed = {field: son[field] for field, digest in digests.items() if stored.get(field) != digest}
+    removed = {field: '' for field in stored if field not in digests}
+    update = {}
+    if changed:
+        update['$set'] = changed
+    if removed:
+        update['$unset'] = removed
+    return update
@@ -0,0 +1,160 @@
+import io
+import mmap
+import time
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, current_app
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+class UploadMetricsFields:
+    UPLOADS = 'uploads'
+    FILES = 'files'
+    BYTES = 'bytes'
+    SECONDS = 'seconds'
+    SPOOLED = 'spooled'  # files that went to disk
+    REJECTED = 'rejected'
+    THROUGHPUT = 'throughput'  # bytes per second, all uploads
+    LAST_THROUGHPUT = 'last_throughput'
+
+
+class UploadMetrics(object):
+    EXTENSION_NAME = 'upload_metrics'
+
+    def __init__(self):
+        self._uploads = 0
+        self._files = 0
+        self._bytes = 0
+        self._seconds = 0.0
+        self._spooled = 0
+        self._rejected = 0
+        self._last_throughput = 0
+
+    def add(self, files: int, size: int, seconds: float, spooled: int):
+        self._uploads += 1
+        self._files += files
+        self._bytes += size
+        self._seconds += seconds
+        self._spooled += spooled
+        self._last_throughput = int(size / seconds) if seconds > 0 else 0
+
+    def reject(self):
+        self._rejected += 1
+
+    def to_dict(self) -> dict:
+        throughput = int(self._bytes / self._seconds) if self._seconds > 0 else 0
+        return {UploadMetricsFields.UPLOADS: self._uploads, UploadMetricsFields.FILES: self._files,
+                UploadMetricsFields.BYTES: self._bytes, UploadMetricsFields.SECONDS: round(self._seconds, 3),
+                UploadMetricsFields.SPOOLED: self._spooled, UploadMetricsFields.REJECTED: self._rejected,
+                UploadMetricsFields.THROUGHPUT: throughput, UploadMetricsFields.LAST_THROUGHPUT: self._last_throughput}
+
+
+class UploadSpool(SpooledTemporaryFile):
+    DEFAULT_THRESHOLD = 1024 * 1024
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, limit=0, folder=None):
+        # kept in memory up to threshold bytes then moved to a temporary file, more than limit bytes are refused
+        super(UploadSpool, self).__init__(max_size=threshold, mode='wb+', dir=folder)
+        self._limit = limit
+        self.written = 0
+
+    @property
+    def spooled(self) -> bool:
+        return self._rolled
+
+    def write(self, data):
+        self.written += len(data)
+        if self._limit and self.written > self._limit:
+            raise RequestEntityTooLarge()
+        return super(UploadSpool, self).write(data)
+
+
+class SpoolingRequest(Request):
+    # flask request class, see init_project, size limits come from the app config:
+    # MAX_CONTENT_LENGTH (whole request), UPLOAD_MAX_FILE_SIZE (one file), UPLOAD_SPOOL_THRESHOLD (memory per file)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        spool = UploadSpool(config.get('UPLOAD_SPOOL_THRESHOLD', UploadSpool.DEFAULT_THRESHOLD),
+                            config.get('UPLOAD_MAX_FILE_SIZE', 0), config.get('UPLOAD_SPOOL_DIR'))
+        self.__dict__.setdefault('_spools', []).append(spool)
+        return spool
+
+    def _load_form_data(self):
+        if 'form' in self.__dict__:
+            return
+
+        metrics = current_app.extensions.get(UploadMetrics.EXTENSION_NAME)
+        started = time.time()
+        try:
+            super(SpoolingRequest, self)._load_form_data()
+        except RequestEntityTooLarge:
+            if metrics:
+                metrics.reject()
+            raise
+
+        spools = self.__dict__.get('_spools')
+        if metrics and spools:
+            metrics.add(len(spools), sum(spool.written for spool in spools), time.time() - started,
+                        sum(1 for spool in spools if spool.spooled))
+
+
+class MappedReader(object):
+    # readline/read over a mmap, enough for the playlist and epg parsers
+    def __init__(self, mapped: mmap.mmap):
+        self._mapped = mapped
+        self._pos = 0
+
+    def readline(self, limit=-1) -> bytes:
+        end = self._mapped.find(b'\n', self._pos)
+        end = len(self._mapped) if end == -1 else end + 1
+        if limit is not None and limit >= 0:
+            end = min(end, self._pos + limit)
+        line = self._mapped[self._pos:end]
+        self._pos = end
+        return line
+
+    def read(self, size=-1) -> bytes:
+        end = len(self._mapped) if size is None or size < 0 else min(self._pos + size, len(self._mapped))
+        data = self._mapped[self._pos:end]
+        self._pos = end
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+def _get_fileno(stream):
+    # only files already on disk, asking a memory spool for fileno() would write it out
+    if isinstance(stream, SpooledTemporaryFile):
+        return stream.fileno() if stream._rolled else None
+
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+@contextmanager
+def open_upload(file: FileStorage):
+    # binary reader of an uploaded file, spooled files are memory mapped instead of read into memory
+    stream = file.stream
+    stream.seek(0)
+    fileno = _get_fileno(stream)
+    if fileno is None:
+        yield stream
+        return
+
+    try:
+        mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        # empty file
+        yield stream
+        return
+
+    try:
+        yield MappedReader(mapped)
+    finally:
+        mapped.close()
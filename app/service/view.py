@@ -1,25 +1,72 @@
 import logging
-import os
+import re
 
 import pyfastocloud_models.constants as constants
 from bson.objectid import ObjectId
-from flask import render_template, redirect, url_for, request, jsonify, Response
+from flask import render_template, redirect, url_for, request, jsonify, Response, send_file, stream_with_context
 from flask_classy import FlaskView, route
 from flask_login import login_required, current_user
 from pyfastocloud_models.provider.entry_pair import ProviderPair
 from pyfastocloud_models.service.entry import ServiceSettings
-from pyfastocloud_models.utils.m3u_parser import M3uParser
-from pyfastocloud_models.utils.utils import is_valid_http_url, is_valid_url
+from pyfastocloud_models.utils.utils import is_valid_url
 
-from app import get_runtime_folder
+from app import app, get_runtime_folder, servers_manager, service_logs, stream_logs_index, output_monitor, \
+    logo_validator, logo_mirror, epg_merger
 from app.common.service.forms import ServiceSettingsForm, ActivateForm, UploadM3uForm, ServerProviderForm
 from app.home.entry import ProviderUser
+from app.service.log_store import LogStore, make_file_response, make_tail_response, make_range_response
+from app.service.placement import PlacementEngine
+from app.service.playlist_reader import M3uEntry, iterate_m3u_batches
+from app.service.playlist_writer import generate_m3u, get_service_stream_ids, iterate_service_streams
+from app.service.source_index import DuplicatePolicy, get_source_key, get_source_urls
+from app.service.upload_spool import UploadMetrics, open_upload
 
 
 # routes
 class ServiceView(FlaskView):
+    DEFAULT_TAIL_LINES = 100
+    UPLOAD_BATCH_SIZE = 1000
+
     route_base = "/service/"
 
+    @staticmethod
+    def _add_placed_streams(server, streams: list):
+        services = current_user.get_writable_servers()
+        costs = [PlacementEngine.estimate_cost(stream) for stream in streams]
+        targets = servers_manager.placement.plan(services, costs)
+        grouped = {}
+        for stream, target in zip(streams, targets):
+            target = target or server
+            grouped.setdefault(target.id, (target, []))[1].append(stream)
+
+        for target, target_streams in grouped.values():
+            target.add_streams(target_streams)
+
+    @staticmethod
+    def _merge_stream(stream, mfile: M3uEntry, valid_logos: set) -> bool:
+        # fills what the existing stream misses from the duplicated entry, returns True if changed
+        changed = False
+        tvg_id = mfile.tvg_id
+        if not stream.tvg_id and tvg_id and len(tvg_id) < constants.MAX_STREAM_TVG_ID_LENGTH:
+            stream.tvg_id = tvg_id
+            changed = True
+
+        tvg_name = mfile.tvg_name
+        if not stream.tvg_name and tvg_name and len(tvg_name) < constants.MAX_STREAM_NAME_LENGTH:
+            stream.tvg_name = tvg_name
+            changed = True
+
+        tvg_logo = mfile.tvg_logo
+        if not stream.tvg_logo and tvg_logo in valid_logos:
+            stream.tvg_logo = tvg_logo
+            changed = True
+
+        tvg_group = mfile.tvg_group
+        if tvg_group and tvg_group not in stream.groups:
+            stream.groups.append(tvg_group)
+            changed = True
+        return changed
+
     @login_required
     @route('/upload_m3u', methods=['POST', 'GET'])
     def upload_m3u(self):
@@ -33,95 +80,126 @@ class ServiceView(FlaskView):
         server = current_user.get_current_server()
         if server and form.validate_on_submit():
             stream_type = form.type.data
+            policy = request.form.get('duplicates', DuplicatePolicy.SKIP)
+            if policy not in DuplicatePolicy.ALL:
+                policy = DuplicatePolicy.SKIP
+
             files = request.files.getlist("files")
+            imported_keys = set()  # sources added by this upload, files can overlap each other
             for file in files:
-                m3u_parser = M3uParser()
-                data = file.read().decode('utf-8')
-                m3u_parser.load_content(data)
-                m3u_parser.parse()
-
                 streams = []
-                for mfile in m3u_parser.files:
-                    input_url = mfile['link']
-                    if not is_valid_url(input_url):
-                        logging.warning('Skipped invalid url: %s', input_url)
-                        continue
-
-                    if stream_type == constants.StreamType.PROXY:
-                        stream_object = server.make_proxy_stream()
-                        stream = stream_object.stream()
-                    elif stream_type == constants.StreamType.VOD_PROXY:
-                        stream_object = server.make_proxy_vod()
-                        stream = stream_object.stream()
-                    elif stream_type == constants.StreamType.RELAY:
-                        stream_object = server.make_relay_stream()
-                        stream = stream_object.stream()
-                        sid = stream.output[0].id
-                        stream.output = [stream_object.generate_http_link(constants.HlsType.HLS_PULL, oid=sid)]
-                    elif stream_type == constants.StreamType.ENCODE:
-                        stream_object = server.make_encode_stream()
-                        stream = stream_object.stream()
-                        sid = stream.output[0].id
-                        stream.output = [stream_object.generate_http_link(constants.HlsType.HLS_PULL, oid=sid)]
-                    elif stream_type == constants.StreamType.VOD_RELAY:
-                        stream_object = server.make_vod_relay_stream()
-                        stream = stream_object.stream()
-                        sid = stream.output[0].id
-                        stream.output = [stream_object.generate_vod_link(constants.HlsType.HLS_PULL, oid=sid)]
-                    elif stream_type == constants.StreamType.VOD_ENCODE:
-                        stream_object = server.make_vod_encode_stream()
-                        stream = stream_object.stream()
-                        sid = stream.output[0].id
-                        stream.output = [stream_object.generate_vod_link(constants.HlsType.HLS_PULL, oid=sid)]
-                    elif stream_type == constants.StreamType.COD_RELAY:
-                        stream_object = server.make_cod_relay_stream()
-                        stream = stream_object.stream()
-                        sid = stream.output[0].id
-                        stream.output = [stream_object.generate_cod_link(constants.HlsType.HLS_PULL, oid=sid)]
-                    elif stream_type == constants.StreamType.COD_ENCODE:
-                        stream_object = server.make_cod_encode_stream()
-                        stream = stream_object.stream()
-                        sid = stream.output[0].id
-                        stream.output = [stream_object.generate_cod_link(constants.HlsType.HLS_PULL, oid=sid)]
-                    elif stream_type == constants.StreamType.CATCHUP:
-                        stream_object = server.make_catchup_stream()
-                        stream = stream_object.stream()
-                    else:
-                        stream_object = server.make_test_life_stream()
-                        stream = stream_object.stream()
-
-                    if stream_type == constants.StreamType.PROXY or stream_type == constants.StreamType.VOD_PROXY:
-                        stream.output[0].uri = input_url
-                    else:
-                        stream.input[0].uri = input_url
-
-                    title = mfile['title']
-                    if len(title) < constants.MAX_STREAM_NAME_LENGTH:
-                        stream.name = title
-
-                    tvg_id = mfile['tvg-id']
-                    if tvg_id and len(tvg_id) < constants.MAX_STREAM_TVG_ID_LENGTH:
-                        stream.tvg_id = tvg_id
-
-                    tvg_name = mfile['tvg-name']
-                    if tvg_name and len(tvg_name) < constants.MAX_STREAM_NAME_LENGTH:
-                        stream.tvg_name = tvg_name
-
-                    tvg_group = mfile['tvg-group']
-                    if tvg_group:
-                        stream.groups = [tvg_group]
-
-                    tvg_logo = mfile['tvg-logo']
-                    if tvg_logo and len(tvg_logo) < constants.MAX_URI_LENGTH:
-                        if is_valid_http_url(tvg_logo, timeout=0.05):
-                            stream.tvg_logo = tvg_logo
-
-                    is_valid_stream = stream.is_valid()
-                    if is_valid_stream:
-                        stream.save()
-                        streams.append(stream)
-
-                server.add_streams(streams)
+                duplicates = 0
+                # the upload is parsed while read, logos are checked for a batch of entries at once
+                with open_upload(file) as reader:
+                    for entries in iterate_m3u_batches(reader, ServiceView.UPLOAD_BATCH_SIZE):
+                        valid_logos = logo_validator.validate(
+                            [mfile.tvg_logo for mfile in entries if
+                             mfile.tvg_logo and len(mfile.tvg_logo) < constants.MAX_URI_LENGTH])
+                        merged = {}  # id -> stream, written together after the batch
+                        for mfile in entries:
+                            input_url = mfile.link
+                            if not is_valid_url(input_url):
+                                logging.warning('Skipped invalid url: %s', input_url)
+                                continue
+
+                            key = get_source_key(input_url)
+                            existing = server.find_streams_by_source(input_url)
+                            if existing or key in imported_keys:
+                                duplicates += 1
+                                if policy == DuplicatePolicy.MERGE and existing:
+                                    original = existing[0].stream()
+                                    if ServiceView._merge_stream(original, mfile, valid_logos):
+                                        merged[original.id] = original
+                                if policy != DuplicatePolicy.KEEP:
+                                    continue
+                            imported_keys.add(key)
+
+                            if stream_type == constants.StreamType.PROXY:
+                                stream_object = server.make_proxy_stream()
+                                stream = stream_object.stream()
+                            elif stream_type == constants.StreamType.VOD_PROXY:
+                                stream_object = server.make_proxy_vod()
+                                stream = stream_object.stream()
+                            elif stream_type == constants.StreamType.RELAY:
+                                stream_object = server.make_relay_stream()
+                                stream = stream_object.stream()
+                                sid = stream.output[0].id
+                                stream.output = [stream_object.generate_http_link(constants.HlsType.HLS_PULL, oid=sid)]
+                            elif stream_type == constants.StreamType.ENCODE:
+                                stream_object = server.make_encode_stream()
+                                stream = stream_object.stream()
+                                sid = stream.output[0].id
+                                stream.output = [stream_object.generate_http_link(constants.HlsType.HLS_PULL, oid=sid)]
+                            elif stream_type == constants.StreamType.VOD_RELAY:
+                                stream_object = server.make_vod_relay_stream()
+                                stream = stream_object.stream()
+                                sid = stream.output[0].id
+                                stream.output = [stream_object.generate_vod_link(constants.HlsType.HLS_PULL, oid=sid)]
+                            elif stream_type == constants.StreamType.VOD_ENCODE:
+                                stream_object = server.make_vod_encode_stream()
+                                stream = stream_object.stream()
+                                sid = stream.output[0].id
+                                stream.output = [stream_object.generate_vod_link(constants.HlsType.HLS_PULL, oid=sid)]
+                            elif stream_type == constants.StreamType.COD_RELAY:
+                                stream_object = server.make_cod_relay_stream()
+                                stream = stream_object.stream()
+                                sid = stream.output[0].id
+                                stream.output = [stream_object.generate_cod_link(constants.HlsType.HLS_PULL, oid=sid)]
+                            elif stream_type == constants.StreamType.COD_ENCODE:
+                                stream_object = server.make_cod_encode_stream()
+                                stream = stream_object.stream()
+                                sid = stream.output[0].id
+                                stream.output = [stream_object.generate_cod_link(constants.HlsType.HLS_PULL, oid=sid)]
+                            elif stream_type == constants.StreamType.CATCHUP:
+                                stream_object = server.make_catchup_stream()
+                                stream = stream_object.stream()
+                            else:
+                                stream_object = server.make_test_life_stream()
+                                stream = stream_object.stream()
+
+                            if stream_type == constants.StreamType.PROXY or \
+                                    stream_type == constants.StreamType.VOD_PROXY:
+                                stream.output[0].uri = input_url
+                            else:
+                                stream.input[0].uri = input_url
+
+                            # bare urls have no title, the stream keeps its default name
+                            title = mfile.title
+                            if title and len(title) < constants.MAX_STREAM_NAME_LENGTH:
+                                stream.name = title
+
+                            tvg_id = mfile.tvg_id
+                            if tvg_id and len(tvg_id) < constants.MAX_STREAM_TVG_ID_LENGTH:
+                                stream.tvg_id = tvg_id
+
+                            tvg_name = mfile.tvg_name
+                            if tvg_name and len(tvg_name) < constants.MAX_STREAM_NAME_LENGTH:
+                                stream.tvg_name = tvg_name
+
+                            tvg_group = mfile.tvg_group
+                            if tvg_group:
+                                stream.groups = [tvg_group]
+
+                            tvg_logo = mfile.tvg_logo
+                            if tvg_logo and len(tvg_logo) < constants.MAX_URI_LENGTH:
+                                if tvg_logo in valid_logos:
+                                    stream.tvg_logo = tvg_logo
+
+                            is_valid_stream = stream.is_valid()
+                            if is_valid_stream:
+                                stream.save()
+                                streams.append(stream)
+
+                        if merged:
+                            server.update_streams(list(merged.values()))
+
+                if duplicates:
+                    logging.info('Upload %s: %d duplicated sources (%s)', file.filename, duplicates, policy)
+
+                if app.config.get('AUTO_PLACEMENT'):
+                    ServiceView._add_placed_streams(server, streams)
+                else:
+                    server.add_streams(streams)
 
         return redirect(url_for('ProviderView:dashboard'))
 
@@ -184,27 +262,180 @@ class ServiceView(FlaskView):
     @login_required
     @route('/playlist/<sid>/master.m3u', methods=['GET'])
     def playlist(self, sid):
-        server = ServiceSettings.get_by_id(ObjectId(sid))
-        if server:
-            return Response(server.generate_playlist(), mimetype='application/x-mpequrl'), 200
+        def generate():
+            server = ServiceSettings.get_by_id(ObjectId(sid))
+            if server:
+                return logo_mirror.rewrite_playlist(server.generate_playlist())
+            return None
+
+        playlist = servers_manager.playlist_cache.get_service_playlist(sid, generate)
+        if playlist:
+            return playlist.make_response()
 
         return jsonify(status='failed'), 404
 
+    @login_required
+    @route('/epg/<sid>/epg.xml.gz', methods=['GET'])
+    def epg(self, sid):
+        # merged xmltv of the channels used by the service streams, players revalidate with the etag,
+        # only services of the current user are opened
+        settings = None
+        for server_settings in current_user.servers:
+            if server_settings and str(server_settings.id) == sid:
+                settings = server_settings
+                break
+
+        if not settings:
+            return jsonify(status='failed'), 404
+
+        server = servers_manager.find_or_create_server(settings)
+        path = epg_merger.get_path(server, request.args.get('force', 0, type=int) != 0)
+        response = send_file(path, mimetype='application/gzip', add_etags=False, cache_timeout=0)
+        response.set_etag(epg_merger.get_etag(path))
+        return response.make_conditional(request)
+
+    @login_required
+    @route('/export/<sid>/master.m3u', methods=['GET'])
+    def export(self, sid):
+        stream_ids = get_service_stream_ids(ObjectId(sid))
+        if stream_ids is None:
+            return jsonify(status='failed'), 404
+
+        # chunks hold whole entries, logos are rewritten with one lookup per chunk
+        content = (logo_mirror.rewrite_playlist(chunk) for chunk in generate_m3u(iterate_service_streams(stream_ids)))
+        return Response(stream_with_context(content), mimetype='application/x-mpequrl')
+
     @login_required
     def view_log(self):
         server = current_user.get_current_server()
         if server:
-            path = os.path.join(get_runtime_folder(), str(server.id))
-            try:
-                with open(path, "r") as f:
-                    content = f.read()
-
-                return content
-            except OSError as e:
-                print('Caught exception OSError : {0}'.format(e))
+            path = service_logs.get_current_path(str(server.id))
+            if not path:
                 return '''<pre>Not found, please use get log button firstly.</pre>'''
+
+            return make_file_response(path, get_runtime_folder())
         return '''<pre>Not found, please create server firstly.</pre>'''
 
+    @login_required
+    @route('/log_tail', methods=['GET'])
+    def log_tail(self):
+        server = current_user.get_current_server()
+        path = service_logs.get_current_path(str(server.id)) if server else None
+        if not path:
+            return jsonify(status='failed'), 404
+
+        lines = request.args.get('lines', ServiceView.DEFAULT_TAIL_LINES, type=int)
+        return make_tail_response(path, lines)
+
+    @login_required
+    @route('/log_range', methods=['GET'])
+    def log_range(self):
+        server = current_user.get_current_server()
+        path = service_logs.get_current_path(str(server.id)) if server else None
+        if not path:
+            return jsonify(status='failed'), 404
+
+        return make_range_response(path)
+
+    @login_required
+    @route('/placement', methods=['GET'])
+    def placement(self):
+        stream_type = request.args.get('type', constants.StreamType.RELAY, type=int)
+        count = max(request.args.get('count', 1, type=int), 1)
+        services = current_user.get_writable_servers()
+        cost = PlacementEngine.estimate_type_cost(stream_type)
+        chosen, scores = servers_manager.placement.choose(services, cost)
+        plan = {}
+        for target in servers_manager.placement.plan(services, [cost] * count):
+            if target:
+                sid = str(target.id)
+                plan[sid] = plan.get(sid, 0) + 1
+
+        return jsonify(status='ok', service=str(chosen.id) if chosen else None, cost=cost.to_dict(), scores=scores,
+                       plan=plan), 200
+
+    @login_required
+    @route('/rebalance', methods=['GET', 'POST'])
+    def rebalance(self):
+        # GET suggests moves between the user services, POST applies them
+        services = current_user.get_writable_servers()
+        moves = servers_manager.placement.rebalance(services)
+        if request.method == 'GET':
+            return jsonify(status='ok', moves=moves), 200
+
+        grouped = {}
+        for move in moves:
+            grouped.setdefault((move['source'], move['target']), []).append(ObjectId(move['stream']))
+
+        by_id = {str(service.id): service for service in services}
+        moved = 0
+        for (source, target), sids in grouped.items():
+            moved += servers_manager.migrate_streams(by_id[source], by_id[target], sids)
+        return jsonify(status='ok', moves=moves, moved=moved), 200
+
+    @login_required
+    @route('/migrate', methods=['POST'])
+    def migrate(self):
+        data = request.get_json()
+        source = current_user.get_current_server()
+        by_id = {str(service.id): service for service in current_user.get_writable_servers()}
+        target = by_id.get(data.get('target')) if data else None
+        if not source or str(source.id) not in by_id or not target:
+            return jsonify(status='failed'), 404
+
+        sids = data.get('streams', [])
+        if not isinstance(sids, list) or not all(isinstance(sid, str) and ObjectId.is_valid(sid) for sid in sids):
+            return jsonify(status='failed'), 400
+
+        moved = servers_manager.migrate_streams(source, target, [ObjectId(sid) for sid in sids])
+        return jsonify(status='ok', moved=moved), 200
+
+    @login_required
+    @route('/output_status', methods=['GET'])
+    def output_status(self):
+        server = current_user.get_current_server()
+        if not server:
+            return jsonify(status='failed'), 404
+
+        states = output_monitor.get_status([stream.id for stream in server.get_streams()])
+        return jsonify(status='ok', outputs=states), 200
+
+    @login_required
+    @route('/upload_metrics', methods=['GET'])
+    def upload_metrics(self):
+        return jsonify(status='ok', metrics=app.extensions[UploadMetrics.EXTENSION_NAME].to_dict()), 200
+
+    @login_required
+    @route('/duplicates', methods=['GET'])
+    def duplicates(self):
+        server = current_user.get_current_server()
+        if not server:
+            return jsonify(status='failed'), 404
+
+        groups = []
+        for streams in server.get_duplicate_sources():
+            groups.append([{'id': str(stream.id), 'name': stream.stream().name,
+                            'sources': get_source_urls(stream.stream())} for stream in streams])
+        return jsonify(status='ok', duplicates=groups), 200
+
+    @login_required
+    @route('/search_logs', methods=['GET'])
+    def search_logs(self):
+        server = current_user.get_current_server()
+        term = request.args.get('q', '')
+        if not server or not term:
+            return jsonify(status='failed'), 404
+
+        regex = request.args.get('regex', 0, type=int) != 0
+        streams = {str(stream.id): stream.stream().name for stream in server.get_streams()}
+        try:
+            found, complete = stream_logs_index.search(term, list(streams.keys()), regex)
+        except re.error as ex:
+            return jsonify(status='failed', error=str(ex)), 400
+
+        result = [{'id': sid, 'name': streams[sid], 'matches': matches} for sid, matches in found.items()]
+        return jsonify(status='ok', result=result, truncated=not complete), 200
+
     # broadcast routes
 
     @login_required
@@ -275,6 +506,7 @@ class ServiceView(FlaskView):
         if server:
             current_user.set_current_server_position(0)
             server.delete()
+            servers_manager.playlist_cache.invalidate_service(sid)
             return jsonify(status='ok'), 200
 
         return jsonify(status='failed'), 404
@@ -288,18 +520,16 @@ class ServiceView(FlaskView):
         if request.method == 'POST' and form.validate_on_submit():
             server = form.update_entry(server)
             server.save()
+            # links of every stream depend on the service hosts
+            servers_manager.playlist_cache.clear()
             return jsonify(status='ok'), 200
 
         return render_template('service/edit.html', form=form)
 
     @route('/log/<sid>', methods=['POST'])
     def log(self, sid):
-        # len = request.headers['content-length']
-        new_file_path = os.path.join(get_runtime_folder(), sid)
-        with open(new_file_path, 'wb') as f:
-            data = request.stream.read()
-            f.write(b'<pre>')
-            f.write(data)
-            f.write(b'</pre>')
-            f.close()
+        if not LogStore.is_valid_key(sid):
+            return jsonify(status='failed'), 400
+
+        service_logs.ingest(sid, request.stream)
         return jsonify(status='ok'), 200
@@ -0,0 +1,43 @@
+from app.service.stream import HardwareStreamObject
+
+
+class WireFormat:
+    JSON = 'json'
+    COMPACT = 'compact'
+
+    ALL = [JSON, COMPACT]
+
+
+# compact payloads are plain arrays, values ordered as in these schemas
+class CompactSchema:
+    INPUT_BPS_FIELD = 'input_bps'
+    OUTPUT_BPS_FIELD = 'output_bps'
+
+    STREAM_FIELDS = ['id', HardwareStreamObject.STATUS_FIELD, HardwareStreamObject.RESTARTS_FIELD,
+                     HardwareStreamObject.CPU_FIELD, HardwareStreamObject.RSS_FIELD, INPUT_BPS_FIELD,
+                     OUTPUT_BPS_FIELD, HardwareStreamObject.TIMESTAMP_FIELD, HardwareStreamObject.START_TIME_FIELD,
+                     HardwareStreamObject.LOOP_START_TIME_FIELD, HardwareStreamObject.IDLE_TIME_FIELD,
+                     HardwareStreamObject.QUALITY_FIELD, 'price', HardwareStreamObject.BREAKER_FIELD]
+
+    @staticmethod
+    def to_dict(service_fields: list) -> dict:
+        return {'stream': CompactSchema.STREAM_FIELDS, 'service': service_fields}
+
+
+def _total_bps(streams) -> int:
+    total = 0
+    for stream in streams or []:
+        total += stream.get('bps', 0)
+    return total
+
+
+def pack_stream(front: dict) -> list:
+    # per stream input/output statistics are reduced to their total bitrate
+    values = dict(front)
+    values[CompactSchema.INPUT_BPS_FIELD] = _total_bps(front.get(HardwareStreamObject.INPUT_STREAMS_FIELD))
+    values[CompactSchema.OUTPUT_BPS_FIELD] = _total_bps(front.get(HardwareStreamObject.OUTPUT_STREAMS_FIELD))
+    return [values.get(field) for field in CompactSchema.STREAM_FIELDS]
+
+
+def pack_service(service: dict, service_fields: list) -> list:
+    return [service.get(field) for field in service_fields]
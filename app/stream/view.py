@@ -1,21 +1,24 @@
-import os
-
 import pyfastocloud_models.constants as constants
 from bson.objectid import ObjectId
-from flask import render_template, request, jsonify, Response
+from flask import render_template, request, jsonify
 from flask_classy import FlaskView, route
 from flask_login import login_required, current_user
 from pyfastocloud_models.stream.entry import IStream
 
-from app import get_runtime_stream_folder
+from app import app, get_runtime_folder, servers_manager, stream_logs, source_prober, logo_mirror, catchup_planner
 from app.common.stream.forms import ProxyStreamForm, EncodeStreamForm, RelayStreamForm, TimeshiftRecorderStreamForm, \
     CatchupStreamForm, TimeshiftPlayerStreamForm, TestLifeStreamForm, VodEncodeStreamForm, VodRelayStreamForm, \
     ProxyVodStreamForm, CodEncodeStreamForm, CodRelayStreamForm, EventStreamForm
+from app.epg.matcher import ChannelMatcher
+from app.service.log_store import LogStore, make_file_response, make_tail_response, make_range_response
+from app.service.placement import PlacementEngine
+from app.service.source_index import get_source_urls
 
 
 # routes
 class StreamView(FlaskView):
-    DEFAULT_PIPELINE_FILENAME_TEMPLATE_1S = '{0}_pipeline.html'
+    DEFAULT_PIPELINE_FILENAME_TEMPLATE_1S = '{0}_pipeline'
+    DEFAULT_TAIL_LINES = 100
 
     route_base = '/stream/'
 
@@ -23,6 +26,24 @@ class StreamView(FlaskView):
     def _get_pipeline_name(sid: str):
         return StreamView.DEFAULT_PIPELINE_FILENAME_TEMPLATE_1S.format(sid)
 
+    @staticmethod
+    def _add_stream(server, stream: IStream):
+        # with AUTO_PLACEMENT new streams go to the least loaded service the user can write to
+        target = server
+        if app.config.get('AUTO_PLACEMENT'):
+            cost = PlacementEngine.estimate_cost(stream)
+            if cost.cpu or cost.bandwidth:
+                chosen, _ = servers_manager.placement.choose(current_user.get_writable_servers(), cost)
+                if chosen:
+                    target = chosen
+        target.add_stream(stream)
+
+    @staticmethod
+    def _get_log_path(name: str):
+        if not LogStore.is_valid_key(name):
+            return None
+        return stream_logs.get_current_path(name)
+
     @login_required
     @route('/start', methods=['POST'])
     def start(self):
@@ -59,12 +80,49 @@ class StreamView(FlaskView):
             return jsonify(status='ok'), 200
         return jsonify(status='failed'), 404
 
+    @login_required
+    @route('/probe', methods=['POST'])
+    def probe(self):
+        # checks sources of the given streams (all streams of the current service without sids)
+        server = current_user.get_current_server()
+        if not server:
+            return jsonify(status='failed'), 404
+
+        data = request.get_json(silent=True) or {}
+        if 'sids' in data:
+            sids = data['sids']
+            if not isinstance(sids, list) or not all(isinstance(sid, str) and ObjectId.is_valid(sid) for sid in sids):
+                return jsonify(status='failed'), 400
+            streams = [server.find_stream_by_id(ObjectId(sid)) for sid in sids]
+        else:
+            streams = server.get_streams()
+
+        sources = {}
+        for stream in streams:
+            if stream:
+                sources[str(stream.id)] = get_source_urls(stream.stream())
+
+        if data.get('force'):
+            for urls in sources.values():
+                for url in urls:
+                    source_prober.invalidate(url)
+
+        probed = source_prober.probe_many([url for urls in sources.values() for url in urls])
+        result = {sid: [probed[url] for url in urls] for sid, urls in sources.items()}
+        return jsonify(status='ok', result=result), 200
+
     @login_required
     @route('/play/<sid>/master.m3u', methods=['GET'])
     def play(self, sid):
-        stream = IStream.get_by_id(ObjectId(sid))
-        if stream:
-            return Response(stream.generate_playlist(), mimetype='application/x-mpequrl'), 200
+        def generate():
+            stream = IStream.get_by_id(ObjectId(sid))
+            if stream:
+                return logo_mirror.rewrite_playlist(stream.generate_playlist())
+            return None
+
+        playlist = servers_manager.playlist_cache.get_stream_playlist(sid, generate)
+        if playlist:
+            return playlist.make_response()
 
         return jsonify(status='failed'), 404
 
@@ -90,26 +148,48 @@ class StreamView(FlaskView):
 
     @login_required
     def view_log(self, sid):
-        path = os.path.join(get_runtime_stream_folder(), sid)
-        try:
-            with open(path, "r") as f:
-                content = f.read()
-                return content
-        except OSError as e:
-            print('Caught exception OSError : {0}'.format(e))
+        path = StreamView._get_log_path(sid)
+        if not path:
             return '''<pre>Not found, please use get log button firstly.</pre>'''
 
+        return make_file_response(path, get_runtime_folder())
+
     @login_required
     def view_pipeline(self, sid):
-        path = os.path.join(get_runtime_stream_folder(), StreamView._get_pipeline_name(sid))
-        try:
-            with open(path, "r") as f:
-                content = f.read()
-                return content
-        except OSError as e:
-            print('Caught exception OSError : {0}'.format(e))
+        path = StreamView._get_log_path(StreamView._get_pipeline_name(sid))
+        if not path:
             return '''<pre>Not found, please use get pipeline button firstly.</pre>'''
 
+        return make_file_response(path, get_runtime_folder(), 'text/html')
+
+    @login_required
+    @route('/log_tail/<sid>', methods=['GET'])
+    def log_tail(self, sid):
+        path = StreamView._get_log_path(sid)
+        if not path:
+            return jsonify(status='failed'), 404
+
+        lines = request.args.get('lines', StreamView.DEFAULT_TAIL_LINES, type=int)
+        return make_tail_response(path, lines)
+
+    @login_required
+    @route('/log_range/<sid>', methods=['GET'])
+    def log_range(self, sid):
+        path = StreamView._get_log_path(sid)
+        if not path:
+            return jsonify(status='failed'), 404
+
+        return make_range_response(path)
+
+    @login_required
+    @route('/pipeline_range/<sid>', methods=['GET'])
+    def pipeline_range(self, sid):
+        path = StreamView._get_log_path(StreamView._get_pipeline_name(sid))
+        if not path:
+            return jsonify(status='failed'), 404
+
+        return make_range_response(path)
+
     # broadcast routes
 
     @login_required
@@ -122,7 +202,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.make_entry()
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/proxy/add.html', form=form)
@@ -138,7 +218,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.make_entry()
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/vod_proxy/add.html', form=form)
@@ -154,7 +234,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/relay/add.html', form=form,
@@ -171,7 +251,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/encode/add.html', form=form,
@@ -188,7 +268,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/timeshift_recorder/add.html', form=form,
@@ -206,7 +286,7 @@ class StreamView(FlaskView):
             if request.method == 'POST':  # FIXME form.validate_on_submit()
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/test_life/add.html', form=form,
@@ -223,7 +303,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/catchup/add.html', form=form,
@@ -241,7 +321,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/timeshift_player/add.html', form=form,
@@ -258,7 +338,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/vod_relay/add.html', form=form,
@@ -275,7 +355,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/vod_encode/add.html', form=form,
@@ -292,7 +372,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/event/add.html', form=form,
@@ -309,7 +389,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/cod_relay/add.html', form=form,
@@ -326,7 +406,7 @@ class StreamView(FlaskView):
             if request.method == 'POST' and form.validate_on_submit():
                 new_entry = form.update_entry(stream_object.stream())
                 new_entry.save()
-                server.add_stream(new_entry)
+                StreamView._add_stream(server, new_entry)
                 return jsonify(status='ok'), 200
 
             return render_template('stream/cod_encode/add.html', form=form,
@@ -514,26 +594,100 @@ class StreamView(FlaskView):
             return jsonify(status='ok'), 200
         return jsonify(status='failed'), 404
 
+    @login_required
+    @route('/restart_all_streams', methods=['GET'])
+    def restart_all_streams(self):
+        server = current_user.get_current_server()
+        if server:
+            server.restart_all_streams()
+            return jsonify(status='ok'), 200
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/start_progress', methods=['GET'])
+    def start_progress(self):
+        server = current_user.get_current_server()
+        if server:
+            return jsonify(status='ok', progress=server.get_start_progress()), 200
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/cancel_starts', methods=['POST'])
+    def cancel_starts(self):
+        server = current_user.get_current_server()
+        if server:
+            server.cancel_scheduled_starts()
+            return jsonify(status='ok'), 200
+        return jsonify(status='failed'), 404
+
+    @login_required
+    @route('/match_epg', methods=['GET'])
+    def match_epg(self):
+        # suggested tvg_id for every stream of the current service without a known one
+        server = current_user.get_current_server()
+        if not server:
+            return jsonify(status='failed'), 404
+
+        min_confidence = request.args.get('min_confidence', ChannelMatcher.DEFAULT_MIN_CONFIDENCE, type=float)
+        matcher = ChannelMatcher.load()
+        return jsonify(status='ok', matches=matcher.match_streams(server.get_streams(), min_confidence)), 200
+
+    @login_required
+    @route('/apply_epg_matches', methods=['POST'])
+    def apply_epg_matches(self):
+        # {matches: [{id, tvg_id}]}, usually the accepted part of match_epg
+        server = current_user.get_current_server()
+        if not server:
+            return jsonify(status='failed'), 404
+
+        data = request.get_json(silent=True) or {}
+        tvg_ids = {}
+        for match in data.get('matches', []):
+            if not isinstance(match, dict):
+                continue
+
+            sid = match.get('id')
+            tvg_id = match.get('tvg_id')
+            if not isinstance(sid, str) or not ObjectId.is_valid(sid):
+                continue  # entries without a valid stream id are skipped
+            if isinstance(tvg_id, str) and tvg_id and len(tvg_id) < constants.MAX_STREAM_TVG_ID_LENGTH:
+                tvg_ids[ObjectId(sid)] = tvg_id
+
+        return jsonify(status='ok', updated=server.update_tvg_ids(tvg_ids)), 200
+
+    @login_required
+    @route('/auto_catchup', methods=['GET', 'POST'])
+    def auto_catchup(self):
+        # GET lists channels recorded from epg, POST {sids, enabled, keep, remove} changes them
+        server = current_user.get_current_server()
+        if not server:
+            return jsonify(status='failed'), 404
+
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            sids = data.get('sids', [])
+            if data.get('enabled', True):
+                changed = catchup_planner.enable(server, sids, data.get('keep'))
+            else:
+                changed = catchup_planner.disable(server, sids, data.get('remove', False))
+            return jsonify(status='ok', changed=changed), 200
+
+        plans = [{'stream': str(plan.stream), 'keep': plan.keep} for plan in catchup_planner.get_plans(server)]
+        return jsonify(status='ok', plans=plans), 200
+
     @route('/log/<sid>', methods=['POST'])
     def log(self, sid):
-        # len = request.headers['content-length']
-        new_file_path = os.path.join(get_runtime_stream_folder(), sid)
-        with open(new_file_path, 'wb') as f:
-            data = request.stream.read()
-            f.write(b'<pre>')
-            f.write(data)
-            f.write(b'</pre>')
-            f.close()
+        if not LogStore.is_valid_key(sid):
+            return jsonify(status='failed'), 400
 
+        stream_logs.ingest(sid, request.stream)
         return jsonify(status='ok'), 200
 
     @route('/pipeline/<sid>', methods=['POST'])
     def pipeline(self, sid):
-        # len = request.headers['content-length']
-        new_file_path = os.path.join(get_runtime_stream_folder(), StreamView._get_pipeline_name(sid))
-        with open(new_file_path, 'wb') as f:
-            data = request.stream.read()
-            f.write(data)
-            f.close()
+        name = StreamView._get_pipeline_name(sid)
+        if not LogStore.is_valid_key(name):
+            return jsonify(status='failed'), 400
 
+        stream_logs.ingest(name, request.stream)
         return jsonify(status='ok'), 200
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import argparse
+import logging
 import os
 import sys
 
@@ -8,8 +9,11 @@ from pymodm import connect
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
+from app.logo.validator import LogoValidator
+from app.service.http_pool import HttpPool
 from app.service.service import ServiceSettings
 from scripts.migrate.xtream.streams import import_streams_to_server
+from scripts.migrate.xtream.engine import MigrationEngine
 
 PROJECT_NAME = 'import_streams_from_xtream'
 
@@ -21,8 +25,15 @@ if __name__ == '__main__':
     parser.add_argument('--mysql_password', help='MySQL password', default='')
     parser.add_argument('--mysql_port', help='MySQL port', default=3306)
     parser.add_argument('--server_id', help='Server ID', default='')
+    parser.add_argument('--chunk_size', help='Rows fetched per chunk', type=int,
+                        default=MigrationEngine.DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--workers', help='Concurrent logo validations', type=int,
+                        default=MigrationEngine.DEFAULT_WORKERS)
+    parser.add_argument('--checkpoint', help='Checkpoint file to resume from', default=None)
+    parser.add_argument('--dry_run', help='Convert rows without writing to MongoDB', action='store_true')
 
     argv = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
     mysql_host = argv.mysql_host
     mysql_user = argv.mysql_user
     mysql_password = argv.mysql_password
@@ -45,5 +56,8 @@ if __name__ == '__main__':
         database='xtream_iptvpro'
     )
 
-    import_streams_to_server(d, ser)
+    logo_validator = LogoValidator(HttpPool(argv.workers))
+    engine = MigrationEngine(d, argv.chunk_size, argv.workers, argv.checkpoint, argv.dry_run,
+                             logo_validator=logo_validator)
+    import_streams_to_server(engine, ser)
     d.close()
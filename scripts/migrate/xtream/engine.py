@@ -0,0 +1,154 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from bson.objectid import ObjectId
+from pyfastocloud_models.utils.utils import is_valid_http_url
+from pymongo import ReplaceOne
+
+
+class MigrationStats(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = 0
+        self.imported = 0
+        self.skipped = 0
+        self._start = time.time()
+
+    def elapsed(self) -> float:
+        return time.time() - self._start
+
+    def rate(self) -> float:
+        elapsed = self.elapsed()
+        return self.rows / elapsed if elapsed else 0
+
+    def __str__(self):
+        return '{0}: rows:{1} imported:{2} skipped:{3} elapsed:{4:.1f}s rate:{5:.1f} rows/s'.format(
+            self.name, self.rows, self.imported, self.skipped, self.elapsed(), self.rate())
+
+
+class MigrationEngine(object):
+    DEFAULT_CHUNK_SIZE = 1000
+    DEFAULT_WORKERS = 16
+    DEFAULT_LOGO_TIMEOUT = 0.1
+
+    def __init__(self, db, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS, checkpoint_path=None,
+                 dry_run=False, placeholder='%s', logo_validator=None):
+        # db is any DB-API connection (mysql.connector, sqlite3), placeholder is its parameter marker,
+        # logo_validator (app.logo.validator.LogoValidator) shares cached logo checks with the admin
+        self._db = db
+        self._logo_validator = logo_validator
+        self._chunk_size = chunk_size
+        self._workers = workers
+        self._checkpoint_path = checkpoint_path
+        self._dry_run = dry_run
+        self._placeholder = placeholder
+        self._checkpoints = self.__load_checkpoints()
+
+    @property
+    def dry_run(self) -> bool:
+        return self._dry_run
+
+    def fetch_chunks(self, table: str, columns: list, key='id'):
+        # unbuffered cursor, rows are pulled from the server chunk by chunk in key order
+        last_key = self._checkpoints.get(table)
+        sql = 'SELECT {0} FROM {1}'.format(','.join([key] + [column for column in columns if column != key]), table)
+        params = ()
+        if last_key is not None:
+            sql += ' WHERE {0} > {1}'.format(key, self._placeholder)
+            params = (last_key,)
+        sql += ' ORDER BY {0}'.format(key)
+
+        cursor = self._db.cursor()
+        try:
+            cursor.execute(sql, params)
+            names = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(self._chunk_size)
+                if not rows:
+                    break
+                yield [dict(zip(names, row)) for row in rows]
+        finally:
+            cursor.close()
+
+    def run(self, table: str, columns: list, convert, write, key='id') -> MigrationStats:
+        # convert(rows) -> items to store, write(items) persists them, skipped in dry run mode
+        stats = MigrationStats(table)
+        for rows in self.fetch_chunks(table, columns, key):
+            items = convert(rows)
+            stats.rows += len(rows)
+            stats.imported += len(items)
+            stats.skipped += len(rows) - len(items)
+            if not self._dry_run:
+                if items:
+                    write(items)
+                self.__save_checkpoint(table, rows[-1][key])
+            logging.info(str(stats))
+
+        logging.info('Finished %s%s', str(stats), ' (dry run)' if self._dry_run else '')
+        return stats
+
+    @staticmethod
+    def make_id(table: str, key) -> ObjectId:
+        # the same source row always gets the same document id, a chunk written again after a crash between write
+        # and checkpoint replaces its own documents instead of duplicating them
+        return ObjectId(hashlib.md5('{0}:{1}'.format(table, key).encode('utf-8')).hexdigest()[:24])
+
+    @staticmethod
+    @contextmanager
+    def deferred_save(instance):
+        # for model methods that save on their own (Subscriber.add_server), write_documents stores the instance
+        instance.save = lambda *args, **kwargs: instance
+        try:
+            yield instance
+        finally:
+            del instance.save
+
+    @staticmethod
+    def write_documents(model, instances: list) -> list:
+        # validated upserts by id with one unordered bulk write, returns the ids
+        operations = []
+        ids = []
+        for instance in instances:
+            instance.full_clean()
+            son = instance.to_son()
+            operations.append(ReplaceOne({'_id': son['_id']}, son, upsert=True))
+            ids.append(son['_id'])
+
+        if operations:
+            model._mongometa.collection.bulk_write(operations, ordered=False)
+        return ids
+
+    def validate_logos(self, urls: list, timeout=DEFAULT_LOGO_TIMEOUT) -> set:
+        if self._logo_validator:
+            return self._logo_validator.validate(urls)
+
+        uniq = list(set(url for url in urls if url))
+        if not uniq:
+            return set()
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            results = executor.map(lambda url: is_valid_http_url(url, timeout=timeout), uniq)
+            return set(url for url, valid in zip(uniq, results) if valid)
+
+    # private
+    def __load_checkpoints(self) -> dict:
+        if not self._checkpoint_path or not os.path.exists(self._checkpoint_path):
+            return {}
+
+        with open(self._checkpoint_path, 'r') as f:
+            return json.load(f)
+
+    def __save_checkpoint(self, table: str, last_key):
+        self._checkpoints[table] = last_key
+        if not self._checkpoint_path:
+            return
+
+        tmp_path = self._checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._checkpoints, f)
+        os.replace(tmp_path, self._checkpoint_path)
@@ -2,24 +2,30 @@ from pyfastocloud_models.provider.entry_pair import ProviderPair
 
 from app.home.entry import ProviderUser
 from app.service.service import ServiceSettings
+from scripts.migrate.xtream.engine import MigrationEngine, MigrationStats
 
 
-def import_resellers_to_server(db, server: ServiceSettings):
-    cursor = db.cursor(dictionary=True)
-    sql = 'SELECT username,email,password from reg_users'
-    cursor.execute(sql)
-    sql_providers = cursor.fetchall()
+def import_resellers_to_server(engine: MigrationEngine, server: ServiceSettings) -> MigrationStats:
+    def convert(rows: list) -> list:
+        resellers = []
+        for sql_entry in rows:
+            email = sql_entry['email']
+            password = sql_entry['email']
+            new_user = ProviderUser.make_provider(email=email, first_name='Xtream', last_name='Codes',
+                                                  password=password, country='US', language='en')
+            new_user.pk = MigrationEngine.make_id('reg_users', sql_entry['id'])
+            new_user.status = ProviderUser.Status.ACTIVE
+            resellers.append(new_user)
+        return resellers
 
-    for sql_entry in sql_providers:
-        email = sql_entry['email']
-        password = sql_entry['email']
-        new_user = ProviderUser.make_provider(email=email, first_name='Xtream', last_name='Codes', password=password,
-                                              country='US', language='en')
-        new_user.status = ProviderUser.Status.ACTIVE
-        new_user.save()
+    def write(resellers: list):
+        # resellers of a chunk are written with one bulk write, a chunk written again does not add them twice
+        linked = set(getattr(pair.user, 'pk', pair.user) for pair in server.providers if pair)
+        for new_user in resellers:
+            if new_user.pk not in linked:
+                server.add_provider(ProviderPair(new_user.pk, ProviderPair.Roles.ADMIN))
+            new_user.add_server(server)
+        MigrationEngine.write_documents(ProviderUser, resellers)
+        server.save()
 
-        admin = ProviderPair(new_user.id, ProviderPair.Roles.ADMIN)
-        server.add_provider(admin)
-        new_user.add_server(server)
-
-    cursor.close()
+    return engine.run('reg_users', ['username', 'email', 'password'], convert, write)
@@ -2,35 +2,42 @@ import json
 
 import pyfastocloud_models.constants as constants
 from pyfastocloud_models.stream.entry import ProxyStream
-from pyfastocloud_models.utils.utils import is_valid_http_url
 
 from app.service.service import ServiceSettings
-
-
-def import_streams_to_server(db, server: ServiceSettings):
-    cursor = db.cursor(dictionary=True)
-    sql = 'SELECT stream_source, stream_display_name, stream_icon, channel_id from streams'
-    cursor.execute(sql)
-    sql_streams = cursor.fetchall()
-
-    for sql_entry in sql_streams:
-        stream = ProxyStream.make_stream(server)
-        urls = json.loads(sql_entry['stream_source'])
-        if not len(urls):
-            continue
-
-        stream.output[0].uri = urls[0]
-        stream.name = sql_entry['stream_display_name']
-        tvg_logo = sql_entry['stream_icon']
-        if len(tvg_logo) < constants.MAX_URL_LENGTH:
-            if is_valid_http_url(tvg_logo, timeout=0.1):
+from scripts.migrate.xtream.engine import MigrationEngine, MigrationStats
+
+
+def import_streams_to_server(engine: MigrationEngine, server: ServiceSettings) -> MigrationStats:
+    def convert(rows: list) -> list:
+        logos = [row['stream_icon'] for row in rows if
+                 row['stream_icon'] and len(row['stream_icon']) < constants.MAX_URL_LENGTH]
+        valid_logos = engine.validate_logos(logos)
+
+        streams = []
+        for sql_entry in rows:
+            urls = json.loads(sql_entry['stream_source'])
+            if not len(urls):
+                continue
+
+            stream = ProxyStream.make_stream(server)
+            stream.pk = MigrationEngine.make_id('streams', sql_entry['id'])
+            stream.output[0].uri = urls[0]
+            stream.name = sql_entry['stream_display_name']
+            tvg_logo = sql_entry['stream_icon']
+            if tvg_logo in valid_logos:
                 stream.tvg_logo = tvg_logo
-        epg_id = sql_entry['channel_id']
-        if epg_id:
-            stream.tvg_id = epg_id
-
-        stream.save()
-        server.streams.append(stream)
-
-    server.save()
-    cursor.close()
+            epg_id = sql_entry['channel_id']
+            if epg_id:
+                stream.tvg_id = epg_id
+            streams.append(stream)
+        return streams
+
+    def write(streams: list):
+        ids = MigrationEngine.write_documents(ProxyStream, streams)
+        ServiceSettings.objects.raw({'_id': server.id}).update({'$addToSet': {'streams': {'$each': ids}}})
+        # the subscribers import links server.streams, the new streams have to be there too
+        linked = set(stream.pk for stream in server.streams if stream)
+        server.streams.extend(stream for stream in streams if stream.pk not in linked)
+
+    return engine.run('streams', ['stream_source', 'stream_display_name', 'stream_icon', 'channel_id'], convert,
+                      write)
@@ -4,28 +4,34 @@ from pyfastocloud_models.subscriber.entry import Device
 from pyfastocloud_models.subscriber.entry import Subscriber
 
 from app.service.service import ServiceSettings
+from scripts.migrate.xtream.engine import MigrationEngine, MigrationStats
 
 
-def import_subscribers_to_server(db, server: ServiceSettings):
-    cursor = db.cursor(dictionary=True)
-    sql = 'SELECT username,password,created_at,exp_date FROM users'
-    cursor.execute(sql)
-    sql_subscribers = cursor.fetchall()
+def import_subscribers_to_server(engine: MigrationEngine, server: ServiceSettings) -> MigrationStats:
+    def convert(rows: list) -> list:
+        subscribers = []
+        for sql_entry in rows:
+            new_user = Subscriber.make_subscriber(email=sql_entry['username'], first_name=sql_entry['username'],
+                                                  last_name=sql_entry['username'], password=sql_entry['password'],
+                                                  country='US', language='US')
+            new_user.pk = MigrationEngine.make_id('users', sql_entry['id'])
+            new_user.status = Subscriber.Status.ACTIVE
+            created_at = sql_entry['created_at']
+            if created_at:
+                new_user.created_date = datetime.fromtimestamp(created_at)
+            exp_date = sql_entry['exp_date']
+            if exp_date:
+                new_user.exp_date = datetime.fromtimestamp(exp_date)
+            dev = Device(name='Xtream')
+            new_user.add_device(dev)
+            subscribers.append(new_user)
+        return subscribers
 
-    for sql_entry in sql_subscribers:
-        new_user = Subscriber.make_subscriber(email=sql_entry['username'], first_name=sql_entry['username'],
-                                              last_name=sql_entry['username'], password=sql_entry['password'],
-                                              country='US', language='US')
-        new_user.status = Subscriber.Status.ACTIVE
-        created_at = sql_entry['created_at']
-        if created_at:
-            new_user.created_date = datetime.fromtimestamp(created_at)
-        exp_date = sql_entry['exp_date']
-        if exp_date:
-            new_user.exp_date = datetime.fromtimestamp(exp_date)
-        dev = Device(name='Xtream')
-        new_user.add_device(dev)
-        # save
-        new_user.add_server(server)
+    def write(subscribers: list):
+        # add_server links the server streams and saves the subscriber, the saves of a chunk go in one bulk write
+        for new_user in subscribers:
+            with MigrationEngine.deferred_save(new_user):
+                new_user.add_server(server)
+        MigrationEngine.write_documents(Subscriber, subscribers)
 
-    cursor.close()
+    return engine.run('users', ['username', 'password', 'created_at', 'exp_date'], convert, write)
@@ -9,20 +9,15 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 PROJECT_NAME = 'parse_streams_collection'
 
-from pyfastocloud_models.stream.entry import IStream
+from app.service.playlist_writer import iterate_all_streams, write_m3u
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(prog=PROJECT_NAME, usage='%(prog)s [options]')
     parser.add_argument('--mongo_uri', help='MongoDB credentials', default='mongodb://localhost:27017/iptv')
+    parser.add_argument('--out', help='Output playlist path', default='out.m3u')
 
     argv = parser.parse_args()
 
     mongo = connect(argv.mongo_uri)
     if mongo:
-        streams = IStream.objects.all()
-        f = open("out.m3u", "w")
-        f.write('#EXTM3U\n')
-        idx = 0
-        for stream in streams:
-            f.write(stream.generate_input_playlist(False))
-        f.close()
+        write_m3u(argv.out, iterate_all_streams(), input_playlist=True)
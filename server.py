@@ -7,7 +7,7 @@ import gevent
 from gevent.pywsgi import WSGIServer
 from geventwebsocket.handler import WebSocketHandler
 
-from app import app, servers_manager
+from app import app, servers_manager, output_monitor, logo_mirror, catchup_planner
 
 PROJECT_NAME = 'fastocloud_iptv_admin'
 LOGS_PATH = PROJECT_NAME + '.log'
@@ -29,11 +29,17 @@ def main():
     http_server = WSGIServer((servers_manager.host, servers_manager.port), app, handler_class=WebSocketHandler)
     srv_greenlet = gevent.spawn(http_server.serve_forever)
     alarm_greenlet = gevent.spawn(servers_refresh)
+    monitor_greenlet = gevent.spawn(output_monitor.run)
+    mirror_greenlet = gevent.spawn(logo_mirror.run)
+    catchup_greenlet = gevent.spawn(catchup_planner.run)
 
     try:
-        gevent.joinall([srv_greenlet, alarm_greenlet])
+        gevent.joinall([srv_greenlet, alarm_greenlet, monitor_greenlet, mirror_greenlet, catchup_greenlet])
     except KeyboardInterrupt:
         servers_manager.stop()
+        output_monitor.stop()
+        logo_mirror.stop()
+        catchup_planner.stop()
         http_server.stop()
 
 
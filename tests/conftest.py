@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+# app/__init__.py builds the whole application (config, mongo, services), tests import the modules they need
+# from the app folder without running it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+if 'app' not in sys.modules:
+    package = types.ModuleType('app')
+    package.__path__ = [os.path.join(ROOT, 'app')]
+    sys.modules['app'] = package
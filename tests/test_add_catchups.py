@@ -0,0 +1,66 @@
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('pyfastocloud')
+pytest.importorskip('pyfastocloud_models')
+
+from bson.objectid import ObjectId  # noqa: E402
+from pyfastocloud_models.common_entries import InputUrl, OutputUrl  # noqa: E402
+from pyfastocloud_models.service.entry import ServiceSettings  # noqa: E402
+from pyfastocloud_models.stream.entry import IStream, CatchupStream  # noqa: E402
+
+from app.service.service import Service  # noqa: E402
+
+
+def _make_service() -> Service:
+    settings = mock.MagicMock()
+    settings.id = ObjectId()
+    settings.streams = []
+    settings.hls_directory = '/hls'
+    return Service('localhost', 8080, None, settings, mock.MagicMock())
+
+
+def _make_catchup(name: str) -> CatchupStream:
+    catchup = CatchupStream(name=name)
+    catchup.input = [InputUrl.make_stub()]
+    catchup.output = [OutputUrl.make_default_http()]
+    return catchup
+
+
+def test_add_catchups_gives_ids_before_insert():
+    service = _make_service()
+    channel = mock.MagicMock()
+    channel.id = ObjectId()
+    channel.stream.return_value.parts = []
+    catchups = [_make_catchup('first'), _make_catchup('second')]
+
+    inserted = []
+
+    def bulk_create(objects, **kwargs):
+        # like pymodm, the documents are inserted as they are and the models are left alone
+        inserted.extend(obj.to_son() for obj in objects)
+        return [son['_id'] for son in inserted]
+
+    with mock.patch.object(CatchupStream, 'objects') as catchup_objects, \
+            mock.patch.object(IStream, 'objects') as stream_objects, \
+            mock.patch.object(ServiceSettings, 'objects') as settings_objects:
+        catchup_objects.bulk_create.side_effect = bulk_create
+        service.add_catchups(channel, catchups)
+
+    ids = [catchup.id for catchup in catchups]
+    assert all(isinstance(sid, ObjectId) for sid in ids)
+    assert len(set(ids)) == len(ids)
+    assert [son['_id'] for son in inserted] == ids
+
+    settings_push = settings_objects.raw.return_value.update.call_args[0][0]
+    assert settings_push == {'$push': {'streams': {'$each': ids}}}
+    parts_push = stream_objects.raw.return_value.update.call_args[0][0]
+    assert parts_push == {'$push': {'parts': {'$each': ids}}}
+    assert channel.stream.return_value.parts == catchups
+
+    for catchup in catchups:
+        stream_object = service.find_stream_by_id(catchup.id)
+        assert stream_object is not None
+        assert str(catchup.id) in stream_object._generate_catchup_dir()
+        assert 'None' not in stream_object._generate_catchup_dir()
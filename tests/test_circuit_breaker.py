@@ -0,0 +1,24 @@
+from app.service.circuit_breaker import RestartBreaker, BreakerState
+
+
+def test_quits_open_the_breaker():
+    breaker = RestartBreaker(window=60, max_restarts=3, backoff=10)
+    assert not breaker.on_quit(now=100)
+    assert not breaker.on_quit(now=101)
+    assert breaker.on_quit(now=102)
+    assert breaker.state == BreakerState.OPEN
+    assert breaker.retry_at == 112
+
+
+def test_expected_quits_are_not_counted():
+    breaker = RestartBreaker(window=60, max_restarts=2, backoff=10)
+    for now in range(100, 110):
+        breaker.expect_quit()
+        assert not breaker.on_quit(now=now)
+    assert breaker.state == BreakerState.CLOSED
+
+    # only the quit that was asked for is skipped
+    breaker.expect_quit()
+    assert not breaker.on_quit(now=110)
+    assert not breaker.on_quit(now=111)
+    assert breaker.on_quit(now=112)
@@ -0,0 +1,57 @@
+import io
+import re
+
+import pytest
+
+pytest.importorskip('gevent')
+pytest.importorskip('pyfastocloud_models')
+
+from bson.objectid import ObjectId  # noqa: E402
+
+from app.service.log_index import LogSearchIndex  # noqa: E402
+from app.service.log_store import LogStore  # noqa: E402
+
+
+@pytest.mark.parametrize('term', ['(a+)+$', '(a|aa)*', '((ab)*c)+', '(x+){2,}', r'(a)\1', '(?P<w>a)(?P=w)', 'a' * 300])
+def test_unsafe_regex_is_refused(term):
+    with pytest.raises(re.error):
+        LogSearchIndex.compile_regex(term)
+
+
+@pytest.mark.parametrize('term', ['error [0-9]+', '(audio|video) failed', '(ab)+', '[(+*)]+', r'\(a+\)+', 'x{2}'])
+def test_safe_regex_is_compiled(term):
+    assert LogSearchIndex.compile_regex(term)
+
+
+def test_search_stops_at_max_scan(tmp_path):
+    store = LogStore(str(tmp_path / 'logs'))
+    keys = [str(ObjectId()) for _ in range(3)]
+    for key in keys:
+        store.ingest(key, io.BytesIO(b'error here\n' * 100))
+
+    index = LogSearchIndex(store, max_scan=800)
+    found, complete = index.search('error', keys)
+    assert not complete
+    assert list(found.keys()) == keys[:2]
+
+    index = LogSearchIndex(store)
+    found, complete = index.search('error', keys, max_matches=5)
+    assert complete
+    assert [len(matches) for matches in found.values()] == [5, 5, 5]
+
+
+def test_index_entries_are_capped(tmp_path):
+    store = LogStore(str(tmp_path / 'logs'))
+    keys = [str(ObjectId()) for _ in range(3)]
+    for key in keys:
+        store.ingest(key, io.BytesIO(b'alpha beta gamma\n'))
+
+    index = LogSearchIndex(store, max_tokens=4)
+    index.search('alpha', keys)
+    index._worker.join()
+    assert sum(len(posting) for posting in index._postings.values()) == 4
+    assert sum(len(tokens) for tokens in index._tokens.values()) == 4
+
+    # unknown tokens scan every log once the index overflowed
+    found, _ = index.search('gamma', keys)
+    assert list(found.keys()) == keys
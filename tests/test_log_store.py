@@ -0,0 +1,62 @@
+import io
+import os
+
+import pytest
+
+pytest.importorskip('pyfastocloud_models')
+
+from bson.objectid import ObjectId  # noqa: E402
+
+from app.service.log_store import LogStore  # noqa: E402
+
+
+class _BrokenStream(object):
+    def read(self, size):
+        raise IOError('connection reset')
+
+
+def test_ingest_keeps_generations(tmp_path):
+    store = LogStore(str(tmp_path / 'logs'), generations=3)
+    key = str(ObjectId())
+    store.ingest(key, io.BytesIO(b'first\n'))
+    store.ingest(key, io.BytesIO(b'first\nsecond\n'))
+
+    with open(store.get_current_path(key), 'rb') as f:
+        assert f.read() == b'first\nsecond\n'
+    assert store.get_generation_path(key, 1)
+    index = store.get_index(key)
+    assert [entry[LogStore.LINES_FIELD] for entry in index] == [2, 1]
+    assert index[0][LogStore.APPENDED_FROM_FIELD] == len(b'first\n')
+
+
+def test_ingest_error_is_not_hidden(tmp_path):
+    store = LogStore(str(tmp_path / 'logs'))
+    key = str(ObjectId())
+    with pytest.raises(IOError, match='connection reset'):
+        store.ingest(key, _BrokenStream())
+    assert not store.get_current_path(key)
+    assert os.listdir(os.path.join(str(tmp_path / 'logs'), key)) == []
+
+
+def test_import_legacy_files(tmp_path):
+    legacy = tmp_path / 'runtime_folder'
+    legacy.mkdir()
+    (legacy / 'stream').mkdir()  # folders of other data are left alone
+    (legacy / 'notes').write_bytes(b'not a log')
+    sid = str(ObjectId())
+    (legacy / sid).write_bytes(b'<pre>old log\n')
+    (legacy / (sid + '_pipeline')).write_bytes(b'digraph {}\n')
+
+    store = LogStore(str(tmp_path / 'logs'))
+    assert store.import_legacy(str(legacy)) == 2
+    with open(store.get_current_path(sid), 'rb') as f:
+        assert f.read() == b'<pre>old log\n'
+    assert store.get_current_path(sid + '_pipeline')
+    assert sorted(os.listdir(str(legacy))) == ['notes', 'stream']
+
+    # a legacy file left next to a log of the new layout does not replace it
+    (legacy / sid).write_bytes(b'stale\n')
+    assert store.import_legacy(str(legacy)) == 0
+    with open(store.get_current_path(sid), 'rb') as f:
+        assert f.read() == b'<pre>old log\n'
+    assert not (legacy / sid).exists()
@@ -0,0 +1,59 @@
+import io
+
+from app.service.playlist_reader import MAX_LINE_LENGTH, iterate_m3u, iterate_m3u_batches
+
+
+def _parse(data: bytes) -> list:
+    return list(iterate_m3u(io.BytesIO(data)))
+
+
+def test_bom_and_crlf():
+    entries = _parse(b'\xef\xbb\xbf#EXTM3U\r\n#EXTINF:-1,First\r\nhttp://host/1\r\n')
+    assert [(entry.title, entry.link) for entry in entries] == [('First', 'http://host/1')]
+
+
+def test_cp1252_title():
+    entries = _parse('#EXTM3U\n#EXTINF:-1,Caf\xe9 TV\nhttp://host/1\n'.encode('cp1252'))
+    assert entries[0].title == 'Caf\xe9 TV'
+
+
+def test_utf8_title():
+    entries = _parse('#EXTM3U\n#EXTINF:-1,Caf\xe9 TV\nhttp://host/1\n'.encode('utf-8'))
+    assert entries[0].title == 'Caf\xe9 TV'
+
+
+def test_quoted_comma_and_attributes():
+    entries = _parse(b'#EXTM3U\n#EXTINF:-1 tvg-id="a.b" tvg-logo="http://l/1.png" group-title="News, World" '
+                     b'catchup=append,Title, with commas\nhttp://host/1\n')
+    entry = entries[0]
+    assert entry.duration == -1
+    assert entry.title == 'Title, with commas'
+    assert entry.tvg_id == 'a.b'
+    assert entry.tvg_logo == 'http://l/1.png'
+    assert entry.tvg_group == 'News, World'
+    assert entry.attributes == {'catchup': 'append'}
+
+
+def test_extgrp():
+    entries = _parse(b'#EXTM3U\n#EXTINF:-1,First\n#EXTGRP:Sports\nhttp://host/1\n'
+                     b'#EXTINF:-1 group-title="Movies",Second\n#EXTGRP:Sports\nhttp://host/2\n')
+    assert [entry.tvg_group for entry in entries] == ['Sports', 'Movies']
+
+
+def test_bare_urls_have_no_title():
+    entries = _parse(b'http://host/1\n#EXTINF:-1,Second\nhttp://host/2\nhttp://host/3\n')
+    assert [(entry.title, entry.link) for entry in entries] == [('', 'http://host/1'), ('Second', 'http://host/2'),
+                                                                 ('', 'http://host/3')]
+
+
+def test_oversize_line_is_skipped():
+    oversize = b'#EXTINF:-1,' + b'x' * (MAX_LINE_LENGTH * 2) + b'\nhttp://host/long\n'
+    entries = _parse(b'#EXTM3U\n' + oversize + b'#EXTINF:-1,Next\nhttp://host/next\n')
+    # the oversized extinf is dropped, its url is a bare entry and the rest is not taken for urls
+    assert [(entry.title, entry.link) for entry in entries] == [('', 'http://host/long'), ('Next', 'http://host/next')]
+
+
+def test_batches():
+    data = b''.join(b'#EXTINF:-1,S%d\nhttp://host/%d\n' % (i, i) for i in range(5))
+    batches = list(iterate_m3u_batches(io.BytesIO(data), 2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
@@ -0,0 +1,22 @@
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('pyfastocloud_models')
+
+from bson.objectid import ObjectId  # noqa: E402
+
+from app.service import playlist_writer  # noqa: E402
+
+
+def test_service_streams_keep_their_order():
+    ids = [ObjectId() for _ in range(5)]
+    streams = {sid: mock.MagicMock(pk=sid) for sid in ids[:4]}  # the last stream is gone
+
+    def iterate_streams(query: dict):
+        # storage order, not the $in order
+        return [streams[sid] for sid in reversed(query['_id']['$in']) if sid in streams]
+
+    with mock.patch.object(playlist_writer, '_iterate_streams', side_effect=iterate_streams):
+        result = list(playlist_writer.iterate_service_streams(ids, chunk_size=2))
+    assert [stream.pk for stream in result] == ids[:4]
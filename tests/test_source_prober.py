@@ -0,0 +1,83 @@
+import functools
+import http.server
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('gevent')
+
+from app.service.http_pool import HttpPool  # noqa: E402
+from app.service.source_prober import SourceProber, ProbeStatus, ProbeFields  # noqa: E402
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+
+def _live_playlist(segment: str) -> str:
+    return '#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXTINF:2,\n{0}\n'.format(segment)
+
+
+@pytest.fixture()
+def origin(tmp_path):
+    # http.server stand-in for the stream sources, Last-Modified comes from the file mtime
+    files = {
+        'fresh.m3u8': _live_playlist('fresh.ts'),
+        'stuck.m3u8': _live_playlist('stuck.ts'),
+        'missing.m3u8': _live_playlist('gone.ts'),
+        'empty.m3u8': '#EXTM3U\n#EXT-X-TARGETDURATION:2\n',
+        'vod.m3u8': '#EXTM3U\n#EXTINF:2,\nstuck.ts\n#EXT-X-ENDLIST\n',
+        'master.m3u8': '#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1000\nstuck.m3u8\n',
+        'fresh.ts': 'x' * 188,
+        'stuck.ts': 'x' * 188,
+    }
+    for name, content in files.items():
+        (tmp_path / name).write_text(content)
+    old = time.time() - 3600
+    os.utime(str(tmp_path / 'stuck.ts'), (old, old))
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                             functools.partial(_QuietHandler, directory=str(tmp_path)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{0}/'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('name,status', [
+    ('fresh.m3u8', ProbeStatus.OK),
+    ('stuck.m3u8', ProbeStatus.STALE),
+    ('missing.m3u8', ProbeStatus.STALE),
+    ('empty.m3u8', ProbeStatus.STALE),
+    ('vod.m3u8', ProbeStatus.OK),
+    ('master.m3u8', ProbeStatus.STALE),
+    ('fresh.ts', ProbeStatus.OK),
+    ('nothing.m3u8', ProbeStatus.FAILED),
+])
+def test_probe_status(origin, name, status):
+    prober = SourceProber(HttpPool(4, 2))
+    probed = prober.probe(origin + name)
+    assert probed[ProbeFields.STATUS] == status
+    assert probed[ProbeFields.RESPONSE_TIME] is not None
+
+
+def test_probe_unsupported_scheme():
+    prober = SourceProber(HttpPool(1, 1))
+    assert prober.probe('rtmp://host/live')[ProbeFields.STATUS] == ProbeStatus.UNSUPPORTED
+
+
+def test_probe_is_cached_until_invalidated(origin, tmp_path):
+    prober = SourceProber(HttpPool(4, 2))
+    url = origin + 'fresh.m3u8'
+    first = prober.probe(url)
+    (tmp_path / 'fresh.m3u8').unlink()
+    assert prober.probe(url) is first
+
+    prober.invalidate(url)
+    assert prober.probe(url)[ProbeFields.STATUS] == ProbeStatus.FAILED
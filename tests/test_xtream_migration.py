@@ -0,0 +1,85 @@
+import json
+import sqlite3
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('pyfastocloud_models')
+
+from scripts.migrate.xtream.engine import MigrationEngine  # noqa: E402
+
+
+def _make_db(rows: int) -> sqlite3.Connection:
+    # sqlite stand-in for the xtream mysql database
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE streams (id INTEGER PRIMARY KEY, stream_source TEXT, stream_display_name TEXT, '
+               'stream_icon TEXT, channel_id TEXT)')
+    db.executemany('INSERT INTO streams VALUES (?, ?, ?, ?, ?)',
+                   [(sid, json.dumps(['http://host/{0}.ts'.format(sid)]), 'stream {0}'.format(sid), None, None)
+                    for sid in range(1, rows + 1)])
+    return db
+
+
+def test_run_resumes_from_checkpoint(tmp_path):
+    db = _make_db(10)
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    written = []
+
+    def crash_on_third(items):
+        if len(written) == 4:
+            raise RuntimeError('crash')
+        written.extend(items)
+
+    engine = MigrationEngine(db, chunk_size=2, checkpoint_path=checkpoint, placeholder='?')
+    with pytest.raises(RuntimeError):
+        engine.run('streams', ['stream_display_name'], lambda rows: rows, crash_on_third)
+
+    engine = MigrationEngine(db, chunk_size=2, checkpoint_path=checkpoint, placeholder='?')
+    stats = engine.run('streams', ['stream_display_name'], lambda rows: rows, written.extend)
+    assert [row['id'] for row in written] == list(range(1, 11))
+    assert stats.rows == 6
+
+
+def test_dry_run_writes_nothing(tmp_path):
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    engine = MigrationEngine(_make_db(3), chunk_size=2, checkpoint_path=checkpoint, dry_run=True, placeholder='?')
+    write = mock.MagicMock()
+    stats = engine.run('streams', ['stream_display_name'], lambda rows: rows, write)
+    assert stats.rows == 3
+    write.assert_not_called()
+    assert not (tmp_path / 'checkpoint.json').exists()
+
+
+def test_make_id_is_stable():
+    assert MigrationEngine.make_id('streams', 1) == MigrationEngine.make_id('streams', 1)
+    assert MigrationEngine.make_id('streams', 1) != MigrationEngine.make_id('streams', 2)
+    assert MigrationEngine.make_id('streams', 1) != MigrationEngine.make_id('users', 1)
+
+
+def test_import_streams_is_idempotent():
+    from pyfastocloud_models.stream.entry import ProxyStream
+    from scripts.migrate.xtream.streams import import_streams_to_server, ServiceSettings
+
+    server = mock.MagicMock()
+    server.streams = []
+    collection = {}
+
+    def bulk_write(operations, ordered=True):
+        for operation in operations:
+            collection[operation._filter['_id']] = operation._doc
+
+    collection_mock = mock.MagicMock()
+    collection_mock.bulk_write.side_effect = bulk_write
+    with mock.patch.object(type(ProxyStream._mongometa), 'collection', new_callable=mock.PropertyMock,
+                           return_value=collection_mock), mock.patch.object(ServiceSettings, 'objects'):
+        engine = MigrationEngine(_make_db(5), chunk_size=2, placeholder='?')
+        import_streams_to_server(engine, server)
+        # a chunk written again after a crash replaces its documents
+        engine = MigrationEngine(_make_db(5), chunk_size=2, placeholder='?')
+        import_streams_to_server(engine, server)
+
+    ids = [stream.pk for stream in server.streams]
+    assert len(ids) == 5
+    assert len(set(ids)) == 5
+    assert sorted(collection.keys()) == sorted(ids)
+    assert [collection[sid]['name'] for sid in ids] == ['stream {0}'.format(sid) for sid in range(1, 6)]